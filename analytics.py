@@ -0,0 +1,64 @@
+# ====================================================================
+# CÁLCULOS ANALÍTICOS PARA EL POOL DE PROCESOS
+# ====================================================================
+# Funciones puras (numpy/pandas, sin Streamlit) que app.py ejecuta en
+# procesos aparte. Viven en su propio módulo para que los procesos del
+# pool las importen por nombre: Streamlit sustituye el módulo __main__
+# en cada rerun y las funciones del script no se pueden serializar.
+# ====================================================================
+
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+def compute_horizon_returns(closes: pd.DataFrame, horizons: Dict[str, Optional[pd.DateOffset]]) -> pd.DataFrame:
+    """
+    Rentabilidades de todos los horizontes para todos los mercados en una pasada
+    
+    Las fechas ancla se buscan todas a la vez con searchsorted sobre el
+    índice de fechas; el cierre de referencia es el último disponible en
+    o antes de cada ancla (los huecos por festivos se rellenan hacia delante).
+    
+    Args:
+        closes: Cierres diarios (filas fechas ordenadas, columnas símbolos, NaN sin sesión)
+        horizons: Etiqueta → desplazamiento ("1D" es el cierre anterior de cada
+            mercado y "YTD" el último cierre del año pasado; ambos con None)
+        
+    Returns:
+        DataFrame símbolos × horizontes con la rentabilidad en %
+    """
+    if closes.empty:
+        return pd.DataFrame(columns=list(horizons.keys()), dtype=float)
+    
+    dates = closes.index.to_numpy(dtype="datetime64[ns]")
+    raw = closes.to_numpy(dtype=float)
+    filled = closes.ffill().to_numpy(dtype=float)
+    last = filled[-1]
+    as_of = closes.index[-1]
+    
+    # Una sola búsqueda binaria para todas las anclas de calendario
+    anchors = {}
+    for label, offset in horizons.items():
+        if label == "YTD":
+            anchors[label] = pd.Timestamp(as_of.year, 1, 1) - pd.Timedelta(days=1)
+        elif offset is not None:
+            anchors[label] = as_of - offset
+    anchor_dates = np.array([anchors[label].to_datetime64() for label in anchors], dtype="datetime64[ns]")
+    rows = np.searchsorted(dates, anchor_dates, side="right") - 1
+    base = np.where((rows >= 0)[:, None], filled[np.clip(rows, 0, None)], np.nan)
+    
+    # 1D: penúltimo cierre propio de cada mercado (no el día anterior del calendario común)
+    valid = ~np.isnan(raw)
+    count = valid.cumsum(axis=0)
+    previous_row = np.argmax(valid & (count == count[-1] - 1), axis=0)
+    previous = np.where(count[-1] >= 2, raw[previous_row, np.arange(raw.shape[1])], np.nan)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        by_anchor = (last / base - 1) * 100
+        one_day = (last / previous - 1) * 100
+    
+    result = pd.DataFrame(by_anchor.T, index=closes.columns, columns=list(anchors))
+    if "1D" in horizons:
+        result["1D"] = one_day
+    return result[list(horizons.keys())]
@@ -11,14 +11,38 @@
 # 2. IMPORTACIÓN DE LIBRERÍAS
 import streamlit as st
 import pandas as pd
+import numpy as np
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
 import requests
 from datetime import datetime, timedelta
 import pytz
 import json
 import time
 import random
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import hashlib
+import pickle
+from collections.abc import Mapping
+from types import MappingProxyType
+import sys
+import os
+import uuid
+import io
+import tempfile
+import atexit
+import zlib
 from typing import Dict, List, Tuple, Optional
+from abc import ABC, abstractmethod
 import logging
+from analytics import compute_horizon_returns
 
 # 3. CONFIGURACIÓN Y VARIABLES GLOBALES
 # ====================================================================
@@ -48,7 +72,9 @@ GLOBAL_MARKETS = {
         "market_close": 16,
         "currency": "USD",
         "description": "Índice de las 500 empresas más importantes de EE.UU.",
-        "base_price": 5800
+        "base_price": 5800,
+        "market_cap": 52000,  # Capitalización aproximada en miles de millones de USD
+        "coordinates": (40.71, -74.01)  # Latitud y longitud de la bolsa
     },
     "^IXIC": {
         "name": "NASDAQ",
@@ -60,7 +86,9 @@ GLOBAL_MARKETS = {
         "market_close": 16,
         "currency": "USD",
         "description": "Índice tecnológico principal de EE.UU.",
-        "base_price": 19500
+        "base_price": 19500,
+        "market_cap": 30000,
+        "coordinates": (40.76, -73.99)
     },
     "^GSPTSE": {
         "name": "TSX",
@@ -72,7 +100,9 @@ GLOBAL_MARKETS = {
         "market_close": 16,
         "currency": "CAD",
         "description": "Índice principal de la bolsa de Toronto",
-        "base_price": 25200
+        "base_price": 25200,
+        "market_cap": 3300,
+        "coordinates": (43.65, -79.38)
     },
     
     # EUROPA
@@ -86,7 +116,9 @@ GLOBAL_MARKETS = {
         "market_close": 16,
         "currency": "GBP",
         "description": "100 empresas más grandes del Reino Unido",
-        "base_price": 8300
+        "base_price": 8300,
+        "market_cap": 2900,
+        "coordinates": (51.51, -0.09)
     },
     "^GDAXI": {
         "name": "DAX",
@@ -98,7 +130,9 @@ GLOBAL_MARKETS = {
         "market_close": 17,
         "currency": "EUR",
         "description": "Índice de las 40 empresas principales de Alemania",
-        "base_price": 21400
+        "base_price": 21400,
+        "market_cap": 2300,
+        "coordinates": (50.11, 8.68)
     },
     "^FCHI": {
         "name": "CAC 40",
@@ -110,7 +144,9 @@ GLOBAL_MARKETS = {
         "market_close": 17,
         "currency": "EUR",
         "description": "40 empresas más importantes de Francia",
-        "base_price": 7520
+        "base_price": 7520,
+        "market_cap": 2600,
+        "coordinates": (48.87, 2.34)
     },
     "^IBEX": {
         "name": "IBEX 35",
@@ -122,7 +158,9 @@ GLOBAL_MARKETS = {
         "market_close": 17,
         "currency": "EUR",
         "description": "35 empresas principales de España",
-        "base_price": 12150
+        "base_price": 12150,
+        "market_cap": 850,
+        "coordinates": (40.42, -3.7)
     },
     
     # ASIA-PACÍFICO
@@ -136,7 +174,9 @@ GLOBAL_MARKETS = {
         "market_close": 15,
         "currency": "JPY", 
         "description": "225 empresas principales de Japón",
-        "base_price": 39700
+        "base_price": 39700,
+        "market_cap": 4200,
+        "coordinates": (35.68, 139.77)
     },
     "000001.SS": {
         "name": "Shanghai Composite",
@@ -148,7 +188,9 @@ GLOBAL_MARKETS = {
         "market_close": 15,
         "currency": "CNY",
         "description": "Índice compuesto de Shanghai",
-        "base_price": 3320
+        "base_price": 3320,
+        "market_cap": 7500,
+        "coordinates": (31.23, 121.49)
     },
     "^HSI": {
         "name": "Hang Seng",
@@ -160,7 +202,9 @@ GLOBAL_MARKETS = {
         "market_close": 16,
         "currency": "HKD",
         "description": "Índice principal de Hong Kong",
-        "base_price": 19750
+        "base_price": 19750,
+        "market_cap": 3200,
+        "coordinates": (22.28, 114.16)
     },
     "^AXJO": {
         "name": "ASX 200",
@@ -172,7 +216,9 @@ GLOBAL_MARKETS = {
         "market_close": 16,
         "currency": "AUD",
         "description": "200 empresas principales de Australia",
-        "base_price": 8420
+        "base_price": 8420,
+        "market_cap": 1800,
+        "coordinates": (-33.87, 151.21)
     },
     
     # AMÉRICA LATINA
@@ -186,7 +232,9 @@ GLOBAL_MARKETS = {
         "market_close": 17,
         "currency": "BRL",
         "description": "Índice principal de Brasil",
-        "base_price": 122800
+        "base_price": 122800,
+        "market_cap": 700,
+        "coordinates": (-23.55, -46.63)
     },
     "^MXX": {
         "name": "IPC",
@@ -198,7 +246,9 @@ GLOBAL_MARKETS = {
         "market_close": 15,
         "currency": "MXN",
         "description": "Índice de Precios y Cotizaciones de México",
-        "base_price": 55800
+        "base_price": 55800,
+        "market_cap": 350,
+        "coordinates": (19.43, -99.13)
     }
 }
 
@@ -213,88 +263,632 @@ WEATHER_EMOJIS = {
     "strong_loss": "🌩️"      # Pérdida fuerte (<-2.5%)
 }
 
+# Distribución geográfica del mapa mundial: (región, filas de (símbolo, peso))
+WORLD_MAP_LAYOUT = [
+    ("🌏 Asia-Pacífico", [
+        [(None, 1), ("^N225", 2), ("000001.SS", 2), ("^HSI", 2), ("^AXJO", 1)]
+    ]),
+    ("🌍 Europa", [
+        [("^FTSE", 1), ("^GDAXI", 1), ("^FCHI", 1), ("^IBEX", 1)]
+    ]),
+    ("🌎 Américas", [
+        [("^GSPC", 2), ("^IXIC", 2), ("^GSPTSE", 1), ("^BVSP", 2)],
+        [(None, 2), ("^MXX", 1), (None, 2)]  # México centrado
+    ])
+]
+
+# Hoja de estilos compartida por tarjetas y heatmap (se envía una vez por rerun)
+MARKET_CARDS_CSS = """
+<style>
+.mk-grid { display: grid; gap: 1rem; margin-bottom: 0.5rem; }
+.mk-mini {
+    border: 2px solid; border-radius: 10px; padding: 15px; text-align: center;
+    margin: 5px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+}
+.mk-mini .mk-weather { font-size: 24px; margin-bottom: 5px; }
+.mk-mini .mk-name { font-size: 16px; font-weight: bold; margin-bottom: 3px; }
+.mk-mini .mk-country { font-size: 14px; color: #666; margin-bottom: 5px; }
+.mk-mini .mk-change { font-size: 18px; font-weight: bold; }
+.mk-mini .mk-status { font-size: 12px; margin-top: 5px; }
+.mk-mini .mk-spark { display: block; margin: 5px auto 0; }
+.mk-heat { border-left: 4px solid; padding: 10px; margin: 5px 0; border-radius: 5px; }
+.mk-heat .mk-change { font-weight: bold; }
+.mk-card { border-left: 4px solid; padding: 15px; margin: 10px 0; background-color: #f8f9fa; border-radius: 5px; }
+.mk-card h4 { margin: 0 0 10px 0; }
+.mk-card p { margin: 0; color: #666; font-size: 14px; }
+.mk-mini.gain, .mk-heat.gain { background-color: #d4edda; }
+.mk-mini.loss, .mk-heat.loss { background-color: #f8d7da; }
+.mk-mini.flat, .mk-heat.flat { background-color: #e2e3e5; }
+.mk-mini.gain, .mk-heat.gain, .mk-card.gain { border-color: #28a745; }
+.mk-mini.loss, .mk-heat.loss, .mk-card.loss { border-color: #dc3545; }
+.mk-mini.flat, .mk-heat.flat, .mk-card.flat { border-color: #6c757d; }
+.mk-mini.gain .mk-change, .mk-heat.gain .mk-change { color: #28a745; }
+.mk-mini.loss .mk-change, .mk-heat.loss .mk-change { color: #dc3545; }
+.mk-mini.flat .mk-change, .mk-heat.flat .mk-change { color: #6c757d; }
+.mk-mini.pending { opacity: 0.6; border-style: dashed; }
+</style>
+"""
+
 # 4. FUNCIONES PRINCIPALES
 # ====================================================================
 
-@st.cache_data(ttl=300)  # Cache por 5 minutos
-def fetch_market_data_yahoo_api(symbol: str) -> Optional[Dict]:
+# Proveedores de datos de mercado
+# --------------------------------------------------------------------
+
+YAHOO_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept-Encoding': 'gzip, deflate'
+}
+
+# Proveedor principal: "yahoo", "file" o "simulation"
+MARKET_DATA_PROVIDER = os.environ.get("MARKET_DATA_PROVIDER", "yahoo")
+
+# Hosts de Yahoo Finance: el primero es el principal, el resto se usan como cobertura
+YAHOO_HOSTS = os.environ.get(
+    "YAHOO_HOSTS", "query1.finance.yahoo.com,query2.finance.yahoo.com"
+).split(",")
+
+# Fichero JSON del proveedor local
+MARKET_DATA_FILE = os.environ.get("MARKET_DATA_FILE", "market_data.json")
+
+# Espera antes de cubrir la petición mientras no hay latencias suficientes
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_SAMPLES = 20
+
+def yahoo_base_url(host: str) -> str:
+    """
+    URL base de un host de Yahoo (admite "http://..." para servidores stub locales)
+    """
+    return host.rstrip("/") if "://" in host else f"https://{host}"
+
+def parse_yahoo_chart(symbol: str, data: Dict) -> Optional[Dict]:
     """
-    Intenta obtener datos reales de Yahoo Finance API
+    Convierte la respuesta del endpoint chart de Yahoo en datos de mercado
     
     Args:
-        symbol: Símbolo del índice (ej: ^GSPC)
+        symbol: Símbolo del índice
+        data: JSON devuelto por /v8/finance/chart
         
     Returns:
-        Diccionario con datos del mercado o None si hay error
+        Diccionario con datos del mercado o None si la respuesta no es válida
     """
-    try:
-        # Intentar Yahoo Finance API pública
-        url = f"https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
+    if 'chart' in data and 'result' in data['chart'] and data['chart']['result']:
+        result = data['chart']['result'][0]
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
+        if 'meta' in result:
+            meta = result['meta']
+            
+            # Obtener precios
+            current_price = meta.get('regularMarketPrice')
+            previous_close = meta.get('previousClose')
+            volume = meta.get('regularMarketVolume', 0)
             
-            if 'chart' in data and 'result' in data['chart'] and data['chart']['result']:
-                result = data['chart']['result'][0]
+            # Si no hay precio actual, usar datos históricos
+            if not current_price and 'indicators' in result:
+                quotes = result['indicators']['quote'][0]
+                closes = quotes.get('close', [])
+                valid_closes = [c for c in closes if c is not None]
+                if valid_closes:
+                    current_price = valid_closes[-1]
+                    if len(valid_closes) > 1:
+                        previous_close = valid_closes[-2]
+            
+            if current_price and previous_close and previous_close > 0:
+                change_percent = ((current_price - previous_close) / previous_close) * 100
                 
-                if 'meta' in result:
-                    meta = result['meta']
-                    
-                    # Obtener precios
-                    current_price = meta.get('regularMarketPrice')
-                    previous_close = meta.get('previousClose')
-                    volume = meta.get('regularMarketVolume', 0)
-                    
-                    # Si no hay precio actual, usar datos históricos
-                    if not current_price and 'indicators' in result:
-                        quotes = result['indicators']['quote'][0]
-                        closes = quotes.get('close', [])
-                        valid_closes = [c for c in closes if c is not None]
-                        if valid_closes:
-                            current_price = valid_closes[-1]
-                            if len(valid_closes) > 1:
-                                previous_close = valid_closes[-2]
+                # Calcular MA50 si hay suficientes datos
+                ma50 = None
+                ma50_trend = "neutral"
+                
+                if 'indicators' in result and 'quote' in result['indicators']:
+                    quotes = result['indicators']['quote'][0]
+                    closes = quotes.get('close', [])
+                    valid_closes = [c for c in closes if c is not None]
                     
-                    if current_price and previous_close and previous_close > 0:
-                        change_percent = ((current_price - previous_close) / previous_close) * 100
-                        
-                        # Calcular MA50 si hay suficientes datos
-                        ma50 = None
-                        ma50_trend = "neutral"
-                        
-                        if 'indicators' in result and 'quote' in result['indicators']:
-                            quotes = result['indicators']['quote'][0]
-                            closes = quotes.get('close', [])
-                            valid_closes = [c for c in closes if c is not None]
-                            
-                            if len(valid_closes) >= 50:
-                                ma50 = sum(valid_closes[-50:]) / 50
-                                ma50_trend = "alcista" if current_price > ma50 else "bajista"
-                        
-                        return {
-                            "symbol": symbol,
-                            "current_price": round(float(current_price), 2),
-                            "previous_close": round(float(previous_close), 2),
-                            "change_percent": round(float(change_percent), 2),
-                            "change_absolute": round(float(current_price - previous_close), 2),
-                            "volume": int(volume) if volume else 0,
-                            "ma50": round(float(ma50), 2) if ma50 else None,
-                            "ma50_trend": ma50_trend,
-                            "last_updated": datetime.now().strftime("%H:%M:%S"),
-                            "data_source": "🟢 Yahoo Finance API"
-                        }
-        
-    except Exception as e:
-        logger.warning(f"Error con Yahoo API para {symbol}: {str(e)}")
+                    if len(valid_closes) >= 50:
+                        ma50 = sum(valid_closes[-50:]) / 50
+                        ma50_trend = "alcista" if current_price > ma50 else "bajista"
+                
+                return {
+                    "symbol": symbol,
+                    "current_price": round(float(current_price), 2),
+                    "previous_close": round(float(previous_close), 2),
+                    "change_percent": round(float(change_percent), 2),
+                    "change_absolute": round(float(current_price - previous_close), 2),
+                    "volume": int(volume) if volume else 0,
+                    "ma50": round(float(ma50), 2) if ma50 else None,
+                    "ma50_trend": ma50_trend,
+                    "last_updated": datetime.now().strftime("%H:%M:%S"),
+                    "timestamp": int(meta.get('regularMarketTime') or time.time()),
+                    "sparkline": build_intraday_sparkline(symbol, result),
+                    "data_source": "🟢 Yahoo Finance API"
+                }
     
     return None
 
+class LatencyTracker:
+    """
+    Ventana de latencias recientes de un proveedor
+    """
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Percentil q (0-100) de las latencias registradas, None si no hay datos
+        """
+        with self._lock:
+            if not self._samples:
+                return None
+            return float(np.percentile(self._samples, q))
+
+class MarketDataProvider(ABC):
+    """
+    Interfaz común de los proveedores de datos de mercado
+
+    Las subclases implementan _fetch(); fetch_quote() mide la latencia de
+    las llamadas que obtienen datos para alimentar la cobertura (los
+    errores rápidos y los timeouts no representan al servidor sano). Las
+    barras intradía se piden con fetch_intraday_bars() y no cuentan en esas
+    estadísticas: son respuestas mucho mayores que una cotización.
+    """
+
+    name = "base"
+    data_source = "base"
+
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self._counter_lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def fetch_quote(self, symbol: str) -> Optional[Dict]:
+        """
+        Obtiene los datos de un símbolo
+
+        Args:
+            symbol: Símbolo del índice
+
+        Returns:
+            Diccionario con datos del mercado o None si hay error
+        """
+        start = time.perf_counter()
+        try:
+            result = self._fetch(symbol)
+        except Exception as e:
+            logger.warning(f"Error con {self.name} para {symbol}: {str(e)}")
+            result = None
+
+        with self._counter_lock:
+            self.requests += 1
+            if result is None:
+                self.failures += 1
+        if result is not None:
+            self.latency.record(time.perf_counter() - start)
+        return result
+
+    @abstractmethod
+    def _fetch(self, symbol: str) -> Optional[Dict]:
+        """
+        Obtiene los datos de un símbolo (puede lanzar excepciones)
+        """
+
+    def fetch_intraday_bars(self, symbol: str) -> Optional[pd.DataFrame]:
+        """
+        Obtiene las barras de 1 minuto de los últimos días de un símbolo
+
+        Args:
+            symbol: Símbolo del índice
+
+        Returns:
+            DataFrame con OHLC_COLUMNS indexado por hora UTC, o None si el
+            proveedor no tiene barras o hay error
+        """
+        try:
+            bars = self._fetch_intraday_bars(symbol)
+        except Exception as e:
+            logger.warning(f"Error con {self.name} en barras de {symbol}: {str(e)}")
+            return None
+        return bars if bars is not None and not bars.empty else None
+
+    @abstractmethod
+    def _fetch_intraday_bars(self, symbol: str) -> Optional[pd.DataFrame]:
+        """
+        Obtiene las barras intradía de un símbolo (puede lanzar excepciones)
+        """
+
+    def stats(self) -> Dict:
+        with self._counter_lock:
+            requests_made, failures = self.requests, self.failures
+        return {
+            "provider": self.name,
+            "requests": requests_made,
+            "failures": failures,
+            "p95": self.latency.percentile(95)
+        }
+
+class YahooProvider(MarketDataProvider):
+    """
+    API pública de Yahoo Finance en un host concreto
+
+    Las peticiones van comprimidas y son condicionales (If-None-Match /
+    If-Modified-Since) cuando el servidor da validadores. Además se guarda
+    un hash del contenido por símbolo: si la respuesta es idéntica a la
+    anterior se devuelve la cotización ya procesada sin volver a parsearla.
+
+    requests.Session no es thread-safe, así que cada hilo del pool usa su
+    propia sesión (con su propio pool de conexiones keep-alive).
+    """
+
+    def __init__(self, host: str, timeout: float = 10):
+        super().__init__()
+        self.host = host
+        self.timeout = timeout
+        self.name = f"Yahoo ({host})"
+        self.data_source = "🟢 Yahoo Finance API"
+        self._local = threading.local()
+        self._last: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.responses = 0
+        self.not_modified = 0
+        self.unchanged = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+    def _session(self) -> requests.Session:
+        """
+        Sesión HTTP del hilo actual (se crea la primera vez que se usa)
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(YAHOO_HEADERS)
+            self._local.session = session
+        return session
+
+    def _fetch(self, symbol: str) -> Optional[Dict]:
+        url = f"{yahoo_base_url(self.host)}/v8/finance/chart/{symbol}"
+        with self._lock:
+            last = self._last.get(symbol)
+
+        headers = {}
+        if last is not None and last["etag"]:
+            headers["If-None-Match"] = last["etag"]
+        if last is not None and last["last_modified"]:
+            headers["If-Modified-Since"] = last["last_modified"]
+
+        response = self._session().get(url, headers=headers, timeout=self.timeout)
+        with self._lock:
+            self.responses += 1
+            # tell(): bytes leídos del socket (comprimidos); content: ya descomprimido
+            self.wire_bytes += response.raw.tell() if response.raw is not None else len(response.content)
+            self.decoded_bytes += len(response.content)
+
+        if response.status_code == 304 and last is not None:
+            with self._lock:
+                self.not_modified += 1
+            return dict(last["quote"])
+        if response.status_code != 200:
+            return None
+
+        digest = hashlib.blake2b(response.content, digest_size=16).digest()
+        if last is not None and digest == last["digest"]:
+            with self._lock:
+                self.unchanged += 1
+            quote = last["quote"]
+        else:
+            quote = parse_yahoo_chart(symbol, response.json())
+            if quote is None:
+                return None
+
+        with self._lock:
+            self._last[symbol] = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "digest": digest,
+                "quote": quote
+            }
+        return dict(quote)
+
+    def _fetch_intraday_bars(self, symbol: str) -> Optional[pd.DataFrame]:
+        response = self._session().get(
+            f"{yahoo_base_url(self.host)}/v8/finance/chart/{symbol}",
+            params={"interval": INTRADAY_BASE_INTERVAL, "range": INTRADAY_RANGE},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return parse_yahoo_intraday_bars(response.json())
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self._lock:
+            stats.update(
+                responses=self.responses,
+                not_modified=self.not_modified,
+                unchanged=self.unchanged,
+                wire_bytes=self.wire_bytes,
+                decoded_bytes=self.decoded_bytes
+            )
+        return stats
+
+class FileProvider(MarketDataProvider):
+    """
+    Proveedor local: lee un JSON {símbolo: datos} o {símbolo: respuesta chart}
+
+    Las barras intradía salen de la clave opcional "intraday" de cada
+    símbolo, con una respuesta chart de interval=1m.
+    """
+
+    data_source = "🟢 Archivo local"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.name = f"Archivo ({path})"
+
+    def _entry(self, symbol: str) -> Optional[Dict]:
+        with open(self.path, encoding="utf-8") as handle:
+            return json.load(handle).get(symbol)
+
+    def _fetch_intraday_bars(self, symbol: str) -> Optional[pd.DataFrame]:
+        entry = self._entry(symbol)
+        if not entry or "intraday" not in entry:
+            return None
+        return parse_yahoo_intraday_bars(entry["intraday"])
+
+    def _fetch(self, symbol: str) -> Optional[Dict]:
+        entry = self._entry(symbol)
+        if not entry:
+            return None
+        if "chart" in entry:
+            return parse_yahoo_chart(symbol, entry)
+
+        current_price = float(entry["current_price"])
+        previous_close = float(entry["previous_close"])
+        ma50 = entry.get("ma50")
+        return {
+            "symbol": symbol,
+            "current_price": round(current_price, 2),
+            "previous_close": round(previous_close, 2),
+            "change_percent": round((current_price - previous_close) / previous_close * 100, 2),
+            "change_absolute": round(current_price - previous_close, 2),
+            "volume": int(entry.get("volume", 0)),
+            "ma50": round(float(ma50), 2) if ma50 else None,
+            "ma50_trend": ("alcista" if current_price > ma50 else "bajista") if ma50 else "neutral",
+            "last_updated": datetime.now().strftime("%H:%M:%S"),
+            "timestamp": int(entry.get("timestamp", time.time())),
+            "data_source": self.data_source
+        }
+
+class SimulationProvider(MarketDataProvider):
+    """
+    Datos simulados realistas (siempre responde)
+    """
+
+    name = "Simulación"
+    data_source = "🟡 Simulación Realista"
+
+    def _fetch(self, symbol: str) -> Optional[Dict]:
+        if symbol not in GLOBAL_MARKETS:
+            return None
+        return generate_realistic_market_data(symbol, GLOBAL_MARKETS[symbol])
+
+    def _fetch_intraday_bars(self, symbol: str) -> Optional[pd.DataFrame]:
+        if symbol not in GLOBAL_MARKETS:
+            return None
+        return generate_intraday_bars(symbol)
+
+class HedgedProvider(MarketDataProvider):
+    """
+    Petición cubierta entre varios hosts: se pregunta al primero y, si no
+    responde dentro de su p95 observado, se lanza la misma petición al
+    siguiente, y así sucesivamente; gana la primera respuesta válida.
+
+    Todos los hosts cuelgan de un único nivel: las tareas enviadas al pool
+    son peticiones simples que nunca esperan a otras tareas del mismo pool.
+    Las barras intradía se cubren igual, con el mismo umbral por host.
+    """
+
+    def __init__(self, providers: List[MarketDataProvider], executor: ThreadPoolExecutor):
+        super().__init__()
+        self.providers = list(providers)
+        self.executor = executor
+        self.name = " ⇄ ".join(provider.name for provider in self.providers)
+        self.data_source = self.providers[0].data_source
+        self.hedges = 0
+        self.secondary_wins = 0
+
+    def hedge_delay(self, provider: Optional[MarketDataProvider] = None) -> float:
+        """
+        Umbral de cobertura: p95 del host (el principal por defecto), o el
+        valor por defecto sin historial
+        """
+        provider = provider or self.providers[0]
+        if len(provider.latency) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return provider.latency.percentile(95)
+
+    def _fetch(self, symbol: str) -> Optional[Dict]:
+        return self._hedge("fetch_quote", symbol)
+
+    def _fetch_intraday_bars(self, symbol: str) -> Optional[pd.DataFrame]:
+        return self._hedge("fetch_intraday_bars", symbol)
+
+    def _hedge(self, method: str, symbol: str):
+        """
+        Lanza provider.<method>(symbol) host a host hasta obtener un resultado
+
+        Args:
+            method: "fetch_quote" o "fetch_intraday_bars"
+            symbol: Símbolo del índice
+
+        Returns:
+            El primer resultado no nulo, o None si todos los hosts fallan
+        """
+        pending, levels = set(), {}
+        for level, provider in enumerate(self.providers):
+            if level > 0:
+                # El host anterior tarda (o falló): cubrir con el siguiente
+                with self._counter_lock:
+                    self.hedges += 1
+            launched = self.executor.submit(getattr(provider, method), symbol)
+            levels[launched] = level
+            pending.add(launched)
+
+            last = level == len(self.providers) - 1
+            deadline = time.monotonic() + self.hedge_delay(provider)
+            while pending:
+                timeout = None if last else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    break
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if result is not None:
+                        if levels[future] > 0:
+                            with self._counter_lock:
+                                self.secondary_wins += 1
+                        return result
+                if launched in done and not last:
+                    # El host recién lanzado falló: pasar ya al siguiente
+                    break
+        return None
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self._counter_lock:
+            hedges, secondary_wins = self.hedges, self.secondary_wins
+        stats.update(
+            hedge_delay=self.hedge_delay(),
+            hedges=hedges,
+            secondary_wins=secondary_wins,
+            providers=[provider.stats() for provider in self.providers]
+        )
+        return stats
+
+def build_data_provider(kind: str, executor: ThreadPoolExecutor) -> MarketDataProvider:
+    """
+    Construye el proveedor configurado
+
+    Args:
+        kind: "yahoo", "file" o "simulation"
+        executor: Pool de hilos para las peticiones cubiertas
+
+    Returns:
+        Proveedor listo para usar
+    """
+    if kind == "file":
+        return FileProvider(MARKET_DATA_FILE)
+    if kind == "simulation":
+        return SimulationProvider()
+
+    providers = [YahooProvider(host.strip()) for host in YAHOO_HOSTS if host.strip()]
+    if len(providers) == 1:
+        return providers[0]
+    # Coberturas en un solo nivel: query1 ⇄ query2 ⇄ ...
+    return HedgedProvider(providers, executor)
+
+@st.cache_resource
+def get_data_provider() -> MarketDataProvider:
+    """
+    Proveedor de datos compartido por todas las sesiones del proceso
+    """
+    return build_data_provider(MARKET_DATA_PROVIDER, ThreadPoolExecutor(max_workers=8))
+
+# Contadores de transferencia de YahooProvider (se suman en las coberturas)
+TRANSFER_COUNTERS = ("responses", "not_modified", "unchanged", "wire_bytes", "decoded_bytes")
+
+def provider_transfer_stats(stats: Dict) -> Dict:
+    """
+    Suma los contadores de transferencia de un proveedor y sus coberturas
+    
+    Args:
+        stats: Resultado de MarketDataProvider.stats()
+        
+    Returns:
+        Diccionario con los TRANSFER_COUNTERS sumados y la tasa de respuestas
+        que no hubo que procesar (304 o contenido idéntico)
+    """
+    totals = {counter: stats.get(counter, 0) for counter in TRANSFER_COUNTERS}
+    for nested in stats.get("providers", []):
+        for counter, value in provider_transfer_stats(nested).items():
+            if counter in totals:
+                totals[counter] += value
+    skipped = totals["not_modified"] + totals["unchanged"]
+    totals["skip_rate"] = skipped / totals["responses"] if totals["responses"] else None
+    return totals
+
+# Vida de una cotización en cache con el mercado abierto; cerrado dura hasta la apertura
+OPEN_MARKET_TTL = 60
+
+# Tope de vida de cualquier entrada (cubre fines de semana largos) para que
+# las claves de expiración antiguas acaben saliendo del cache
+QUOTE_CACHE_MAX_AGE = 4 * 24 * 3600
+
+class QuoteUnavailableError(Exception):
+    """
+    El proveedor no devolvió cotización; al lanzarse no queda en el cache
+    """
+
+def get_quote_expiry(symbol: str, now: Optional[float] = None) -> int:
+    """
+    Calcula cuándo caduca la cotización en cache de un símbolo
+    
+    Con el mercado abierto caduca en el siguiente múltiplo de OPEN_MARKET_TTL;
+    cerrado, en su próxima apertura. El valor se usa como parte de la clave
+    del cache, así que todas las sesiones comparten la misma entrada.
+    
+    Args:
+        symbol: Símbolo del índice
+        now: Momento actual en epoch (por defecto time.time())
+        
+    Returns:
+        Epoch en segundos en el que caduca la cotización
+    """
+    now = time.time() if now is None else now
+    market_info = GLOBAL_MARKETS[symbol]
+    status = get_market_status(
+        market_info["timezone"],
+        market_info["market_open"],
+        market_info["market_close"]
+    )
+    
+    if not status["is_open"] and status["next_open"] is not None:
+        return int(status["next_open"].timestamp())
+    
+    return (int(now) // OPEN_MARKET_TTL + 1) * OPEN_MARKET_TTL
+
+@st.cache_data(ttl=QUOTE_CACHE_MAX_AGE, max_entries=4 * len(GLOBAL_MARKETS), show_spinner=False)
+def fetch_market_data_from_provider(symbol: str, expires_at: int) -> Optional[Dict]:
+    """
+    Intenta obtener datos reales del proveedor configurado
+    
+    Args:
+        symbol: Símbolo del índice (ej: ^GSPC)
+        expires_at: Caducidad de la cotización (ver get_quote_expiry), solo clave de cache
+        
+    Returns:
+        Diccionario con datos del mercado
+        
+    Raises:
+        QuoteUnavailableError: si el proveedor falla (el fallo no se cachea
+            hasta la apertura, se reintenta en el siguiente refresco)
+    """
+    time.sleep(0.1)  # Pequeña pausa para evitar rate limiting (solo sin cache)
+    quote = get_data_provider().fetch_quote(symbol)
+    if quote is None:
+        raise QuoteUnavailableError(symbol)
+    return quote
+
 def generate_realistic_market_data(symbol: str, market_info: Dict) -> Dict:
     """
     Genera datos realistas basados en patrones reales de mercado
@@ -353,6 +947,7 @@ def generate_realistic_market_data(symbol: str, market_info: Dict) -> Dict:
         "ma50": round(ma50, 2),
         "ma50_trend": ma50_trend,
         "last_updated": datetime.now().strftime("%H:%M:%S"),
+        "timestamp": int(time.time()),
         "data_source": "🟡 Simulación Realista"
     }
 
@@ -372,9 +967,10 @@ def fetch_market_data(symbol: str) -> Optional[Dict]:
     market_info = GLOBAL_MARKETS[symbol]
     
     # Intentar obtener datos reales primero
-    real_data = fetch_market_data_yahoo_api(symbol)
-    if real_data:
-        return real_data
+    try:
+        return fetch_market_data_from_provider(symbol, get_quote_expiry(symbol))
+    except QuoteUnavailableError:
+        pass
     
     # Si no se pueden obtener datos reales, generar datos realistas
     return generate_realistic_market_data(symbol, market_info)
@@ -431,12 +1027,27 @@ def get_market_status(timezone_str: str, market_open: int, market_close: int) ->
         else:
             status = "Cerrado"
             is_open = False
+        
+        # Próxima apertura: hoy si aún no ha abierto, si no el siguiente día hábil
+        # (localize() respeta los cambios de horario de verano)
+        open_day = local_time.date()
+        if is_weekend or current_hour >= market_open:
+            open_day += timedelta(days=1)
+        while open_day.weekday() >= 5:
+            open_day += timedelta(days=1)
+        next_open = tz.localize(datetime(open_day.year, open_day.month, open_day.day, market_open))
+        
+        next_close = None
+        if is_open:
+            next_close = tz.localize(datetime(local_time.year, local_time.month, local_time.day, market_close))
             
         return {
             "is_open": is_open,
             "status": status,
             "local_time": local_time.strftime("%H:%M"),
-            "local_date": local_time.strftime("%d/%m/%Y")
+            "local_date": local_time.strftime("%d/%m/%Y"),
+            "next_open": next_open,
+            "next_close": next_close
         }
         
     except Exception as e:
@@ -445,7 +1056,9 @@ def get_market_status(timezone_str: str, market_open: int, market_close: int) ->
             "is_open": False,
             "status": "Error",
             "local_time": "N/A",
-            "local_date": "N/A"
+            "local_date": "N/A",
+            "next_open": None,
+            "next_close": None
         }
 
 def format_number(number: float, currency: str = "") -> str:
@@ -466,84 +1079,43 @@ def format_number(number: float, currency: str = "") -> str:
     else:
         return f"{number:.2f} {currency}".strip()
 
-def create_world_map_visualization(market_data: Dict) -> None:
+def create_world_map_visualization(market_data: Dict, pending: frozenset = frozenset()) -> None:
     """
     Crea mapa mundial visual interactivo con vista rápida de todos los mercados
     
     Args:
         market_data: Diccionario con datos de todos los mercados
+        pending: Mercados cuya cotización aún no ha llegado
     """
     st.markdown("### 🗺️ Mapa Mundial de Mercados Financieros")
     st.markdown("#### 🌍 Vista Global de un Solo Vistazo")
     
-    # Crear el mapa mundial usando columnas y diseño geográfico
-    # Organizar mercados por ubicación geográfica aproximada
-    
-    # Fila 1: Asia-Pacífico (arriba)
-    st.markdown("##### 🌏 Asia-Pacífico")
-    asia_cols = st.columns([1, 2, 2, 2, 1])
-    
-    with asia_cols[1]:  # Japón
-        if "^N225" in market_data and market_data["^N225"]:
-            create_mini_market_card("^N225", market_data["^N225"])
-    
-    with asia_cols[2]:  # China/Shanghai
-        if "000001.SS" in market_data and market_data["000001.SS"]:
-            create_mini_market_card("000001.SS", market_data["000001.SS"])
-    
-    with asia_cols[3]:  # Hong Kong
-        if "^HSI" in market_data and market_data["^HSI"]:
-            create_mini_market_card("^HSI", market_data["^HSI"])
-    
-    with asia_cols[4]:  # Australia
-        if "^AXJO" in market_data and market_data["^AXJO"]:
-            create_mini_market_card("^AXJO", market_data["^AXJO"])
-    
-    st.markdown("---")
-    
-    # Fila 2: Europa (centro)
-    st.markdown("##### 🌍 Europa")
-    europe_cols = st.columns(4)
-    
-    european_markets = ["^FTSE", "^GDAXI", "^FCHI", "^IBEX"]
-    for idx, symbol in enumerate(european_markets):
-        with europe_cols[idx]:
-            if symbol in market_data and market_data[symbol]:
-                create_mini_market_card(symbol, market_data[symbol])
-    
-    st.markdown("---")
-    
-    # Fila 3: Américas (abajo)
-    st.markdown("##### 🌎 Américas")
-    americas_cols = st.columns([2, 2, 1, 2])
-    
-    with americas_cols[0]:  # Estados Unidos (S&P 500)
-        if "^GSPC" in market_data and market_data["^GSPC"]:
-            create_mini_market_card("^GSPC", market_data["^GSPC"])
-    
-    with americas_cols[1]:  # Estados Unidos (NASDAQ)
-        if "^IXIC" in market_data and market_data["^IXIC"]:
-            create_mini_market_card("^IXIC", market_data["^IXIC"])
-    
-    with americas_cols[2]:  # Canadá
-        if "^GSPTSE" in market_data and market_data["^GSPTSE"]:
-            create_mini_market_card("^GSPTSE", market_data["^GSPTSE"])
-    
-    with americas_cols[3]:  # Brasil
-        if "^BVSP" in market_data and market_data["^BVSP"]:
-            create_mini_market_card("^BVSP", market_data["^BVSP"])
-    
-    # México en una fila separada centrada
-    mexico_col = st.columns([2, 1, 2])
-    with mexico_col[1]:
-        if "^MXX" in market_data and market_data["^MXX"]:
-            create_mini_market_card("^MXX", market_data["^MXX"])
-    
-    st.markdown("---")
+    # Crear el mapa mundial con una rejilla HTML por fila geográfica
+    # (cada región se envía al navegador en una sola llamada)
+    for title, rows in WORLD_MAP_LAYOUT:
+        st.markdown(f"##### {title}")
+        
+        region_html = []
+        for cells in rows:
+            row_cells = []
+            for symbol, weight in cells:
+                card_html = ""
+                if symbol and symbol in market_data and market_data[symbol]:
+                    card_html = create_mini_market_card(symbol, market_data[symbol])
+                elif symbol and symbol in market_data and symbol in pending:
+                    card_html = render_pending_card_html(symbol)
+                row_cells.append((card_html, weight))
+            region_html.append(render_card_grid(row_cells))
+        
+        st.markdown("".join(region_html), unsafe_allow_html=True)
+        st.markdown("---")
     
     # Resumen visual global
     create_global_heatmap(market_data)
     
+    # Evolución del día, reproducible fotograma a fotograma
+    create_timelapse_panel()
+    
     # Organizar por continentes para vista detallada
     continents = {}
     for symbol, market_info in GLOBAL_MARKETS.items():
@@ -554,7 +1126,6 @@ def create_world_map_visualization(market_data: Dict) -> None:
         # Agregar datos del mercado si están disponibles
         if symbol in market_data and market_data[symbol]:
             data = market_data[symbol]
-            weather_emoji = get_weather_emoji(data["change_percent"])
             market_status = get_market_status(
                 market_info["timezone"],
                 market_info["market_open"], 
@@ -565,7 +1136,6 @@ def create_world_map_visualization(market_data: Dict) -> None:
                 "symbol": symbol,
                 "info": market_info,
                 "data": data,
-                "weather": weather_emoji,
                 "status": market_status
             })
     
@@ -587,54 +1157,146 @@ def create_world_map_visualization(market_data: Dict) -> None:
         
         st.markdown("---")
 
-def create_mini_market_card(symbol: str, data: Dict) -> None:
+def get_performance_tone(change_percent: float) -> str:
+    """
+    Clase CSS según el signo del rendimiento
+    
+    Args:
+        change_percent: Cambio porcentual del índice
+        
+    Returns:
+        "gain", "loss" o "flat"
+    """
+    if change_percent > 0:
+        return "gain"
+    elif change_percent < 0:
+        return "loss"
+    return "flat"
+
+def current_minute() -> str:
+    """
+    Minuto actual, usado como parte de la clave de cache de los fragmentos
+    """
+    return datetime.now().strftime("%Y%m%d%H%M")
+
+def render_card_grid(cells: List[Tuple[str, int]]) -> str:
+    """
+    Une varias tarjetas en una sola rejilla HTML
+    
+    Args:
+        cells: Lista de (fragmento HTML, peso de la columna)
+        
+    Returns:
+        Bloque HTML listo para un único st.markdown
+    """
+    columns = " ".join(f"{weight}fr" for _, weight in cells)
+    body = "".join(f'<div class="mk-cell">{html}</div>' for html, _ in cells)
+    return f'<div class="mk-grid" style="grid-template-columns: {columns};">{body}</div>'
+
+@st.cache_data(max_entries=2048, show_spinner=False)
+def render_mini_card_html(symbol: str, change_bucket: float, is_open: bool, minute: str,
+                          sparkline: Tuple[float, ...] = (), pending: bool = False) -> str:
+    """
+    Fragmento HTML de una tarjeta mini, cacheado por símbolo, cambio, estado y minuto
+    
+    Args:
+        symbol: Símbolo del mercado
+        change_bucket: Cambio porcentual redondeado a la precisión mostrada
+        is_open: Si el mercado está abierto
+        minute: Minuto actual (la hora local se muestra con precisión de minuto)
+        sparkline: Precios intradía ya reducidos
+        pending: Si es el último valor conocido a la espera de la cotización nueva
+        
+    Returns:
+        HTML de la tarjeta
+    """
+    info = GLOBAL_MARKETS[symbol]
+    weather = get_weather_emoji(change_bucket)
+    status = get_market_status(info["timezone"], info["market_open"], info["market_close"])
+    status_emoji = "🟢" if is_open else "🔴"
+    tone = get_performance_tone(change_bucket)
+    pending_class = " pending" if pending else ""
+    pending_badge = " ⏳" if pending else ""
+    
+    return (
+        f'<div class="mk-mini {tone}{pending_class}">'
+        f'<div class="mk-weather">{weather}</div>'
+        f'<div class="mk-name">{info["flag"]} {info["name"]}{pending_badge}</div>'
+        f'<div class="mk-country">{info["country"]}</div>'
+        f'<div class="mk-change">{change_bucket:+.2f}%</div>'
+        f'{render_sparkline_svg(sparkline, tone)}'
+        f'<div class="mk-status">{status_emoji} {status["status"]} • {status["local_time"]}</div>'
+        f'</div>'
+    )
+
+def render_pending_card_html(symbol: str) -> str:
+    """
+    Tarjeta mini de relleno para un mercado cuya cotización aún no ha llegado
+    
+    Args:
+        symbol: Símbolo del mercado
+        
+    Returns:
+        HTML de la tarjeta
+    """
+    info = GLOBAL_MARKETS[symbol]
+    return (
+        f'<div class="mk-mini flat pending">'
+        f'<div class="mk-weather">⏳</div>'
+        f'<div class="mk-name">{info["flag"]} {info["name"]}</div>'
+        f'<div class="mk-country">{info["country"]}</div>'
+        f'<div class="mk-change">--</div>'
+        f'<div class="mk-status">Cargando cotización…</div>'
+        f'</div>'
+    )
+
+def create_mini_market_card(symbol: str, data: Dict) -> str:
     """
     Crea una tarjeta mini para el mapa mundial
     
     Args:
         symbol: Símbolo del mercado
         data: Datos del mercado
+        
+    Returns:
+        Fragmento HTML de la tarjeta (vacío si el símbolo no existe)
     """
     if symbol not in GLOBAL_MARKETS:
-        return
+        return ""
         
     info = GLOBAL_MARKETS[symbol]
-    weather = get_weather_emoji(data["change_percent"])
     status = get_market_status(info["timezone"], info["market_open"], info["market_close"])
-    status_emoji = "🟢" if status["is_open"] else "🔴"
-    
-    # Color de fondo basado en rendimiento
-    if data["change_percent"] > 0:
-        bg_color = "#d4edda"  # Verde claro
-        border_color = "#28a745"
-    elif data["change_percent"] < 0:
-        bg_color = "#f8d7da"  # Rojo claro
-        border_color = "#dc3545"
-    else:
-        bg_color = "#e2e3e5"  # Gris claro
-        border_color = "#6c757d"
-    
-    st.markdown(f"""
-    <div style="
-        background-color: {bg_color}; 
-        border: 2px solid {border_color}; 
-        border-radius: 10px; 
-        padding: 15px; 
-        text-align: center; 
-        margin: 5px;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    ">
-        <div style="font-size: 24px; margin-bottom: 5px;">{weather}</div>
-        <div style="font-size: 16px; font-weight: bold; margin-bottom: 3px;">{info['flag']} {info['name']}</div>
-        <div style="font-size: 14px; color: #666; margin-bottom: 5px;">{info['country']}</div>
-        <div style="font-size: 18px; font-weight: bold; color: {border_color};">
-            {data['change_percent']:+.2f}%
-        </div>
-        <div style="font-size: 12px; margin-top: 5px;">
-            {status_emoji} {status['status']} • {status['local_time']}
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    
+    return render_mini_card_html(
+        symbol,
+        round(data["change_percent"], 2),
+        status["is_open"],
+        current_minute(),
+        get_sparkline(symbol, data),
+        bool(data.get("pending"))
+    )
+
+@st.cache_data(max_entries=2048, show_spinner=False)
+def render_heatmap_item_html(symbol: str, change_bucket: float, tone: str) -> str:
+    """
+    Fragmento HTML de un elemento del heatmap, cacheado por símbolo, cambio y columna
+    
+    Args:
+        symbol: Símbolo del mercado
+        change_bucket: Cambio porcentual redondeado a la precisión mostrada
+        tone: Clase CSS de la columna ("gain", "flat" o "loss")
+        
+    Returns:
+        HTML del elemento
+    """
+    info = GLOBAL_MARKETS[symbol]
+    weather = get_weather_emoji(change_bucket)
+    return (
+        f'<div class="mk-heat {tone}">'
+        f'<strong>{weather} {info["flag"]} {info["name"]}</strong><br>'
+        f'<span class="mk-change">{change_bucket:+.2f}%</span>'
+        f'</div>'
+    )
 
 def create_global_heatmap(market_data: Dict) -> None:
     """
@@ -649,59 +1311,52 @@ def create_global_heatmap(market_data: Dict) -> None:
     heatmap_data = []
     for symbol, data in market_data.items():
         if data and symbol in GLOBAL_MARKETS:
-            info = GLOBAL_MARKETS[symbol]
             heatmap_data.append({
-                "Mercado": f"{info['flag']} {info['name']}",
-                "Rendimiento": data["change_percent"],
-                "País": info["country"],
-                "Continente": info["continent"]
+                "symbol": symbol,
+                "Rendimiento": round(data["change_percent"], 2)
             })
     
     if heatmap_data:
         # Ordenar por rendimiento
         heatmap_data.sort(key=lambda x: x["Rendimiento"], reverse=True)
         
-        # Crear visualización en columnas por rendimiento
-        col1, col2, col3 = st.columns(3)
+        columns = [
+            ("🟢 Mejores Performers", "gain", [x for x in heatmap_data if x["Rendimiento"] > 0][:4]),
+            ("⚪ Rendimiento Neutral", "flat", [x for x in heatmap_data if -0.5 <= x["Rendimiento"] <= 0.5][:4]),
+            ("🔴 Peores Performers", "loss", [x for x in heatmap_data if x["Rendimiento"] < 0][-4:])
+        ]
         
-        # Mejores performers
-        with col1:
-            st.markdown("##### 🟢 Mejores Performers")
-            best_performers = [x for x in heatmap_data if x["Rendimiento"] > 0][:4]
-            for item in best_performers:
-                weather = get_weather_emoji(item["Rendimiento"])
-                st.markdown(f"""
-                <div style="background: #d4edda; border-left: 4px solid #28a745; padding: 10px; margin: 5px 0; border-radius: 5px;">
-                    <strong>{weather} {item['Mercado']}</strong><br>
-                    <span style="color: #28a745; font-weight: bold;">+{item['Rendimiento']:.2f}%</span>
-                </div>
-                """, unsafe_allow_html=True)
-        
-        # Neutros
-        with col2:
-            st.markdown("##### ⚪ Rendimiento Neutral")
-            neutral_performers = [x for x in heatmap_data if -0.5 <= x["Rendimiento"] <= 0.5][:4]
-            for item in neutral_performers:
-                weather = get_weather_emoji(item["Rendimiento"])
-                st.markdown(f"""
-                <div style="background: #e2e3e5; border-left: 4px solid #6c757d; padding: 10px; margin: 5px 0; border-radius: 5px;">
-                    <strong>{weather} {item['Mercado']}</strong><br>
-                    <span style="color: #6c757d; font-weight: bold;">{item['Rendimiento']:+.2f}%</span>
-                </div>
-                """, unsafe_allow_html=True)
-        
-        # Peores performers
-        with col3:
-            st.markdown("##### 🔴 Peores Performers")
-            worst_performers = [x for x in heatmap_data if x["Rendimiento"] < 0][-4:]
-            for item in worst_performers:
-                weather = get_weather_emoji(item["Rendimiento"])
-                st.markdown(f"""
-                <div style="background: #f8d7da; border-left: 4px solid #dc3545; padding: 10px; margin: 5px 0; border-radius: 5px;">
-                    <strong>{weather} {item['Mercado']}</strong><br>
-                    <span style="color: #dc3545; font-weight: bold;">{item['Rendimiento']:.2f}%</span>
-                </div>
-                """, unsafe_allow_html=True)
+        # Cada columna se envía como un único bloque HTML
+        for col, (title, tone, items) in zip(st.columns(3), columns):
+            with col:
+                body = "".join(
+                    render_heatmap_item_html(item["symbol"], item["Rendimiento"], tone)
+                    for item in items
+                )
+                st.markdown(f'<h5>{title}</h5>{body}', unsafe_allow_html=True)
+
+@st.cache_data(max_entries=2048, show_spinner=False)
+def render_market_card_header_html(symbol: str, change_bucket: float, is_open: bool) -> str:
+    """
+    Cabecera HTML de la tarjeta detallada, cacheada por símbolo, cambio y estado
+    
+    Args:
+        symbol: Símbolo del mercado
+        change_bucket: Cambio porcentual redondeado a la precisión mostrada
+        is_open: Si el mercado está abierto
+        
+    Returns:
+        HTML de la cabecera
+    """
+    info = GLOBAL_MARKETS[symbol]
+    weather = get_weather_emoji(change_bucket)
+    status_emoji = "🟢" if is_open else "🔴"
+    return (
+        f'<div class="mk-card {get_performance_tone(change_bucket)}">'
+        f'<h4>{weather} {info["flag"]} {info["name"]} {status_emoji}</h4>'
+        f'<p>{info["country"]} • {info["description"]}</p>'
+        f'</div>'
+    )
 
 def create_market_card(market: Dict) -> None:
     """
@@ -712,27 +1367,17 @@ def create_market_card(market: Dict) -> None:
     """
     info = market["info"]
     data = market["data"]
-    weather = market["weather"]
     status = market["status"]
     
-    # Color de fondo basado en rendimiento
-    if data["change_percent"] > 0:
-        border_color = "#28a745"  # Verde
-    elif data["change_percent"] < 0:
-        border_color = "#dc3545"  # Rojo
-    else:
-        border_color = "#6c757d"  # Gris
-    
-    # Status emoji
-    status_emoji = "🟢" if status["is_open"] else "🔴"
-    
     with st.container():
-        st.markdown(f"""
-        <div style="border-left: 4px solid {border_color}; padding: 15px; margin: 10px 0; background-color: #f8f9fa; border-radius: 5px;">
-            <h4 style="margin: 0 0 10px 0;">{weather} {info['flag']} {info['name']} {status_emoji}</h4>
-            <p style="margin: 0; color: #666; font-size: 14px;">{info['country']} • {info['description']}</p>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(
+            render_market_card_header_html(
+                market["symbol"],
+                round(data["change_percent"], 2),
+                status["is_open"]
+            ),
+            unsafe_allow_html=True
+        )
         
         # Métricas principales
         col1, col2 = st.columns(2)
@@ -767,42 +1412,61 @@ def create_market_card(market: Dict) -> None:
                 st.write(f"**🔄 Actualizado:** {data['last_updated']}")
             
             st.write(f"**📡 Fuente:** {data['data_source']}")
+            
+        if data.get("pending"):
+            st.caption("⏳ Último valor conocido, esperando la cotización nueva")
 
-def create_global_summary(market_data: Dict) -> None:
+def build_global_summary(snapshot: "MarketSnapshot") -> Optional[Dict]:
     """
-    Crea resumen global de todos los mercados
+    Calcula las estadísticas del resumen global a partir de la raíz del
+    motor de agregados guardada en el snapshot al construirlo
     
     Args:
-        market_data: Diccionario con datos de todos los mercados
+        snapshot: Snapshot con los datos de todos los mercados
+        
+    Returns:
+        Diccionario con los contadores y el promedio, None si no hay datos
     """
-    valid_data = [data for data in market_data.values() if data is not None]
-    
-    if not valid_data:
-        st.warning("⚠️ No se pudieron obtener datos de mercados")
-        return
+    if not snapshot.valid_count or snapshot.rollup is None:
+        return None
     
-    # Calcular estadísticas globales
-    total_markets = len(valid_data)
-    positive_markets = sum(1 for data in valid_data if data["change_percent"] > 0)
-    negative_markets = sum(1 for data in valid_data if data["change_percent"] < 0)
+    # Estadísticas globales: la raíz del árbol tal como quedó con este snapshot
+    root = snapshot.rollup.node("geography")
+    total_markets = root["markets"]
+    positive_markets = root["up"]
+    negative_markets = root["down"]
     neutral_markets = total_markets - positive_markets - negative_markets
+    avg_performance = root["mean"]
+    open_markets = root["open"]
+    real_data_sources = snapshot.real_count
     
-    avg_performance = sum(data["change_percent"] for data in valid_data) / total_markets
+    return {
+        "total_markets": total_markets,
+        "positive_markets": positive_markets,
+        "negative_markets": negative_markets,
+        "neutral_markets": neutral_markets,
+        "avg_performance": avg_performance,
+        "open_markets": open_markets,
+        "real_data_sources": real_data_sources
+    }
+
+def create_global_summary(summary: Optional[Dict]) -> None:
+    """
+    Crea resumen global de todos los mercados
     
-    # Contar mercados abiertos
-    open_markets = 0
-    for symbol, market_info in GLOBAL_MARKETS.items():
-        if symbol in market_data and market_data[symbol]:
-            status = get_market_status(
-                market_info["timezone"],
-                market_info["market_open"],
-                market_info["market_close"]
-            )
-            if status["is_open"]:
-                open_markets += 1
+    Args:
+        summary: Estadísticas calculadas por build_global_summary
+    """
+    if summary is None:
+        st.warning("⚠️ No se pudieron obtener datos de mercados")
+        return
     
-    # Contar fuentes de datos reales
-    real_data_sources = sum(1 for data in valid_data if "🟢" in data.get("data_source", ""))
+    total_markets = summary["total_markets"]
+    positive_markets = summary["positive_markets"]
+    negative_markets = summary["negative_markets"]
+    avg_performance = summary["avg_performance"]
+    open_markets = summary["open_markets"]
+    real_data_sources = summary["real_data_sources"]
     
     st.markdown("### 📊 Resumen Global de Mercados")
     
@@ -852,12 +1516,15 @@ def create_global_summary(market_data: Dict) -> None:
             delta=f"{real_data_sources} datos reales"
         )
 
-def create_performance_chart(market_data: Dict) -> None:
+def build_performance_frame(market_data: Dict) -> pd.DataFrame:
     """
-    Crea gráfico de rendimiento usando matplotlib nativo de Streamlit
+    Prepara los datos del gráfico de rendimiento
     
     Args:
         market_data: Diccionario con datos de todos los mercados
+        
+    Returns:
+        DataFrame ordenado por rendimiento (vacío si no hay datos)
     """
     # Preparar datos para el gráfico
     chart_data = []
@@ -875,11 +1542,21 @@ def create_performance_chart(market_data: Dict) -> None:
             })
     
     if not chart_data:
-        st.warning("⚠️ No hay datos suficientes para crear el gráfico")
-        return
+        return pd.DataFrame()
     
     df = pd.DataFrame(chart_data)
-    df = df.sort_values("Rendimiento (%)", ascending=True)
+    return df.sort_values("Rendimiento (%)", ascending=True)
+
+def create_performance_chart(df: pd.DataFrame) -> None:
+    """
+    Crea gráfico de rendimiento usando matplotlib nativo de Streamlit
+    
+    Args:
+        df: Datos preparados por build_performance_frame
+    """
+    if df.empty:
+        st.warning("⚠️ No hay datos suficientes para crear el gráfico")
+        return
     
     # Crear gráfico de barras usando Streamlit nativo
     st.markdown("### 📊 Rendimiento Diario de Índices Globales")
@@ -892,21 +1569,22 @@ def create_performance_chart(market_data: Dict) -> None:
         hide_index=True
     )
 
-def create_sidebar_content(market_data: Dict) -> Tuple[str, str]:
+def create_sidebar_content(market_data: "MarketSnapshot") -> Tuple[Tuple[str, str, object], ...]:
     """
     Crea contenido del sidebar con información adicional
     
     Args:
-        market_data: Diccionario con datos de todos los mercados
+        market_data: Snapshot con datos de todos los mercados
         
     Returns:
-        Tupla con filtros seleccionados
+        Condiciones del screener de los filtros seleccionados
     """
     st.sidebar.header("🎛️ Panel de Control")
     
     # Botón de actualización
     if st.sidebar.button("🔄 Actualizar Datos", type="primary"):
         st.cache_data.clear()
+        get_snapshot_builder.clear()
         st.rerun()
     
     st.sidebar.markdown("---")
@@ -934,9 +1612,17 @@ def create_sidebar_content(market_data: Dict) -> Tuple[str, str]:
     
     performance_filter = st.sidebar.selectbox(
         "Rendimiento:",
-        ["Todos", "Solo Positivos", "Solo Negativos", "Solo Neutros"]
+        list(PERFORMANCE_FILTERS.keys())
     )
     
+    # Filtros rápidos y screener avanzado se combinan en una sola consulta
+    conditions = []
+    if selected_continent != "Todos":
+        conditions.append(("continent", "in", frozenset([selected_continent])))
+    if PERFORMANCE_FILTERS[performance_filter] is not None:
+        conditions.append(PERFORMANCE_FILTERS[performance_filter])
+    conditions = tuple(conditions) + create_screener_controls(market_data)
+    
     # Estadísticas rápidas en sidebar
     valid_data = [data for data in market_data.values() if data is not None]
     if valid_data:
@@ -967,15 +1653,25 @@ def create_sidebar_content(market_data: Dict) -> Tuple[str, str]:
         - Total: {len(valid_data)}
         """)
     
+    # Uso de memoria del historial de ticks
+    usage = get_tick_history().memory_usage()
+    st.sidebar.caption(
+        f"🧠 Historial en memoria: {usage['total_bytes'] / 1024:,.0f} KB de "
+        f"{usage['max_bytes'] / 1024:,.0f} KB • {usage['ticks']:,} ticks"
+    )
+    
     # Información técnica
     st.sidebar.markdown("---")
     st.sidebar.subheader("ℹ️ Información Técnica")
-    st.sidebar.info("""
+    st.sidebar.info(f"""
     **📊 Fuentes de Datos:**
-    - 🟢 Yahoo Finance API (datos reales)
+    - 🟢 Yahoo Finance API (datos reales, con cobertura entre hosts)
+    - 🟢 Archivo local (proveedor alternativo)
     - 🟡 Simulación realista (fallback)
     
-    **🔄 Actualización:** Cada 5 minutos
+    **🔄 Actualización:**
+    - Mercado abierto: cada {OPEN_MARKET_TTL} segundos
+    - Mercado cerrado: última cotización hasta la próxima apertura
     
     **📈 Análisis Técnico:**
     - MA50: Media móvil de 50 períodos
@@ -1007,17 +1703,22 @@ def create_sidebar_content(market_data: Dict) -> Tuple[str, str]:
         except:
             st.sidebar.text(f"{city_name}: Error")
     
-    return selected_continent, performance_filter
+    return conditions
 
-def create_detailed_table(market_data: Dict) -> None:
+def build_detailed_table(market_data: Dict) -> pd.DataFrame:
     """
-    Crea tabla detallada con todos los datos de mercados
+    Prepara las filas de la tabla detallada con tipos nativos
+    
+    Precio, cambio y volumen son numéricos, la apertura y la tendencia
+    booleanos y la actualización un datetime; el formato visual lo pone
+    st.column_config, así que el navegador ordena y filtra sin reruns.
     
     Args:
         market_data: Diccionario con datos de todos los mercados
+        
+    Returns:
+        DataFrame ordenado por cambio porcentual (vacío si no hay datos)
     """
-    st.markdown("### 📋 Tabla Detallada de Mercados")
-    
     # Crear datos para la tabla
     table_data = []
     for symbol, data in market_data.items():
@@ -1030,182 +1731,3997 @@ def create_detailed_table(market_data: Dict) -> None:
                 "🌤️": weather,
                 "🏛️ Mercado": f"{info['flag']} {info['name']}",
                 "🌍 País": info["country"],
-                "💰 Precio": f"{data['current_price']:,.2f} {info['currency']}",
-                "📊 Cambio": f"{data['change_percent']:+.2f}%",
-                "📈 Tendencia": f"{'📈' if data['ma50_trend'] == 'alcista' else '📉'} {data['ma50_trend'].title()}",
-                "🕐 Estado": f"{'🟢' if status['is_open'] else '🔴'} {status['status']}",
-                "🌐 Hora Local": f"{status['local_time']}",
-                "📊 Volumen": format_number(data['volume']),
-                "📡 Fuente": data['data_source'],
-                "🔄 Actualizado": data['last_updated']
+                "💰 Precio": data["current_price"],
+                "💱 Moneda": info["currency"],
+                "📊 Cambio": data["change_percent"],
+                # Sin MA50 ("neutral") la casilla queda vacía, no como "debajo"
+                "📈 Sobre MA50": pd.NA if data["ma50_trend"] not in ("alcista", "bajista") else data["ma50_trend"] == "alcista",
+                "🟢 Abierto": status["is_open"],
+                "🕐 Estado": status["status"],
+                "🌐 Hora Local": status["local_time"],
+                "📊 Volumen": data["volume"],
+                "📡 Fuente": f"⏳ {data['data_source']}" if data.get("pending") else data["data_source"],
+                "🔄 Actualizado": data["timestamp"],
+                "📉 Intradía": list(get_sparkline(symbol, data))
             })
     
-    if table_data:
-        df_table = pd.DataFrame(table_data)
-        # Ordenar por cambio porcentual descendente
-        df_table = df_table.sort_values("📊 Cambio", key=lambda x: x.str.replace('%', '').str.replace('+', '').astype(float), ascending=False)
-        st.dataframe(df_table, use_container_width=True, hide_index=True)
+    if not table_data:
+        return pd.DataFrame()
+    
+    df_table = pd.DataFrame(table_data)
+    df_table["💰 Precio"] = df_table["💰 Precio"].astype("float64")
+    df_table["📊 Cambio"] = df_table["📊 Cambio"].astype("float64")
+    df_table["📊 Volumen"] = df_table["📊 Volumen"].astype("int64")
+    df_table["📈 Sobre MA50"] = df_table["📈 Sobre MA50"].astype("boolean")
+    df_table["🔄 Actualizado"] = pd.to_datetime(df_table["🔄 Actualizado"], unit="s", utc=True)
+    
+    # Ordenar por cambio porcentual descendente (sin arrastrar el índice al payload)
+    return df_table.sort_values("📊 Cambio", ascending=False).reset_index(drop=True)
+
+def create_detailed_table(df_table: pd.DataFrame) -> None:
+    """
+    Crea tabla detallada con todos los datos de mercados
+    
+    Args:
+        df_table: Filas preparadas por build_detailed_table
+    """
+    st.markdown("### 📋 Tabla Detallada de Mercados")
+    
+    if not df_table.empty:
+        st.dataframe(
+            df_table,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "💰 Precio": st.column_config.NumberColumn("💰 Precio", format="%.2f"),
+                "📊 Cambio": st.column_config.NumberColumn("📊 Cambio", format="%+.2f%%"),
+                "📈 Sobre MA50": st.column_config.CheckboxColumn("📈 Sobre MA50", help="Precio por encima de la media móvil de 50 periodos"),
+                "🟢 Abierto": st.column_config.CheckboxColumn("🟢 Abierto"),
+                "📊 Volumen": st.column_config.NumberColumn("📊 Volumen", format="%d"),
+                "🔄 Actualizado": st.column_config.DatetimeColumn("🔄 Actualizado (UTC)", format="HH:mm:ss"),
+                "📉 Intradía": st.column_config.LineChartColumn("📉 Intradía", width="small")
+            }
+        )
     else:
         st.warning("⚠️ No hay datos disponibles para mostrar en la tabla")
 
-# 5. FUNCIÓN PRINCIPAL
+# 4.1 CORRELACIÓN ENTRE MERCADOS
 # ====================================================================
 
-def main():
+# Ventanas móviles disponibles (en número de barras)
+CORRELATION_WINDOWS = [12, 48, 288]
+
+# Duración de cada barra en segundos, independiente del refresco de las
+# cotizaciones: cada barra se registra con el primer refresco completo de su periodo
+CORRELATION_BAR_SECONDS = 300
+
+# Barras comunes mínimas para dar la correlación de una pareja de índices
+CORRELATION_MIN_OBSERVATIONS = 6
+
+class RollingCorrelationEngine:
     """
-    Función principal de la aplicación
+    Motor de correlación y covarianza móvil entre todos los índices
+
+    Guarda la serie de retornos por barra y mantiene, para cada ventana y
+    cada pareja de índices, las sumas de las barras en que ambos tienen
+    retorno: número de barras, Σx, Σx² y Σxy. Un mercado cerrado o sin
+    cotización no aporta nada (en lugar de un retorno nulo que acercaría
+    sus correlaciones a cero). Cada barra nueva suma su aportación y resta
+    la de la barra que sale de la ventana, de modo que no hace falta
+    recalcular las matrices N×N completas en cada rerun.
     """
-    # Título principal
-    st.title("🌍 Mercados Financieros Globales")
-    st.markdown("### 📊 Monitor en tiempo real de los principales índices bursátiles mundiales")
-    
-    # Hora actual UTC
-    current_utc = datetime.now(pytz.UTC)
-    st.info(f"🕐 **Hora UTC:** {current_utc.strftime('%Y-%m-%d %H:%M:%S')} | 🔄 **Última actualización:** {datetime.now().strftime('%H:%M:%S')}")
-    
-    # Mostrar spinner mientras se cargan los datos
-    with st.spinner("📡 Obteniendo datos de los mercados globales..."):
-        # Obtener datos de todos los mercados
-        market_data = {}
-        progress_bar = st.progress(0)
-        total_markets = len(GLOBAL_MARKETS)
-        
-        for idx, symbol in enumerate(GLOBAL_MARKETS.keys()):
-            progress_bar.progress((idx + 1) / total_markets)
-            market_data[symbol] = fetch_market_data(symbol)
-            time.sleep(0.1)  # Pequeña pausa para evitar rate limiting
-        
-        progress_bar.empty()
-    
-    # Mostrar estado de conexión de datos
-    valid_data = [data for data in market_data.values() if data is not None]
-    real_data_count = sum(1 for data in valid_data if "🟢" in data.get("data_source", ""))
-    
-    if real_data_count > 0:
-        st.success(f"✅ Datos obtenidos exitosamente: {real_data_count} fuentes reales, {len(valid_data) - real_data_count} simuladas")
-    else:
-        st.info("ℹ️ Usando datos simulados realistas - API externa no disponible")
-    
-    # Crear sidebar con filtros
-    selected_continent, performance_filter = create_sidebar_content(market_data)
-    
-    # Aplicar filtros si es necesario
-    filtered_data = market_data.copy()
-    
-    if selected_continent != "Todos":
-        filtered_symbols = [
-            symbol for symbol, info in GLOBAL_MARKETS.items() 
-            if info["continent"] == selected_continent
-        ]
-        filtered_data = {k: v for k, v in market_data.items() if k in filtered_symbols}
-    
-    if performance_filter != "Todos":
-        if performance_filter == "Solo Positivos":
-            filtered_data = {k: v for k, v in filtered_data.items() if v and v["change_percent"] > 0}
-        elif performance_filter == "Solo Negativos":
-            filtered_data = {k: v for k, v in filtered_data.items() if v and v["change_percent"] < 0}
-        elif performance_filter == "Solo Neutros":
-            filtered_data = {k: v for k, v in filtered_data.items() if v and v["change_percent"] == 0}
-    
-    # Mostrar resumen global
-    create_global_summary(market_data)
-    
-    st.markdown("---")
-    
-    # Mostrar mapa mundial
-    create_world_map_visualization(filtered_data)
-    
-    # Mostrar gráfico de rendimiento
-    st.markdown("### 📈 Análisis Comparativo de Rendimiento")
-    create_performance_chart(filtered_data)
-    
-    # Mostrar tabla detallada
-    create_detailed_table(filtered_data)
-    
-    # Footer informativo mejorado
-    st.markdown("---")
-    
-    # Estadísticas finales
-    total_real = sum(1 for data in valid_data if "🟢" in data.get("data_source", ""))
-    total_sim = len(valid_data) - total_real
-    success_rate = (total_real / len(valid_data) * 100) if valid_data else 0
-    
-    st.markdown("### 🚀 Widget de Mercados Financieros Globales v3.0")
-    
-    # Crear métricas finales en columnas
-    footer_cols = st.columns(4)
-    
-    with footer_cols[0]:
-        st.metric("📊 Mercados Monitoreados", len(GLOBAL_MARKETS), "indices principales")
-    
-    with footer_cols[1]:
-        st.metric("📡 Datos Reales", total_real, f"de {len(valid_data)} total")
-    
-    with footer_cols[2]:
-        st.metric("🟡 Datos Simulados", total_sim, "fallback realista")
-    
-    with footer_cols[3]:
-        st.metric("✅ Tasa de Éxito", f"{success_rate:.1f}%", "conexión API")
-    
-    # Información técnica en expander
-    with st.expander("ℹ️ Información Técnica Detallada"):
-        st.markdown("""
-        **🌟 Características Principales:**
-        - 🗺️ **Mapa mundial interactivo** con vista geográfica de mercados
-        - 🌤️ **7 niveles de emojis meteorológicos** por rendimiento
-        - 📡 **Sistema híbrido**: Datos reales de Yahoo Finance + fallback inteligente
-        - 📊 **Análisis técnico**: Media Móvil 50 períodos calculada en tiempo real
-        - 🕐 **Horarios precisos**: Estado abierto/cerrado por zona horaria
-        - 🔍 **Filtros avanzados**: Por continente y tipo de rendimiento
-        - 🌡️ **Heatmap global**: Visualización rápida de mejores/peores performers
-        - 📈 **Estadísticas globales**: Sentimiento de mercado y promedios
-        
-        **📊 Mercados Incluidos:**
-        - **🇺🇸 Estados Unidos**: S&P 500, NASDAQ
-        - **🇨🇦 Canadá**: TSX
-        - **🇬🇧 Reino Unido**: FTSE 100
-        - **🇩🇪 Alemania**: DAX
-        - **🇫🇷 Francia**: CAC 40
-        - **🇪🇸 España**: IBEX 35
-        - **🇯🇵 Japón**: Nikkei 225
-        - **🇨🇳 China**: Shanghai Composite
-        - **🇭🇰 Hong Kong**: Hang Seng
-        - **🇦🇺 Australia**: ASX 200
-        - **🇧🇷 Brasil**: Bovespa
-        - **🇲🇽 México**: IPC
-        
-        **🔧 Tecnología:**
-        - Desarrollado con Streamlit puro (sin dependencias externas)
-        - Compatible con Streamlit Cloud
-        - Cache inteligente de 5 minutos
-        - Sistema robusto de manejo de errores
-        - Interfaz responsive para móviles y desktop
-        """)
-    
-    # Aviso legal
-    st.info("""
-    ⚠️ **Aviso Legal**: Esta herramienta es exclusivamente para fines educativos e informativos. 
-    No constituye asesoramiento financiero. Las decisiones de inversión requieren análisis profesional independiente.
-    """)
-    
-    # Timestamp final
-    st.caption(f"🕐 Última actualización: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')} | Desarrollado con ❤️ usando Streamlit")
 
-# 6. EJECUCIÓN PRINCIPAL
+    def __init__(self, symbols: List[str], windows: List[int]):
+        self.symbols = list(symbols)
+        self.windows = sorted(set(windows))
+        self._max_window = self.windows[-1]
+
+        size = len(self.symbols)
+        self._returns = deque(maxlen=self._max_window)
+        self._counts = {w: np.zeros((size, size)) for w in self.windows}
+        self._sums = {w: np.zeros((size, size)) for w in self.windows}
+        self._squares = {w: np.zeros((size, size)) for w in self.windows}
+        self._cross = {w: np.zeros((size, size)) for w in self.windows}
+        self._last_prices = np.full(size, np.nan)
+        self._last_bar = None
+        self._bars_since_resync = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @property
+    def last_bar(self) -> Optional[int]:
+        return self._last_bar
+
+    def observations(self, window: int) -> int:
+        """
+        Número de barras de retornos disponibles dentro de la ventana
+        """
+        return min(len(self._returns), window)
+
+    @staticmethod
+    def _contribution(returns: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        Aportación de una barra a las sumas por pareja (NaN = sin retorno)
+
+        Returns:
+            Tupla (barras comunes, Σx, Σx², Σxy); en cada matriz la fila es
+            el índice cuyo retorno se suma y la columna la pareja que lo acompaña
+        """
+        valid = np.isfinite(returns).astype(float)
+        x = np.where(valid > 0, returns, 0.0)
+        return np.outer(valid, valid), np.outer(x, valid), np.outer(x * x, valid), np.outer(x, x)
+
+    def _add(self, window: int, contribution: Tuple[np.ndarray, ...], sign: float) -> None:
+        counts, sums, squares, cross = contribution
+        self._counts[window] += sign * counts
+        self._sums[window] += sign * sums
+        self._squares[window] += sign * squares
+        self._cross[window] += sign * cross
+
+    def push_bar(self, bar_timestamp: int, prices: Dict[str, float]) -> bool:
+        """
+        Incorpora una barra nueva y actualiza las sumas de forma incremental
+
+        Args:
+            bar_timestamp: Inicio de la barra (epoch en segundos)
+            prices: Precio actual por símbolo (solo los mercados que cotizan)
+
+        Returns:
+            True si la barra era nueva, False si ya se había procesado
+        """
+        with self._lock:
+            if self._last_bar is not None and bar_timestamp <= self._last_bar:
+                return False
+
+            current = np.array(
+                [prices.get(symbol, np.nan) for symbol in self.symbols],
+                dtype=float
+            )
+
+            # La primera barra solo fija los precios de referencia
+            if self._last_bar is not None:
+                # Sin precio en esta barra o en la anterior no hay retorno
+                # (tampoco el salto de la reapertura tras un cierre)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    returns = (current / self._last_prices - 1) * 100
+                returns = np.where(np.isfinite(returns), returns, np.nan)
+
+                incoming = self._contribution(returns)
+                for window in self.windows:
+                    self._add(window, incoming, 1.0)
+                    if len(self._returns) >= window:
+                        self._add(window, self._contribution(self._returns[-window]), -1.0)
+
+                self._returns.append(returns)
+                self._bars_since_resync += 1
+
+                # Recalcular periódicamente para acotar el error de redondeo
+                if self._bars_since_resync >= self._max_window:
+                    self._resync()
+
+            self._last_prices = current
+            self._last_bar = bar_timestamp
+            self._cache.clear()
+            return True
+
+    def _resync(self) -> None:
+        """
+        Recalcula las sumas desde la serie guardada (llamar con el lock tomado)
+        """
+        history = np.array(self._returns)
+        valid = np.isfinite(history).astype(float)
+        x = np.where(valid > 0, history, 0.0)
+        for window in self.windows:
+            recent_valid, recent_x = valid[-window:], x[-window:]
+            self._counts[window] = recent_valid.T @ recent_valid
+            self._sums[window] = recent_x.T @ recent_valid
+            self._squares[window] = (recent_x * recent_x).T @ recent_valid
+            self._cross[window] = recent_x.T @ recent_x
+        self._bars_since_resync = 0
+
+    def pair_observations(self, window: int) -> pd.DataFrame:
+        """
+        Barras con retorno de ambos índices de cada pareja dentro de la ventana
+        """
+        with self._lock:
+            counts = self._counts[window].round().astype(int)
+        return pd.DataFrame(counts, index=self.symbols, columns=self.symbols)
+
+    def get_matrix(self, window: int, kind: str = "correlation") -> Tuple[pd.DataFrame, int]:
+        """
+        Devuelve la matriz de correlación o covarianza para una ventana
+
+        Cada celda usa solo las barras en que ambos índices tienen retorno;
+        con menos de CORRELATION_MIN_OBSERVATIONS queda en NaN.
+
+        Args:
+            window: Tamaño de la ventana en barras
+            kind: "correlation" o "covariance"
+
+        Returns:
+            Tupla con la matriz (DataFrame N×N) y el número de barras de la ventana
+        """
+        with self._lock:
+            cache_key = (window, kind, self._last_bar)
+            if cache_key in self._cache:
+                return self._cache[cache_key]
+
+            n = self.observations(window)
+            counts = self._counts[window].round()
+            sums, squares, cross = self._sums[window], self._squares[window], self._cross[window]
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                enough = counts >= CORRELATION_MIN_OBSERVATIONS
+                covariance = (cross - sums * sums.T / counts) / (counts - 1)
+                if kind == "covariance":
+                    matrix = covariance
+                else:
+                    # Varianzas de cada índice sobre las mismas barras de la pareja
+                    variance = np.clip((squares - sums * sums / counts) / (counts - 1), 0, None)
+                    matrix = covariance / np.sqrt(variance * variance.T)
+                    matrix = np.clip(matrix, -1, 1)
+                matrix = np.where(enough & np.isfinite(matrix), matrix, np.nan)
+
+            result = (pd.DataFrame(matrix, index=self.symbols, columns=self.symbols), n)
+            self._cache[cache_key] = result
+            return result
+
+@st.cache_resource
+def get_correlation_engine() -> RollingCorrelationEngine:
+    """
+    Motor de correlación compartido por todas las sesiones del proceso
+    """
+    return RollingCorrelationEngine(list(GLOBAL_MARKETS.keys()), CORRELATION_WINDOWS)
+
+def update_correlation_engine(market_data: Dict) -> None:
+    """
+    Registra la barra actual en el motor de correlación
+
+    Solo entran los mercados abiertos: uno cerrado repetiría su último
+    precio y aportaría retornos nulos que no son observaciones reales.
+
+    Args:
+        market_data: Diccionario con datos de todos los mercados
+    """
+    bar_timestamp = int(time.time() // CORRELATION_BAR_SECONDS) * CORRELATION_BAR_SECONDS
+    prices = {}
+    for symbol, data in market_data.items():
+        info = GLOBAL_MARKETS.get(symbol)
+        if data is None or info is None:
+            continue
+        if get_market_status(info["timezone"], info["market_open"], info["market_close"])["is_open"]:
+            prices[symbol] = data["current_price"]
+    get_correlation_engine().push_bar(bar_timestamp, prices)
+
+def create_correlation_heatmap() -> None:
+    """
+    Crea el heatmap de correlación/covarianza entre todos los índices
+    """
+    st.markdown("### 🔗 Correlación entre Mercados")
+
+    engine = get_correlation_engine()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        window = st.selectbox(
+            "Ventana móvil:",
+            engine.windows,
+            format_func=lambda w: f"{w} barras ({w * CORRELATION_BAR_SECONDS / 3600:g} h)"
+        )
+    with col2:
+        metric = st.radio("Métrica:", ["Correlación", "Covarianza"], horizontal=True)
+
+    kind = "covariance" if metric == "Covarianza" else "correlation"
+    matrix, observations = engine.get_matrix(window, kind)
+    pairs = engine.pair_observations(window)
+
+    if observations < 2:
+        st.info(
+            f"ℹ️ Acumulando historial: {observations} retornos registrados. "
+            "Se necesitan al menos 2 barras para calcular la matriz."
+        )
+        return
+
+    labels = [f"{GLOBAL_MARKETS[s]['flag']} {GLOBAL_MARKETS[s]['name']}" for s in matrix.index]
+
+    heatmap = go.Heatmap(
+        z=matrix.values,
+        x=labels,
+        y=labels,
+        colorscale="RdYlGn",
+        zmid=0,
+        zmin=-1 if kind == "correlation" else None,
+        zmax=1 if kind == "correlation" else None,
+        customdata=pairs.values,
+        hovertemplate="%{y} / %{x}: %{z:.2f} (%{customdata} barras comunes)<extra></extra>"
+    )
+    fig = go.Figure(heatmap)
+    fig.update_layout(height=550, margin=dict(l=10, r=10, t=10, b=10))
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.caption(
+        f"📐 {observations} barras de {CORRELATION_BAR_SECONDS // 60} minutos en la ventana • cada pareja "
+        "usa solo las barras en que ambos mercados están abiertos; con menos de "
+        f"{CORRELATION_MIN_OBSERVATIONS} barras comunes la celda queda vacía"
+    )
+
+# 4.2 HISTORIAL DE TICKS EN MEMORIA
 # ====================================================================
 
-if __name__ == "__main__":
-    try:
-        main()
-    except Exception as e:
-        st.error(f"❌ Error ejecutando la aplicación: {str(e)}")
-        logger.error(f"Error en main(): {str(e)}")
-        
-        # Mostrar información de debug en modo de desarrollo
-        with st.expander("🔧 Información de Debug"):
-            st.exception(e)
-            st.write("**Variables del sistema:**")
-            st.write(f"- Python version: {st.__version__ if hasattr(st, '__version__') else 'N/A'}")
-            st.write(f"- Timestamp: {datetime.now()}")
-            st.write(f"- Mercados configurados: {len(GLOBAL_MARKETS)}")
-            st.write(f"- Timezone UTC: {datetime.now(pytz.UTC)}")
+# Capacidad por símbolo (ticks) y tope total de memoria del historial
+TICK_HISTORY_CAPACITY = 4096
+TICK_HISTORY_MAX_BYTES = 4 * 1024 * 1024
+
+class TickRingBuffer:
+    """
+    Buffer circular de capacidad fija con precios y timestamps de un símbolo
+
+    El almacenamiento se reserva una sola vez en arrays de NumPy. Cada tick
+    se escribe dos veces (posición i e i + capacidad) para que las últimas
+    n muestras sean siempre contiguas y puedan devolverse como vista sin
+    copiar, aunque el buffer haya dado la vuelta.
+    """
+
+    # Bytes por tick: precio float64 + timestamp int64, escritos dos veces
+    BYTES_PER_TICK = 2 * (8 + 8)
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._prices = np.zeros(2 * capacity, dtype=np.float64)
+        self._timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self._head = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        return self._prices.nbytes + self._timestamps.nbytes
+
+    @property
+    def last_timestamp(self) -> Optional[int]:
+        if not self._size:
+            return None
+        return int(self._timestamps[self._head - 1 + self.capacity])
+
+    def append(self, timestamp: int, price: float) -> bool:
+        """
+        Añade un tick; ignora los que no son posteriores al último guardado
+
+        Args:
+            timestamp: Momento del tick (epoch en segundos)
+            price: Precio del tick
+
+        Returns:
+            True si el tick se guardó
+        """
+        last = self.last_timestamp
+        if last is not None and timestamp <= last:
+            return False
+
+        position = self._head
+        self._prices[position] = self._prices[position + self.capacity] = price
+        self._timestamps[position] = self._timestamps[position + self.capacity] = timestamp
+
+        self._head = (position + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        return True
+
+    def window(self, n: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Devuelve las últimas n muestras como vistas de solo lectura
+
+        Las vistas comparten memoria con el buffer: si se necesitan más allá
+        del tick siguiente hay que copiarlas.
+
+        Args:
+            n: Número de muestras (por defecto, todas las disponibles)
+
+        Returns:
+            Tupla (timestamps, precios) ordenada de la más antigua a la más reciente
+        """
+        n = self._size if n is None else max(0, min(n, self._size))
+        end = self._head + self.capacity
+        timestamps = self._timestamps[end - n:end]
+        prices = self._prices[end - n:end]
+        timestamps.flags.writeable = False
+        prices.flags.writeable = False
+        return timestamps, prices
+
+class TickHistoryStore:
+    """
+    Conjunto de buffers circulares por símbolo con un tope total de memoria
+    """
+
+    def __init__(self, capacity: int, max_bytes: int):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._buffers: Dict[str, TickRingBuffer] = {}
+        self._lock = threading.Lock()
+
+    def record(self, symbol: str, timestamp: int, price: float) -> bool:
+        """
+        Guarda un tick del símbolo, creando su buffer si hay memoria disponible
+
+        Returns:
+            True si el tick se guardó
+        """
+        with self._lock:
+            buffer = self._buffers.get(symbol)
+            if buffer is None:
+                required = self.capacity * TickRingBuffer.BYTES_PER_TICK
+                if self._allocated_bytes() + required > self.max_bytes:
+                    logger.warning(f"Historial de ticks lleno, no se guarda {symbol}")
+                    return False
+                buffer = self._buffers[symbol] = TickRingBuffer(self.capacity)
+            return buffer.append(timestamp, price)
+
+    def window(self, symbol: str, n: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vista de las últimas n muestras de un símbolo (vacía si no hay historial)
+        """
+        with self._lock:
+            buffer = self._buffers.get(symbol)
+            if buffer is None:
+                empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+                return empty
+            return buffer.window(n)
+
+    def _allocated_bytes(self) -> int:
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def memory_usage(self) -> Dict:
+        """
+        Informe del uso de memoria actual
+
+        Returns:
+            Diccionario con bytes totales, tope, ticks guardados y detalle por símbolo
+        """
+        with self._lock:
+            return {
+                "total_bytes": self._allocated_bytes(),
+                "max_bytes": self.max_bytes,
+                "ticks": sum(len(buffer) for buffer in self._buffers.values()),
+                "symbols": {
+                    symbol: {"ticks": len(buffer), "bytes": buffer.nbytes}
+                    for symbol, buffer in self._buffers.items()
+                }
+            }
+
+@st.cache_resource
+def get_tick_history() -> TickHistoryStore:
+    """
+    Historial de ticks compartido por todas las sesiones del proceso
+    """
+    # Ajustar la capacidad para que todos los mercados quepan bajo el tope
+    capacity = min(
+        TICK_HISTORY_CAPACITY,
+        TICK_HISTORY_MAX_BYTES // (len(GLOBAL_MARKETS) * TickRingBuffer.BYTES_PER_TICK)
+    )
+    return TickHistoryStore(capacity, TICK_HISTORY_MAX_BYTES)
+
+def record_tick_history(market_data: Dict) -> None:
+    """
+    Guarda el precio actual de cada mercado en el historial de ticks
+
+    Args:
+        market_data: Diccionario con datos de todos los mercados
+    """
+    history = get_tick_history()
+    for symbol, data in market_data.items():
+        if data is not None:
+            history.record(symbol, data["timestamp"], data["current_price"])
+
+# 4.3 SNAPSHOT COMPARTIDO ENTRE SESIONES
+# ====================================================================
+
+# Cada cuánto se reconstruye el snapshot compartido; coincide con el TTL de
+# los mercados abiertos, los cerrados se sirven del cache hasta su apertura
+SNAPSHOT_REFRESH_SECONDS = OPEN_MARKET_TTL
+
+# Presupuesto de tiempo para obtener cotizaciones antes de pintar la página;
+# las que lleguen después se van incorporando con reruns
+RENDER_DEADLINE_SECONDS = float(os.environ.get("RENDER_DEADLINE_SECONDS", "1.5"))
+
+# Tiempo máximo que una sesión sigue las cotizaciones tardías y cadencia del sondeo
+FILL_IN_TIMEOUT_SECONDS = 30
+FILL_IN_MIN_INTERVAL = 1.0
+
+# Peticiones simultáneas al construir un snapshot
+SNAPSHOT_FETCH_WORKERS = 4
+
+# Vistas filtradas y resultados derivados memoizados por snapshot (LRU); un
+# snapshot reutilizado puede vivir horas con los mercados cerrados
+SNAPSHOT_MAX_VIEWS = 128
+SNAPSHOT_MAX_DERIVED = 256
+
+# Últimas cotizaciones reales guardadas en disco para el arranque en caliente
+WARM_START_PATH = os.environ.get("WARM_START_PATH", os.path.join("data", "warm_start.json"))
+
+# Antigüedad máxima de un fichero de arranque en caliente para usarlo
+WARM_START_MAX_AGE = 7 * 24 * 3600
+
+# Opciones del filtro de rendimiento y su condición del screener
+PERFORMANCE_FILTERS = {
+    "Todos": None,
+    "Solo Positivos": ("change_percent", "gt", 0.0),
+    "Solo Negativos": ("change_percent", "lt", 0.0),
+    "Solo Neutros": ("change_percent", "eq", 0.0)
+}
+
+class SnapshotView(Mapping):
+    """
+    Vista filtrada de un snapshot: solo guarda referencias a sus símbolos
+    """
+
+    def __init__(self, quotes: Mapping, symbols: Tuple[str, ...]):
+        self._quotes = quotes
+        self._symbols = symbols
+        self._members = frozenset(symbols)
+
+    def __getitem__(self, symbol: str):
+        if symbol not in self._members:
+            raise KeyError(symbol)
+        return self._quotes[symbol]
+
+    def __iter__(self):
+        return iter(self._symbols)
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+class MarketSnapshot(Mapping):
+    """
+    Foto inmutable de todos los mercados, compartida por referencia entre sesiones
+
+    Se construye una vez por refresco. Las cotizaciones quedan envueltas en
+    MappingProxyType y los filtros se resuelven con los índices del screener
+    (construidos la primera vez que se filtra), sin copiar diccionarios. Las
+    vistas y resultados derivados se memoizan en cachés LRU acotadas.
+    """
+
+    def __init__(self, market_data: Dict, pending: frozenset = frozenset(),
+                 rollup: Optional["RollupState"] = None):
+        self.version = time.time_ns()
+        self.created_at = datetime.now()
+        self.pending = frozenset(pending)
+        # Agregados por grupo con estas cotizaciones (congelados)
+        self.rollup = rollup
+
+        self._symbols = tuple(market_data.keys())
+        self._quotes = MappingProxyType({
+            symbol: MappingProxyType(dict(data)) if data is not None else None
+            for symbol, data in market_data.items()
+        })
+
+        valid = [(symbol, data) for symbol, data in market_data.items() if data is not None]
+        self.valid_count = len(valid)
+        self.real_count = sum(1 for _, data in valid if "🟢" in data.get("data_source", ""))
+
+        self._screener: Optional[ScreenerIndex] = None
+        self._views: "OrderedDict[Tuple, SnapshotView]" = OrderedDict()
+        self._columns: Dict[str, np.ndarray] = {}
+        self._derived: "OrderedDict[Tuple, object]" = OrderedDict()
+        self._views_lock = threading.Lock()
+        self._nbytes = None
+
+    def __getitem__(self, symbol: str):
+        return self._quotes[symbol]
+
+    def __iter__(self):
+        return iter(self._symbols)
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    @property
+    def screener(self) -> "ScreenerIndex":
+        """
+        Índices del screener (se construyen una sola vez por snapshot)
+        """
+        with self._views_lock:
+            if self._screener is None:
+                self._screener = ScreenerIndex({
+                    symbol: screener_row(symbol, self._quotes[symbol]) for symbol in self._symbols
+                })
+            return self._screener
+
+    def screen(self, conditions: Tuple[Tuple[str, str, object], ...] = ()) -> Mapping:
+        """
+        Devuelve la vista filtrada (compartida y memoizada) del snapshot
+
+        Args:
+            conditions: Condiciones del screener (ver ScreenerIndex.select)
+
+        Returns:
+            Mapping de solo lectura con los mercados que cumplen las condiciones
+        """
+        if not conditions:
+            return self
+
+        index = self.screener
+        with self._views_lock:
+            if conditions in self._views:
+                self._views.move_to_end(conditions)
+            else:
+                self._views[conditions] = SnapshotView(self._quotes, index.select(conditions))
+                while len(self._views) > SNAPSHOT_MAX_VIEWS:
+                    self._views.popitem(last=False)
+            return self._views[conditions]
+
+    def column(self, field: str) -> np.ndarray:
+        """
+        Devuelve un campo numérico de todos los mercados como array (memoizado)
+
+        Args:
+            field: Nombre del campo (ej: change_percent)
+
+        Returns:
+            Array de solo lectura en el orden del snapshot, NaN donde no hay dato
+        """
+        with self._views_lock:
+            if field not in self._columns:
+                values = []
+                for symbol in self._symbols:
+                    data = self._quotes[symbol]
+                    value = data.get(field) if data is not None else None
+                    values.append(np.nan if value is None else value)
+                column = np.array(values, dtype=float)
+                column.flags.writeable = False
+                self._columns[field] = column
+            return self._columns[field]
+
+    def derive(self, key: Tuple, build):
+        """
+        Memoiza un resultado derivado del snapshot (tablas, estadísticas...)
+
+        Se calcula la primera vez que una sesión lo pide y se comparte con el
+        resto hasta que el snapshot se reemplaza. Si dos sesiones lo piden a
+        la vez puede construirse dos veces, pero solo se guarda uno.
+
+        Args:
+            key: Clave del resultado, ej. ("tabla", continente, rendimiento)
+            build: Función sin argumentos que calcula el resultado
+
+        Returns:
+            El resultado memoizado (no debe modificarse)
+        """
+        with self._views_lock:
+            if key in self._derived:
+                self._derived.move_to_end(key)
+                return self._derived[key]
+        value = build()
+        with self._views_lock:
+            value = self._derived.setdefault(key, value)
+            while len(self._derived) > SNAPSHOT_MAX_DERIVED:
+                self._derived.popitem(last=False)
+            return value
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memoria aproximada del snapshot (se calcula una sola vez)
+        """
+        if self._nbytes is None:
+            self._nbytes = estimate_size(
+                [self._quotes, self._screener]
+            )
+        return self._nbytes
+
+def estimate_size(obj, seen: Optional[set] = None) -> int:
+    """
+    Estima recursivamente la memoria de un objeto y sus contenidos
+
+    Args:
+        obj: Objeto a medir
+        seen: Identificadores ya contados (para no duplicar referencias)
+
+    Returns:
+        Tamaño aproximado en bytes
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, (Mapping, MappingProxyType)):
+        size += sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(estimate_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), seen)
+    return size
+
+class LastKnownQuotes:
+    """
+    Última cotización de cada mercado, usada para rellenar las pendientes
+
+    Las cotizaciones reales (🟢) se guardan además en disco de forma atómica
+    al completar cada refresco. Al arrancar el proceso se restauran, y el
+    primer snapshot se sirve con ellas al momento mientras el refresco
+    sigue en segundo plano.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._quotes: Dict[str, Dict] = {}
+        self._good: Dict[str, Dict] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.restored = self._load()
+        self.refreshed = False
+
+    def _load(self) -> int:
+        """
+        Restaura las cotizaciones guardadas (si el fichero existe y es reciente)
+
+        Returns:
+            Número de cotizaciones restauradas
+        """
+        try:
+            with open(self.path, encoding="utf-8") as handle:
+                payload = json.load(handle)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo leer el arranque en caliente {self.path}: {str(e)}")
+            return 0
+
+        age = time.time() - payload.get("saved_at", 0)
+        if age > WARM_START_MAX_AGE:
+            logger.info(f"Arranque en caliente descartado: fichero de hace {age / 3600:.0f} h")
+            return 0
+
+        for symbol, quote in payload.get("quotes", {}).items():
+            if symbol in GLOBAL_MARKETS and isinstance(quote, dict):
+                quote["sparkline"] = tuple(quote.get("sparkline") or ())
+                self._quotes[symbol] = quote
+                self._good[symbol] = quote
+
+        logger.info(f"Arranque en caliente: {len(self._quotes)} cotizaciones restauradas de {self.path}")
+        return len(self._quotes)
+
+    @property
+    def warm(self) -> bool:
+        """
+        True mientras se sirvan datos restaurados sin ningún refresco completo
+        """
+        return bool(self.restored) and not self.refreshed
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        with self._lock:
+            return self._quotes.get(symbol)
+
+    def update(self, symbol: str, data: Dict) -> None:
+        with self._lock:
+            self._quotes[symbol] = data
+            if "🟢" in data.get("data_source", ""):
+                self._good[symbol] = data
+                self._dirty = True
+
+    def save(self) -> None:
+        """
+        Guarda en disco las últimas cotizaciones reales si hay alguna nueva
+        (no lanza si falla)
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = {"saved_at": time.time(), "quotes": dict(self._good)}
+            self._dirty = False
+
+        def write(tmp_path: str) -> None:
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                json.dump(payload, handle, ensure_ascii=False)
+
+        try:
+            write_atomic(self.path, write)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el arranque en caliente {self.path}: {str(e)}")
+
+@st.cache_resource
+def get_last_known_quotes() -> LastKnownQuotes:
+    """
+    Últimas cotizaciones del proceso, restauradas de disco al arrancar
+    """
+    return LastKnownQuotes(WARM_START_PATH)
+
+@st.cache_resource
+def get_snapshot_executor() -> ThreadPoolExecutor:
+    """
+    Hilos compartidos para obtener las cotizaciones de los snapshots
+    """
+    return ThreadPoolExecutor(max_workers=SNAPSHOT_FETCH_WORKERS, thread_name_prefix="snapshot")
+
+class SnapshotBuilder:
+    """
+    Obtiene en paralelo las cotizaciones de un periodo de refresco
+
+    snapshot() devuelve en cualquier momento un MarketSnapshot con lo que
+    haya llegado; los mercados pendientes llevan su último valor conocido
+    (marcado con "pending") o None si nunca se recibió. Cada llegada
+    invalida el snapshot memoizado para que el siguiente rerun la incluya.
+    """
+
+    def __init__(self, symbols: List[str], executor: ThreadPoolExecutor):
+        self.symbols = tuple(symbols)
+        self.started = time.monotonic()
+        self._arrived: Dict[str, Optional[Dict]] = {}
+        self._snapshot: Optional[MarketSnapshot] = None
+        self._condition = threading.Condition()
+        for symbol in self.symbols:
+            executor.submit(self._acquire, symbol)
+
+    @property
+    def arrived_count(self) -> int:
+        with self._condition:
+            return len(self._arrived)
+
+    @property
+    def complete(self) -> bool:
+        return self.arrived_count == len(self.symbols)
+
+    def _acquire(self, symbol: str) -> None:
+        """
+        Obtiene una cotización en un hilo del pool y la publica
+        """
+        try:
+            data = fetch_market_data(symbol)
+        except Exception as e:
+            logger.error(f"Error obteniendo {symbol}: {str(e)}")
+            data = None
+
+        last_known = get_last_known_quotes()
+        if data is not None:
+            last_known.update(symbol, data)
+
+        with self._condition:
+            self._arrived[symbol] = data
+            self._snapshot = None
+            complete = len(self._arrived) == len(self.symbols)
+            self._condition.notify_all()
+
+        if complete:
+            # La barra de correlación solo se registra con todas las cotizaciones
+            update_correlation_engine(dict(self._arrived))
+
+            # Refresco completo: deja de servirse el arranque en caliente y se
+            # guardan las cotizaciones reales para el próximo
+            last_known.refreshed = True
+            last_known.save()
+
+            # Las alertas se evalúan una vez por snapshot completo, aunque
+            # ninguna sesión esté mirando
+            get_alert_engine().evaluate(self.snapshot())
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        """
+        Espera a que lleguen todas las cotizaciones como mucho timeout segundos
+
+        Returns:
+            True si ya están todas
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: len(self._arrived) == len(self.symbols), timeout
+            )
+
+    def wait_until_deadline(self, deadline: float) -> bool:
+        """
+        Espera hasta que se cumpla el plazo contado desde que empezó la obtención
+
+        Returns:
+            True si ya están todas
+        """
+        return self.wait(max(0.0, deadline - (time.monotonic() - self.started)))
+
+    def snapshot(self) -> MarketSnapshot:
+        """
+        Snapshot con las cotizaciones recibidas hasta ahora (memoizado por llegada)
+        """
+        with self._condition:
+            if self._snapshot is not None:
+                return self._snapshot
+
+            arrived = dict(self._arrived)
+            last_known = get_last_known_quotes()
+            market_data = {}
+            pending = set()
+            for symbol in self.symbols:
+                if symbol in arrived:
+                    market_data[symbol] = arrived[symbol]
+                    continue
+                pending.add(symbol)
+                previous = last_known.get(symbol)
+                market_data[symbol] = dict(previous, pending=True) if previous is not None else None
+
+            # Refresco completo sin cambios: se reutiliza el snapshot anterior
+            # con sus vistas, índices y tablas ya calculados
+            if not pending:
+                previous = get_published_snapshot().reuse(market_data)
+                if previous is not None:
+                    self._snapshot = previous
+                    return previous
+
+            # Guardar los ticks recibidos en el historial en memoria
+            record_tick_history({symbol: data for symbol, data in arrived.items()})
+
+            # Actualizar los agregados por grupo (solo los mercados que cambiaron)
+            # y guardarlos con el snapshot; las cotizaciones pendientes (último
+            # valor conocido) se agregan en una copia sin tocar el motor
+            rollup = update_rollup_engine(market_data, commit=not pending)
+
+            self._snapshot = MarketSnapshot(market_data, pending, rollup)
+
+            # Con el refresco completo, añadir su fotograma al time-lapse del día
+            # y publicarlo para reutilizarlo si el siguiente llega sin cambios
+            if not pending:
+                get_intraday_timelapse().append(market_data)
+                get_published_snapshot().publish(self._snapshot)
+            return self._snapshot
+
+def market_open_states() -> Tuple[bool, ...]:
+    """
+    Estado abierto/cerrado de cada mercado en este momento
+    """
+    return tuple(
+        get_market_status(info["timezone"], info["market_open"], info["market_close"])["is_open"]
+        for info in GLOBAL_MARKETS.values()
+    )
+
+class PublishedSnapshot:
+    """
+    Último snapshot completo, reutilizado si un refresco trae los mismos datos
+
+    Con los mercados cerrados los refrescos suelen devolver exactamente las
+    mismas cotizaciones. Solo se reutiliza si además no ha abierto ni cerrado
+    ningún mercado, porque el screener indexa el estado de apertura.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[MarketSnapshot] = None
+        self._open_states: Optional[Tuple[bool, ...]] = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.reused = 0
+
+    def reuse(self, market_data: Dict) -> Optional[MarketSnapshot]:
+        """
+        Devuelve el snapshot publicado si tiene exactamente estas cotizaciones
+
+        Args:
+            market_data: Cotizaciones de un refresco completo
+
+        Returns:
+            El snapshot anterior o None si algo cambió
+        """
+        open_states = market_open_states()
+        with self._lock:
+            previous = self._snapshot
+            if previous is None or previous.pending or open_states != self._open_states:
+                return None
+            if list(previous) != list(market_data):
+                return None
+            if any(previous[symbol] != market_data[symbol] for symbol in market_data):
+                return None
+            self.reused += 1
+            return previous
+
+    def publish(self, snapshot: MarketSnapshot) -> None:
+        """
+        Publica un snapshot completo recién construido
+        """
+        open_states = market_open_states()
+        with self._lock:
+            self._snapshot = snapshot
+            self._open_states = open_states
+            self.published += 1
+
+@st.cache_resource
+def get_published_snapshot() -> PublishedSnapshot:
+    """
+    Último snapshot completo compartido por todas las sesiones del proceso
+    """
+    return PublishedSnapshot()
+
+@st.cache_resource(ttl=SNAPSHOT_REFRESH_SECONDS, max_entries=2, show_spinner=False)
+def get_snapshot_builder(refresh_key: int) -> SnapshotBuilder:
+    """
+    Lanza la obtención de cotizaciones del periodo de refresco (una por proceso)
+
+    Args:
+        refresh_key: Periodo de refresco (cambia cada SNAPSHOT_REFRESH_SECONDS)
+
+    Returns:
+        Constructor compartido por todas las sesiones
+    """
+    return SnapshotBuilder(list(GLOBAL_MARKETS.keys()), get_snapshot_executor())
+
+def get_market_snapshot(refresh_key: int, deadline: Optional[float] = None) -> MarketSnapshot:
+    """
+    Devuelve el snapshot de todos los mercados para el periodo de refresco
+
+    Args:
+        refresh_key: Periodo de refresco (cambia cada SNAPSHOT_REFRESH_SECONDS)
+        deadline: Segundos como máximo desde el inicio de la obtención; None
+            espera a todas las cotizaciones
+
+    Returns:
+        Snapshot inmutable compartido por todas las sesiones (puede tener
+        mercados pendientes si venció el plazo)
+    """
+    builder = get_snapshot_builder(refresh_key)
+    if deadline is not None and get_last_known_quotes().warm:
+        # Recién arrancado con datos guardados: se pintan ya, sin esperar
+        deadline = 0.0
+    if deadline is None:
+        builder.wait(None)
+    else:
+        builder.wait_until_deadline(deadline)
+    return builder.snapshot()
+
+def wait_for_pending_quotes(refresh_key: int, snapshot: MarketSnapshot, status) -> None:
+    """
+    Sigue las cotizaciones tardías sin bloquear el script
+
+    Se llama al final de main(), con la página ya pintada. En lugar de esperar
+    dentro del rerun, deja un fragmento que se vuelve a ejecutar cada
+    FILL_IN_MIN_INTERVAL y solo relanza la página completa cuando llega algo
+    nuevo. Pasados FILL_IN_TIMEOUT_SECONDS desde el primer aviso de este
+    refresco se deja de sondear.
+
+    Args:
+        refresh_key: Periodo de refresco del snapshot mostrado
+        snapshot: Snapshot mostrado (con mercados pendientes)
+        status: Placeholder (st.empty) del aviso de pendientes
+    """
+    fill_in = st.session_state.get("fill_in_deadline")
+    if fill_in is None or fill_in[0] != refresh_key:
+        fill_in = (refresh_key, time.monotonic() + FILL_IN_TIMEOUT_SECONDS)
+        st.session_state["fill_in_deadline"] = fill_in
+
+    if time.monotonic() >= fill_in[1]:
+        status.info("⌛ Algunas cotizaciones no han llegado; se reintentará en el próximo refresco")
+        return
+
+    builder = get_snapshot_builder(refresh_key)
+    poll_pending_quotes(refresh_key, len(builder.symbols) - len(snapshot.pending), fill_in[1])
+
+@st.fragment(run_every=FILL_IN_MIN_INTERVAL)
+def poll_pending_quotes(refresh_key: int, shown: int, deadline: float) -> None:
+    """
+    Fragmento que comprueba las llegadas y relanza la página cuando hay novedades
+
+    Args:
+        refresh_key: Periodo de refresco del snapshot mostrado
+        shown: Cotizaciones ya incluidas en la página
+        deadline: Instante (time.monotonic) en que se deja de sondear
+    """
+    builder = get_snapshot_builder(refresh_key)
+    if builder.arrived_count > shown or time.monotonic() >= deadline:
+        st.rerun(scope="app")
+    remaining = len(builder.symbols) - builder.arrived_count
+    st.caption(f"⏳ {remaining} cotizaciones pendientes, se irán mostrando al llegar")
+
+def create_session_diagnostics(snapshot: MarketSnapshot, filtered_data: Mapping) -> None:
+    """
+    Muestra en el sidebar la memoria compartida y la propia de la sesión
+
+    Args:
+        snapshot: Snapshot compartido
+        filtered_data: Vista filtrada usada por la sesión
+    """
+    # Lo propio de la sesión: su estado y la vista (solo referencias)
+    seen = {id(snapshot._quotes)}
+    session_bytes = estimate_size(dict(st.session_state), seen)
+    if filtered_data is not snapshot:
+        session_bytes += sys.getsizeof(filtered_data) + sys.getsizeof(filtered_data._symbols)
+
+    with st.sidebar.expander("🔧 Diagnóstico"):
+        st.write(f"**📦 Snapshot compartido:** {snapshot.nbytes / 1024:,.1f} KB")
+        st.write(f"**👤 Memoria de esta sesión:** {session_bytes / 1024:,.1f} KB")
+        st.write(f"**🕐 Snapshot creado:** {snapshot.created_at.strftime('%H:%M:%S')}")
+        st.caption(f"Versión {snapshot.version}")
+        
+        last_known = get_last_known_quotes()
+        if last_known.restored:
+            st.write(f"**💾 Arranque en caliente:** {last_known.restored} cotizaciones restauradas")
+        
+        # Mercados cerrados: su cotización se sirve del cache hasta la apertura
+        now = time.time()
+        waiting = [get_quote_expiry(symbol, now) for symbol in GLOBAL_MARKETS]
+        waiting = [expiry for expiry in waiting if expiry - now > OPEN_MARKET_TTL]
+        if waiting:
+            next_refresh = datetime.fromtimestamp(min(waiting), tz=pytz.UTC)
+            st.write(
+                f"**💤 En cache hasta la apertura:** {len(waiting)} mercados "
+                f"(próxima {next_refresh.strftime('%a %H:%M')} UTC)"
+            )
+        
+        # Latencias del proveedor de datos y coberturas lanzadas
+        provider_stats = get_data_provider().stats()
+        st.write(f"**📡 Proveedor:** {provider_stats['provider']}")
+        if provider_stats["p95"] is not None:
+            st.write(f"**⏱️ Latencia p95:** {provider_stats['p95'] * 1000:,.0f} ms")
+        if "hedges" in provider_stats:
+            st.write(
+                f"**🛡️ Coberturas:** {provider_stats['hedges']} "
+                f"(ganó el secundario {provider_stats['secondary_wins']}) • "
+                f"umbral {provider_stats['hedge_delay'] * 1000:,.0f} ms"
+            )
+        
+        # Respuestas del proveedor que no hubo que procesar y snapshots reutilizados
+        transfer = provider_transfer_stats(provider_stats)
+        if transfer["responses"]:
+            st.write(
+                f"**📦 Transferido:** {transfer['wire_bytes'] / 1024:,.1f} KB "
+                f"({transfer['decoded_bytes'] / 1024:,.1f} KB sin comprimir)"
+            )
+            st.write(
+                f"**⏭️ Sin cambios:** {transfer['skip_rate']:.0%} de {transfer['responses']} respuestas "
+                f"({transfer['not_modified']} × 304, {transfer['unchanged']} por hash)"
+            )
+        published = get_published_snapshot()
+        if published.reused:
+            st.write(
+                f"**♻️ Snapshots reutilizados:** {published.reused} de "
+                f"{published.reused + published.published} refrescos completos"
+            )
+        
+        # Pool de cálculo: trabajos lanzados y servidos desde resultados previos
+        jobs = get_analytics_jobs()
+        if jobs.submitted:
+            st.write(
+                f"**🧮 Cálculos en segundo plano:** {jobs.submitted} lanzados • "
+                f"{jobs.hits} reutilizados • {jobs.workers} procesos"
+            )
+
+# 4.4 MOTOR DE ALERTAS
+# ====================================================================
+
+# Destino de las alertas: "log", "file" o "webhook" (con ALERT_SINK_TARGET)
+ALERT_SINK = os.environ.get("ALERT_SINK", "log")
+ALERT_SINK_TARGET = os.environ.get("ALERT_SINK_TARGET", "alerts.jsonl")
+
+# Alertas recientes que se conservan para mostrar en el sidebar
+ALERT_HISTORY_SIZE = 200
+
+# Segundos sin actividad tras los que se descartan las reglas de una sesión
+ALERT_SESSION_TTL = 3600
+
+# Campos numéricos disponibles en las reglas y sus alias
+ALERT_FIELDS = {
+    "change_percent": "change_percent",
+    "change": "change_percent",
+    "price": "current_price",
+    "current_price": "current_price",
+    "change_absolute": "change_absolute",
+    "volume": "volume",
+    "ma50": "ma50"
+}
+
+ALERT_OPERATORS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal
+}
+
+def parse_alert_rule(text: str) -> Dict:
+    """
+    Interpreta una regla de alerta escrita por el usuario
+
+    Formatos admitidos (opcionalmente precedidos de "SÍMBOLO:"):
+    - "change_percent < -2" (campo, operador y umbral)
+    - "price crosses MA50" / "price crosses above MA50" / "price crosses below MA50"
+    - "market opens" / "market closes"
+
+    Args:
+        text: Texto de la regla
+
+    Returns:
+        Diccionario con el tipo de regla y sus parámetros
+
+    Raises:
+        ValueError: Si la regla no se puede interpretar
+    """
+    rule = {"text": text.strip(), "symbol": None}
+    body = rule["text"]
+
+    if ":" in body:
+        symbol, body = (part.strip() for part in body.split(":", 1))
+        if symbol not in GLOBAL_MARKETS:
+            raise ValueError(f"Símbolo desconocido: {symbol}")
+        rule["symbol"] = symbol
+
+    tokens = body.lower().split()
+
+    if tokens in (["market", "opens"], ["market", "closes"]):
+        rule.update(kind="session", direction="open" if tokens[1] == "opens" else "close")
+        return rule
+
+    if len(tokens) >= 3 and tokens[0] == "price" and tokens[1] == "crosses" and tokens[-1] == "ma50":
+        direction = tokens[2] if len(tokens) == 4 else "any"
+        if direction not in ("above", "below", "any") or len(tokens) > 4:
+            raise ValueError(f"Dirección de cruce no válida: {body}")
+        rule.update(kind="cross", direction=direction)
+        return rule
+
+    if len(tokens) == 3 and tokens[0] in ALERT_FIELDS and tokens[1] in ALERT_OPERATORS:
+        try:
+            threshold = float(tokens[2])
+        except ValueError:
+            raise ValueError(f"Umbral no numérico: {tokens[2]}")
+        rule.update(
+            kind="threshold",
+            field=ALERT_FIELDS[tokens[0]],
+            op=tokens[1],
+            threshold=threshold
+        )
+        return rule
+
+    raise ValueError(f"Regla no reconocida: {body}")
+
+class LogAlertSink:
+    """
+    Entrega las alertas al log de la aplicación
+    """
+
+    def deliver(self, alerts: List[Dict]) -> None:
+        for alert in alerts:
+            logger.info(f"🔔 Alerta [{alert['symbol']}] {alert['rule']}: {alert['message']}")
+
+class FileAlertSink:
+    """
+    Añade las alertas a un fichero JSON Lines
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def deliver(self, alerts: List[Dict]) -> None:
+        with self._lock, open(self.path, "a", encoding="utf-8") as handle:
+            for alert in alerts:
+                handle.write(json.dumps(alert, ensure_ascii=False) + "\n")
+
+class WebhookAlertSink:
+    """
+    Envía las alertas por POST (JSON) a una URL, en segundo plano
+    """
+
+    def __init__(self, url: str, timeout: float = 5):
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, alerts: List[Dict]) -> None:
+        threading.Thread(target=self._post, args=(alerts,), daemon=True).start()
+
+    def _post(self, alerts: List[Dict]) -> None:
+        try:
+            requests.post(self.url, json={"alerts": alerts}, timeout=self.timeout)
+        except Exception as e:
+            logger.warning(f"Error enviando alertas al webhook {self.url}: {str(e)}")
+
+def create_alert_sink(kind: str, target: str):
+    """
+    Crea el destino de alertas configurado
+
+    Args:
+        kind: "log", "file" o "webhook"
+        target: Ruta del fichero o URL del webhook
+
+    Returns:
+        Objeto con método deliver(alerts)
+    """
+    if kind == "file":
+        return FileAlertSink(target)
+    if kind == "webhook":
+        return WebhookAlertSink(target)
+    return LogAlertSink()
+
+class AlertEngine:
+    """
+    Evalúa todas las reglas de alerta contra cada snapshot en una sola pasada
+
+    Las reglas se compilan en arrays de NumPy agrupados por tipo (y por
+    campo/operador en las de umbral), de modo que cada evaluación es una
+    operación vectorizada reglas × símbolos. Solo se entregan los flancos
+    de subida: una regla de umbral vuelve a disparar cuando su condición
+    deja de cumplirse y se cumple de nuevo.
+    """
+
+    def __init__(self, symbols: List[str], sink):
+        # Mismo orden que las columnas del snapshot (el de GLOBAL_MARKETS)
+        self.symbols = list(symbols)
+        self.sink = sink
+        self._symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._rules: Dict[str, Dict] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._rules_version = 0
+        self._groups: List[Dict] = []
+        self._prev_above = None
+        self._prev_valid = None
+        self._prev_open = None
+        self._evaluated = None
+        self._history = deque(maxlen=ALERT_HISTORY_SIZE)
+        self._lock = threading.Lock()
+
+    def set_rules(self, owner: str, texts: List[str]) -> List[str]:
+        """
+        Sustituye las reglas de un usuario
+
+        Args:
+            owner: Identificador del propietario (sesión)
+            texts: Reglas en texto, una por elemento
+
+        Returns:
+            Lista de errores de interpretación (vacía si todas son válidas)
+        """
+        parsed, errors = {}, []
+        for text in texts:
+            if not text.strip():
+                continue
+            try:
+                rule = parse_alert_rule(text)
+            except ValueError as e:
+                errors.append(str(e))
+                continue
+            rule["owner"] = owner
+            rule["id"] = f"{owner}:{rule['text']}"
+            parsed[rule["id"]] = rule
+
+        with self._lock:
+            self._rules = {k: v for k, v in self._rules.items() if v["owner"] != owner}
+            self._rules.update(parsed)
+            self._last_seen[owner] = time.time()
+            self._compile()
+        return errors
+
+    def touch(self, owner: str) -> bool:
+        """
+        Marca la actividad de un propietario para que no caduquen sus reglas
+
+        Args:
+            owner: Identificador del propietario (sesión)
+
+        Returns:
+            False si el propietario no tiene reglas registradas (nunca las
+            tuvo o caducaron) y hay que volver a enviarlas con set_rules()
+        """
+        with self._lock:
+            if owner not in self._last_seen:
+                return False
+            self._last_seen[owner] = time.time()
+            return True
+
+    def _prune(self, now: float) -> None:
+        """
+        Descarta las reglas de las sesiones sin actividad en ALERT_SESSION_TTL
+        """
+        expired = {owner for owner, seen in self._last_seen.items() if now - seen > ALERT_SESSION_TTL}
+        if not expired:
+            return
+        for owner in expired:
+            del self._last_seen[owner]
+        self._rules = {k: v for k, v in self._rules.items() if v["owner"] not in expired}
+        self._history = deque(
+            (alert for alert in self._history if alert["owner"] not in expired),
+            maxlen=ALERT_HISTORY_SIZE
+        )
+        self._compile()
+
+    def _compile(self) -> None:
+        """
+        Agrupa las reglas en arrays y conserva el estado de disparo previo
+        """
+        previous = {}
+        for group in self._groups:
+            for i, rule_id in enumerate(group["ids"]):
+                previous[rule_id] = group["fired"][i]
+
+        buckets: Dict[Tuple, List[Dict]] = {}
+        for rule in self._rules.values():
+            if rule["kind"] == "threshold":
+                key = ("threshold", rule["field"], rule["op"])
+            else:
+                key = (rule["kind"], rule["direction"])
+            buckets.setdefault(key, []).append(rule)
+
+        self._groups = []
+        for key, rules in buckets.items():
+            scope = np.ones((len(rules), len(self.symbols)), dtype=bool)
+            for i, rule in enumerate(rules):
+                if rule["symbol"] is not None:
+                    scope[i] = False
+                    scope[i, self._symbol_index[rule["symbol"]]] = True
+
+            fired = np.zeros_like(scope)
+            for i, rule in enumerate(rules):
+                if rule["id"] in previous:
+                    fired[i] = previous[rule["id"]]
+
+            self._groups.append({
+                "key": key,
+                "ids": [rule["id"] for rule in rules],
+                "rules": rules,
+                "scope": scope,
+                "thresholds": np.array([rule.get("threshold", np.nan) for rule in rules]),
+                "fired": fired
+            })
+
+        self._rules_version += 1
+
+    def evaluate(self, snapshot: Mapping) -> List[Dict]:
+        """
+        Evalúa las reglas contra un snapshot (una sola vez por snapshot y reglas)
+
+        Args:
+            snapshot: Snapshot de mercado
+
+        Returns:
+            Alertas nuevas entregadas al destino configurado
+        """
+        with self._lock:
+            self._prune(time.time())
+            evaluation_key = (getattr(snapshot, "version", id(snapshot)), self._rules_version)
+            if evaluation_key == self._evaluated:
+                return []
+            self._evaluated = evaluation_key
+
+            values = {field: snapshot.column(field) for field in set(ALERT_FIELDS.values())}
+            is_open = np.array([
+                get_market_status(
+                    GLOBAL_MARKETS[symbol]["timezone"],
+                    GLOBAL_MARKETS[symbol]["market_open"],
+                    GLOBAL_MARKETS[symbol]["market_close"]
+                )["is_open"] if snapshot.get(symbol) else False
+                for symbol in self.symbols
+            ])
+            with np.errstate(invalid="ignore"):
+                above = values["current_price"] > values["ma50"]
+            # Un cruce solo cuenta si precio y MA50 eran válidos en ambos snapshots
+            valid = np.isfinite(values["current_price"]) & np.isfinite(values["ma50"])
+
+            prev_above = above if self._prev_above is None else self._prev_above
+            prev_valid = valid if self._prev_valid is None else self._prev_valid
+            prev_open = is_open if self._prev_open is None else self._prev_open
+            crossable = valid & prev_valid
+
+            events = {
+                ("cross", "above"): ~prev_above & above & crossable,
+                ("cross", "below"): prev_above & ~above & crossable,
+                ("session", "open"): ~prev_open & is_open,
+                ("session", "close"): prev_open & ~is_open
+            }
+            events[("cross", "any")] = events[("cross", "above")] | events[("cross", "below")]
+
+            alerts = []
+            for group in self._groups:
+                kind = group["key"][0]
+                if kind == "threshold":
+                    _, field, op = group["key"]
+                    with np.errstate(invalid="ignore"):
+                        condition = ALERT_OPERATORS[op](
+                            values[field][None, :], group["thresholds"][:, None]
+                        )
+                    condition &= group["scope"]
+                    new = condition & ~group["fired"]
+                    group["fired"] = condition
+                else:
+                    new = group["scope"] & events[group["key"]][None, :]
+
+                for rule_idx, symbol_idx in zip(*np.nonzero(new)):
+                    alerts.append(self._build_alert(
+                        group["rules"][rule_idx], self.symbols[symbol_idx], values, symbol_idx
+                    ))
+
+            self._prev_above = above
+            self._prev_valid = valid
+            self._prev_open = is_open
+            self._history.extend(alerts)
+
+        if alerts:
+            try:
+                self.sink.deliver(alerts)
+            except Exception as e:
+                logger.warning(f"Error entregando alertas: {str(e)}")
+        return alerts
+
+    def _build_alert(self, rule: Dict, symbol: str, values: Dict, idx: int) -> Dict:
+        """
+        Construye el registro de una alerta disparada
+        """
+        price = values["current_price"][idx]
+        change = values["change_percent"][idx]
+        return {
+            "owner": rule["owner"],
+            "rule": rule["text"],
+            "symbol": symbol,
+            "name": GLOBAL_MARKETS[symbol]["name"],
+            "message": f"{GLOBAL_MARKETS[symbol]['name']} {price:,.2f} ({change:+.2f}%)",
+            "triggered_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+    def recent(self, owner: str, limit: int = 10) -> List[Dict]:
+        """
+        Últimas alertas de un propietario, de la más reciente a la más antigua
+        """
+        with self._lock:
+            owned = [alert for alert in self._history if alert["owner"] == owner]
+        return owned[::-1][:limit]
+
+@st.cache_resource
+def get_alert_engine() -> AlertEngine:
+    """
+    Motor de alertas compartido por todas las sesiones del proceso
+    """
+    return AlertEngine(list(GLOBAL_MARKETS.keys()), create_alert_sink(ALERT_SINK, ALERT_SINK_TARGET))
+
+def get_session_id() -> str:
+    """
+    Identificador estable de la sesión actual
+    """
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+    return st.session_state["session_id"]
+
+def create_alerts_panel() -> None:
+    """
+    Crea el panel de reglas de alerta y muestra las alertas de la sesión
+
+    Las reglas se evalúan al completarse cada snapshot (SnapshotBuilder),
+    no al pintar este panel.
+    """
+    engine = get_alert_engine()
+    owner = get_session_id()
+
+    with st.sidebar.expander("🔔 Alertas"):
+        rules_text = st.text_area(
+            "Reglas (una por línea):",
+            key="alert_rules",
+            placeholder="change_percent < -2\n^GSPC: price crosses MA50\nmarket opens",
+            help="Campos: change_percent, price, change_absolute, volume, ma50. "
+                 "Prefijo opcional 'SÍMBOLO:' para limitar la regla a un mercado."
+        )
+
+        # Solo recompilar cuando el texto cambia (o si las reglas caducaron
+        # por inactividad de la sesión)
+        if not engine.touch(owner):
+            st.session_state.pop("alert_rules_applied", None)
+        if st.session_state.get("alert_rules_applied") != rules_text:
+            st.session_state["alert_rules_errors"] = engine.set_rules(owner, rules_text.splitlines())
+            st.session_state["alert_rules_applied"] = rules_text
+
+        for error in st.session_state.get("alert_rules_errors", []):
+            st.warning(f"⚠️ {error}")
+
+        recent = engine.recent(owner)
+        if recent:
+            for alert in recent:
+                st.write(f"**{alert['triggered_at'][11:]}** • {alert['rule']} → {alert['message']}")
+        else:
+            st.caption("Sin alertas disparadas")
+
+# 4.5 EXPORTACIÓN DE DATOS
+# ====================================================================
+
+# Formatos de exportación: (tipo MIME, extensión)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows")
+}
+
+# Conjuntos de datos exportables
+EXPORT_DATASETS = {
+    "snapshot": "📸 Snapshot actual",
+    "history": "🧠 Historial de ticks",
+    "daily": "📅 Histórico diario"
+}
+
+# Conjuntos que solo tienen sentido dentro del proceso de la app: el
+# historial de ticks vive en memoria y un proceso nuevo lo tendría vacío
+EXPORT_IN_PROCESS_DATASETS = ("history",)
+
+# Filas por bloque al generar la exportación
+EXPORT_CHUNK_ROWS = 50_000
+
+def snapshot_to_frame(snapshot: Mapping) -> pd.DataFrame:
+    """
+    Convierte el snapshot en una tabla con una fila por mercado
+
+    Args:
+        snapshot: Snapshot de mercado
+
+    Returns:
+        DataFrame con datos de cotización e información del mercado
+    """
+    rows = []
+    for symbol, data in snapshot.items():
+        if data is None:
+            continue
+        info = GLOBAL_MARKETS.get(symbol, {})
+        rows.append({
+            "symbol": symbol,
+            "name": info.get("name"),
+            "country": info.get("country"),
+            "continent": info.get("continent"),
+            "currency": info.get("currency"),
+            "current_price": data["current_price"],
+            "previous_close": data["previous_close"],
+            "change_percent": data["change_percent"],
+            "change_absolute": data["change_absolute"],
+            "volume": data["volume"],
+            "ma50": data["ma50"],
+            "ma50_trend": data["ma50_trend"],
+            "timestamp": pd.to_datetime(data["timestamp"], unit="s", utc=True),
+            "data_source": data["data_source"]
+        })
+    frame = pd.DataFrame(rows)
+    if not frame.empty:
+        frame["ma50"] = frame["ma50"].astype(float)
+    return frame
+
+def iter_history_frames(history: TickHistoryStore, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """
+    Recorre el historial de ticks en bloques de como mucho chunk_rows filas
+
+    Args:
+        history: Historial de ticks
+        chunk_rows: Tamaño máximo de cada bloque
+
+    Yields:
+        DataFrames con columnas symbol, timestamp y price
+    """
+    yielded = False
+    for symbol in history.memory_usage()["symbols"]:
+        timestamps, prices = history.window(symbol)
+        # Copiar: las vistas del buffer cambian con el siguiente tick
+        timestamps, prices = timestamps.copy(), prices.copy()
+        for start in range(0, len(prices), chunk_rows):
+            yielded = True
+            yield pd.DataFrame({
+                "symbol": symbol,
+                "timestamp": pd.to_datetime(timestamps[start:start + chunk_rows], unit="s", utc=True),
+                "price": prices[start:start + chunk_rows]
+            })
+    if not yielded:
+        yield pd.DataFrame({
+            "symbol": pd.Series(dtype=str),
+            "timestamp": pd.Series(dtype="datetime64[ns, UTC]"),
+            "price": pd.Series(dtype=float)
+        })
+
+def iter_daily_history_frames(base_dir: Optional[str] = None):
+    """
+    Recorre el histórico diario en disco partición a partición
+
+    Args:
+        base_dir: Directorio del histórico (por defecto, HISTORY_DIR)
+
+    Yields:
+        DataFrames con columna symbol más las columnas de DAILY_BAR_COLUMNS
+    """
+    base_dir = base_dir or HISTORY_DIR
+    yielded = False
+    if os.path.isdir(base_dir):
+        for entry in sorted(os.listdir(base_dir)):
+            if not entry.startswith("symbol="):
+                continue
+            folder = os.path.join(base_dir, entry)
+            for name in sorted(os.listdir(folder)):
+                if name.endswith(".parquet"):
+                    frame = pd.read_parquet(os.path.join(folder, name))[DAILY_BAR_COLUMNS]
+                    frame.insert(0, "symbol", entry[len("symbol="):])
+                    yielded = True
+                    yield frame
+    if not yielded:
+        yield pd.DataFrame({
+            "symbol": pd.Series(dtype=str),
+            "date": pd.Series(dtype="datetime64[ns, UTC]"),
+            **{column: pd.Series(dtype=float) for column in DAILY_BAR_COLUMNS[1:]}
+        })
+
+def iter_dataset_frames(dataset: str, snapshot: Mapping):
+    """
+    Bloques de DataFrame del conjunto de datos pedido
+
+    Args:
+        dataset: Clave de EXPORT_DATASETS
+        snapshot: Snapshot de mercado actual
+    """
+    if dataset == "snapshot":
+        yield snapshot_to_frame(snapshot)
+    elif dataset == "history":
+        yield from iter_history_frames(get_tick_history())
+    elif dataset == "daily":
+        yield from iter_daily_history_frames()
+    else:
+        raise ValueError(f"Conjunto de datos desconocido: {dataset}")
+
+class ChunkSink(io.RawIOBase):
+    """
+    Destino de escritura que acumula bytes hasta que se vacía con drain()
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+def iter_export_chunks(frames, fmt: str):
+    """
+    Serializa una secuencia de DataFrames bloque a bloque
+
+    Cada bloque se escribe y se entrega en cuanto está listo, de modo que
+    la exportación completa nunca se construye entera en memoria.
+
+    Args:
+        frames: Iterable de DataFrames con el mismo esquema
+        fmt: Clave de EXPORT_FORMATS
+
+    Yields:
+        Bytes del fichero exportado, en orden
+    """
+    if fmt == "csv":
+        for idx, frame in enumerate(frames):
+            yield frame.to_csv(index=False, header=(idx == 0)).encode("utf-8")
+        return
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportación desconocido: {fmt}")
+
+    sink = ChunkSink()
+    writer = schema = None
+    for frame in frames:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if writer is None:
+            schema = table.schema
+            if fmt == "parquet":
+                writer = pq.ParquetWriter(sink, schema)
+            else:
+                writer = pa.ipc.new_stream(sink, schema)
+        writer.write_table(table.cast(schema))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+class ExportCache:
+    """
+    Ficheros de exportación ya generados, válidos hasta el siguiente refresco
+
+    Los ficheros temporales se borran al cambiar de snapshot y al salir
+    del proceso.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._files: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def get(self, snapshot, dataset: str, fmt: str) -> str:
+        """
+        Devuelve la ruta del fichero exportado, generándolo si hace falta
+
+        Args:
+            snapshot: Snapshot de mercado actual
+            dataset: Clave de EXPORT_DATASETS
+            fmt: Clave de EXPORT_FORMATS
+
+        Returns:
+            Ruta de un fichero temporal con la exportación
+        """
+        with self._lock:
+            if snapshot.version != self._version:
+                self._clear()
+                self._version = snapshot.version
+
+            key = (dataset, fmt)
+            if key not in self._files:
+                suffix = "." + EXPORT_FORMATS[fmt][1]
+                with tempfile.NamedTemporaryFile("wb", suffix=suffix, delete=False) as handle:
+                    try:
+                        for chunk in iter_export_chunks(iter_dataset_frames(dataset, snapshot), fmt):
+                            handle.write(chunk)
+                    except BaseException:
+                        handle.close()
+                        os.unlink(handle.name)
+                        raise
+                self._files[key] = handle.name
+            return self._files[key]
+
+    def close(self) -> None:
+        """
+        Borra todos los ficheros temporales generados
+        """
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        for path in self._files.values():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self._files = {}
+
+@st.cache_resource
+def get_export_cache() -> ExportCache:
+    """
+    Cache de exportaciones compartida por todas las sesiones del proceso
+    """
+    return ExportCache()
+
+def create_export_panel(snapshot) -> None:
+    """
+    Crea el panel de descargas en el sidebar
+
+    La exportación solo se genera cuando el usuario la pide y se reutiliza
+    hasta el siguiente refresco del snapshot. El fichero se escribe en disco
+    por bloques, pero st.download_button lo lee entero en memoria: la
+    descarga no se transmite en streaming.
+
+    Args:
+        snapshot: Snapshot de mercado actual
+    """
+    with st.sidebar.expander("📥 Exportar Datos"):
+        dataset = st.selectbox(
+            "Datos:", list(EXPORT_DATASETS), format_func=EXPORT_DATASETS.get, key="export_dataset"
+        )
+        fmt = st.selectbox(
+            "Formato:", list(EXPORT_FORMATS), format_func=str.upper, key="export_format"
+        )
+
+        requested = st.session_state.get("export_requested")
+        if requested != (snapshot.version, dataset, fmt):
+            if st.button("📦 Preparar exportación", key="export_prepare"):
+                st.session_state["export_requested"] = (snapshot.version, dataset, fmt)
+                st.rerun()
+            return
+
+        path = get_export_cache().get(snapshot, dataset, fmt)
+        mime, extension = EXPORT_FORMATS[fmt]
+        with open(path, "rb") as handle:
+            st.download_button(
+                f"⬇️ Descargar {extension.upper()}",
+                data=handle,
+                file_name=f"mercados_{dataset}_{snapshot.created_at.strftime('%Y%m%d_%H%M')}.{extension}",
+                mime=mime,
+                key="export_download"
+            )
+        st.caption(
+            f"{os.path.getsize(path) / 1024:,.1f} KB • la descarga se sirve completa desde memoria, "
+            "sin streaming; para volúmenes grandes usa export_data.py"
+        )
+
+# 4.6 SPARKLINES INTRADÍA
+# ====================================================================
+
+# Puntos por sparkline tras el downsampling y tamaño del SVG de las tarjetas
+SPARKLINE_POINTS = 48
+SPARKLINE_WIDTH = 120
+SPARKLINE_HEIGHT = 28
+SPARKLINE_CACHE_SIZE = 1024
+
+SPARKLINE_COLORS = {"gain": "#28a745", "loss": "#dc3545", "flat": "#6c757d"}
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, n_out: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce una serie con Largest-Triangle-Three-Buckets
+
+    Conserva el primer y el último punto y, de cada bucket intermedio, el
+    punto que forma el triángulo de mayor área con el punto elegido antes
+    y la media del bucket siguiente. Mantiene picos y valles visibles con
+    un número fijo de puntos.
+
+    Args:
+        x: Eje horizontal (creciente)
+        y: Valores
+        n_out: Número de puntos deseado
+
+    Returns:
+        Tupla (x, y) con como mucho n_out puntos
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    bucket_size = (n - 2) / (n_out - 2)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return x[selected], y[selected]
+
+class SparklineCache:
+    """
+    Caché LRU de sparklines ya reducidas, por (símbolo, origen, última barra)
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[float, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Tuple, compute) -> Tuple[float, ...]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        points = compute()
+
+        with self._lock:
+            self._entries[key] = points
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return points
+
+@st.cache_resource
+def get_sparkline_cache() -> SparklineCache:
+    """
+    Caché de sparklines compartida por todas las sesiones del proceso
+    """
+    return SparklineCache(SPARKLINE_CACHE_SIZE)
+
+def downsample_sparkline(symbol: str, source: str, timestamps: np.ndarray, prices: np.ndarray) -> Tuple[float, ...]:
+    """
+    Reduce una serie a SPARKLINE_POINTS puntos, cacheando por su última barra
+
+    Args:
+        symbol: Símbolo del mercado
+        source: Origen de la serie ("intraday" o "ticks")
+        timestamps: Timestamps de la serie (epoch)
+        prices: Precios de la serie
+
+    Returns:
+        Tupla de precios reducida (vacía si hay menos de 2 puntos)
+    """
+    if len(prices) < 2:
+        return ()
+
+    key = (symbol, source, int(timestamps[-1]), len(prices))
+
+    def compute() -> Tuple[float, ...]:
+        _, reduced = lttb_downsample(
+            np.asarray(timestamps, dtype=float), np.asarray(prices, dtype=float), SPARKLINE_POINTS
+        )
+        return tuple(round(float(p), 2) for p in reduced)
+
+    return get_sparkline_cache().get_or_compute(key, compute)
+
+def build_intraday_sparkline(symbol: str, result: Dict) -> Tuple[float, ...]:
+    """
+    Sparkline a partir de la serie de cierres intradía del endpoint chart
+
+    Args:
+        symbol: Símbolo del mercado
+        result: Elemento chart.result[0] de la respuesta de Yahoo
+
+    Returns:
+        Tupla de precios reducida
+    """
+    timestamps = result.get('timestamp') or []
+    quotes = (result.get('indicators', {}).get('quote') or [{}])[0]
+    closes = quotes.get('close') or []
+
+    pairs = [(t, c) for t, c in zip(timestamps, closes) if t is not None and c is not None]
+    if len(pairs) < 2:
+        return ()
+
+    series = np.array(pairs, dtype=float)
+    return downsample_sparkline(symbol, "intraday", series[:, 0], series[:, 1])
+
+def get_sparkline(symbol: str, data: Mapping) -> Tuple[float, ...]:
+    """
+    Sparkline de un mercado: serie intradía si existe, si no el historial de ticks
+
+    Args:
+        symbol: Símbolo del mercado
+        data: Datos del mercado
+
+    Returns:
+        Tupla de precios reducida (vacía si no hay serie)
+    """
+    if data.get("sparkline"):
+        return tuple(data["sparkline"])
+
+    timestamps, prices = get_tick_history().window(symbol)
+    return downsample_sparkline(symbol, "ticks", timestamps, prices)
+
+def render_sparkline_svg(points: Tuple[float, ...], tone: str) -> str:
+    """
+    SVG en línea con la sparkline para las tarjetas
+
+    Args:
+        points: Precios ya reducidos
+        tone: Clase de rendimiento ("gain", "loss" o "flat")
+
+    Returns:
+        Fragmento SVG (vacío si no hay puntos suficientes)
+    """
+    if len(points) < 2:
+        return ""
+
+    low, high = min(points), max(points)
+    span = (high - low) or 1
+    step = SPARKLINE_WIDTH / (len(points) - 1)
+    coords = " ".join(
+        f"{i * step:.1f},{SPARKLINE_HEIGHT - 2 - (p - low) / span * (SPARKLINE_HEIGHT - 4):.1f}"
+        for i, p in enumerate(points)
+    )
+    return (
+        f'<svg class="mk-spark" width="{SPARKLINE_WIDTH}" height="{SPARKLINE_HEIGHT}" '
+        f'viewBox="0 0 {SPARKLINE_WIDTH} {SPARKLINE_HEIGHT}">'
+        f'<polyline fill="none" stroke="{SPARKLINE_COLORS[tone]}" stroke-width="1.5" points="{coords}"/>'
+        f'</svg>'
+    )
+
+# 4.7 HISTÓRICO DIARIO EN DISCO
+# ====================================================================
+
+# Directorio del histórico diario particionado (symbol=.../year=....parquet)
+HISTORY_DIR = os.environ.get("MARKET_HISTORY_DIR", os.path.join("data", "history"))
+
+DAILY_BAR_COLUMNS = ["date", "open", "high", "low", "close", "volume"]
+
+def history_partition_path(symbol: str, year: int, base_dir: str = HISTORY_DIR) -> str:
+    """
+    Ruta del fichero de un símbolo y año dentro del histórico particionado
+    """
+    return os.path.join(base_dir, f"symbol={symbol}", f"year={year}.parquet")
+
+def write_atomic(path: str, write) -> None:
+    """
+    Escribe un fichero de forma atómica (temporal en el mismo directorio + rename)
+
+    Args:
+        path: Ruta final
+        write: Función que recibe la ruta temporal y escribe el contenido
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(handle)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_history_partition(symbol: str, year: int, bars: pd.DataFrame, base_dir: str = HISTORY_DIR) -> str:
+    """
+    Guarda las barras diarias de un símbolo y año
+
+    Returns:
+        Ruta del fichero escrito
+    """
+    path = history_partition_path(symbol, year, base_dir)
+    write_atomic(path, lambda tmp: bars[DAILY_BAR_COLUMNS].to_parquet(tmp, index=False))
+    return path
+
+def load_daily_history(symbols: Optional[List[str]] = None, base_dir: str = HISTORY_DIR) -> pd.DataFrame:
+    """
+    Carga el histórico diario guardado
+
+    Args:
+        symbols: Símbolos a cargar (por defecto, todos los que haya en disco)
+        base_dir: Directorio del histórico
+
+    Returns:
+        DataFrame con columna symbol más las columnas de DAILY_BAR_COLUMNS
+    """
+    frames = []
+    if os.path.isdir(base_dir):
+        for entry in sorted(os.listdir(base_dir)):
+            if not entry.startswith("symbol="):
+                continue
+            symbol = entry[len("symbol="):]
+            if symbols is not None and symbol not in symbols:
+                continue
+            folder = os.path.join(base_dir, entry)
+            for name in sorted(os.listdir(folder)):
+                if name.endswith(".parquet"):
+                    frame = pd.read_parquet(os.path.join(folder, name))
+                    frame.insert(0, "symbol", symbol)
+                    frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=["symbol"] + DAILY_BAR_COLUMNS)
+    return pd.concat(frames, ignore_index=True).sort_values(["symbol", "date"], ignore_index=True)
+
+def parse_yahoo_daily_bars(data: Dict, timezone: str = "UTC") -> pd.DataFrame:
+    """
+    Convierte una respuesta chart con interval=1d en barras diarias
+
+    La fecha de cada barra es la de la sesión en la hora local del mercado
+    (la ASX abre a las 23:00 UTC del día anterior en verano austral),
+    guardada como medianoche UTC de esa fecha.
+
+    Args:
+        data: JSON devuelto por /v8/finance/chart
+        timezone: Zona horaria del mercado si la respuesta no la indica
+
+    Returns:
+        DataFrame con DAILY_BAR_COLUMNS (vacío si no hay datos)
+    """
+    results = (data.get('chart') or {}).get('result') or []
+    if not results or not results[0].get('timestamp'):
+        return pd.DataFrame(columns=DAILY_BAR_COLUMNS)
+
+    result = results[0]
+    quote = result['indicators']['quote'][0]
+    timezone = (result.get('meta') or {}).get('exchangeTimezoneName') or timezone
+    local = pd.to_datetime(result['timestamp'], unit="s", utc=True).tz_convert(timezone)
+    bars = pd.DataFrame({
+        "date": local.tz_localize(None).normalize().tz_localize("UTC"),
+        "open": quote.get('open'),
+        "high": quote.get('high'),
+        "low": quote.get('low'),
+        "close": quote.get('close'),
+        "volume": quote.get('volume')
+    })
+    bars = bars.dropna(subset=["close"]).drop_duplicates("date", keep="last")
+    bars[["open", "high", "low", "close"]] = bars[["open", "high", "low", "close"]].astype(float)
+    bars["volume"] = bars["volume"].fillna(0).astype("int64")
+    return bars.reset_index(drop=True)
+
+def fetch_daily_bars_yahoo(symbol: str, start: datetime, end: datetime,
+                           host: str = YAHOO_HOSTS[0], timeout: float = 20) -> pd.DataFrame:
+    """
+    Descarga barras diarias de Yahoo Finance para un rango de fechas
+
+    Args:
+        symbol: Símbolo del índice
+        start: Inicio del rango (incluido)
+        end: Fin del rango (excluido)
+        host: Host de Yahoo Finance
+        timeout: Timeout de la petición en segundos
+
+    Returns:
+        DataFrame con DAILY_BAR_COLUMNS
+
+    Raises:
+        requests.RequestException: Si la petición falla
+    """
+    response = requests.get(
+        f"{yahoo_base_url(host)}/v8/finance/chart/{symbol}",
+        params={
+            "period1": int(start.timestamp()),
+            "period2": int(end.timestamp()),
+            "interval": "1d"
+        },
+        headers=YAHOO_HEADERS,
+        timeout=timeout
+    )
+    response.raise_for_status()
+    return parse_yahoo_daily_bars(response.json(), GLOBAL_MARKETS.get(symbol, {}).get("timezone", "UTC"))
+
+def generate_daily_bars(symbol: str, start: datetime, end: datetime) -> pd.DataFrame:
+    """
+    Barras diarias simuladas (paseo aleatorio reproducible) para entornos sin API
+
+    El paseo arranca siempre el 3/1/2000 con la misma semilla por símbolo,
+    así que rangos pedidos por separado encajan sin saltos entre sí.
+
+    Args:
+        symbol: Símbolo del índice
+        start: Inicio del rango (incluido)
+        end: Fin del rango (excluido)
+
+    Returns:
+        DataFrame con DAILY_BAR_COLUMNS en días laborables
+    """
+    last_day = pd.Timestamp(end - timedelta(days=1))
+    if last_day.tzinfo is not None:
+        last_day = last_day.tz_convert("UTC").tz_localize(None)
+    dates = pd.bdate_range("2000-01-03", last_day, tz="UTC")
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+
+    base_price = GLOBAL_MARKETS.get(symbol, {}).get("base_price", 1000)
+    closes = 0.5 * base_price * np.exp(np.cumsum(rng.normal(0.0001, 0.011, len(dates))))
+    opens = closes * (1 + rng.normal(0, 0.003, len(dates)))
+    spread = np.abs(rng.normal(0, 0.006, len(dates)))
+    volumes = rng.integers(10**8, 10**9, len(dates))
+
+    bars = pd.DataFrame({
+        "date": dates,
+        "open": opens,
+        "high": np.maximum(opens, closes) * (1 + spread),
+        "low": np.minimum(opens, closes) * (1 - spread),
+        "close": closes,
+        "volume": volumes
+    })
+    return bars[bars["date"] >= pd.Timestamp(start)].reset_index(drop=True)
+
+# 4.8 AGREGADOS JERÁRQUICOS
+# ====================================================================
+
+# Cestas por defecto; se pueden sustituir con ROLLUP_BASKETS (JSON nombre → símbolos)
+DEFAULT_ROLLUP_BASKETS = {
+    "🏛️ G7": ["^GSPC", "^GSPTSE", "^FTSE", "^GDAXI", "^FCHI", "^N225"],
+    "🇪🇺 Eurozona": ["^GDAXI", "^FCHI", "^IBEX"],
+    "🌱 Emergentes": ["000001.SS", "^HSI", "^BVSP", "^MXX"]
+}
+
+# Árboles de agrupación disponibles en la interfaz
+ROLLUP_TREES = {
+    "Continente → País → Índice": "geography",
+    "Cestas personalizadas": "baskets"
+}
+
+# Ponderaciones disponibles en la interfaz
+ROLLUP_WEIGHTINGS = {
+    "Igual ponderación": "equal",
+    "Por capitalización": "cap"
+}
+
+# Actualizaciones incrementales antes de recalcular las sumas desde cero
+ROLLUP_RESYNC_UPDATES = 1000
+
+def load_rollup_baskets() -> Dict[str, List[str]]:
+    """
+    Lee las cestas personalizadas de ROLLUP_BASKETS o usa las de por defecto
+    
+    Returns:
+        Diccionario nombre de cesta → símbolos conocidos
+    """
+    baskets = DEFAULT_ROLLUP_BASKETS
+    raw = os.environ.get("ROLLUP_BASKETS")
+    if raw:
+        try:
+            baskets = json.loads(raw)
+        except ValueError as e:
+            logger.error(f"ROLLUP_BASKETS no es JSON válido, se usan las cestas por defecto: {str(e)}")
+    
+    return {
+        name: [symbol for symbol in symbols if symbol in GLOBAL_MARKETS]
+        for name, symbols in baskets.items()
+    }
+
+def build_rollup_paths(baskets: Dict[str, List[str]]) -> Dict[str, Dict[str, List[Tuple[str, ...]]]]:
+    """
+    Define la ruta de cada índice dentro de cada árbol de agrupación
+    
+    Args:
+        baskets: Cestas personalizadas (un índice puede estar en varias)
+        
+    Returns:
+        Diccionario árbol → símbolo → rutas hasta la hoja
+    """
+    geography = {
+        symbol: [(info["continent"], info["country"], symbol)]
+        for symbol, info in GLOBAL_MARKETS.items()
+    }
+    
+    by_basket = {symbol: [] for symbol in GLOBAL_MARKETS}
+    for name, symbols in baskets.items():
+        for symbol in symbols:
+            by_basket[symbol].append((name, symbol))
+    
+    return {"geography": geography, "baskets": by_basket}
+
+class RollupEngine:
+    """
+    Agregados por grupo (media igual o por capitalización, amplitud,
+    dispersión y proporción de mercados abiertos) para árboles arbitrarios
+
+    Cada árbol se guarda como una matriz de pertenencia nodos × índices, y
+    cada índice aporta una fila de sumas (n, subidas, bajadas, abiertos,
+    Σw, Σwx, Σwx² por ponderación). La carga completa es un único producto
+    matricial; cuando cambia la cotización de un índice solo se suma la
+    diferencia de su fila en los nodos a los que pertenece.
+    """
+
+    # Columnas de la fila de sumas de cada índice
+    FIELDS = ("n", "up", "down", "open", "w_equal", "wx_equal", "wxx_equal", "w_cap", "wx_cap", "wxx_cap")
+
+    def __init__(self, symbols: List[str], caps: Dict[str, float],
+                 paths: Dict[str, Dict[str, List[Tuple[str, ...]]]]):
+        self.symbols = list(symbols)
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._caps = np.array([caps.get(symbol, 0.0) for symbol in self.symbols], dtype=float)
+
+        # Nodos de cada árbol en orden de recorrido (raíz primero) y pertenencia
+        self._nodes: Dict[str, List[Tuple[str, ...]]] = {}
+        self._membership: Dict[str, np.ndarray] = {}
+        self._symbol_nodes: Dict[str, List[np.ndarray]] = {}
+        for tree, symbol_paths in paths.items():
+            first_seen = {(): 0}
+            members: Dict[Tuple[str, ...], set] = {(): set()}
+            for symbol in self.symbols:
+                for path in symbol_paths.get(symbol, []):
+                    members[()].add(symbol)
+                    for depth in range(1, len(path) + 1):
+                        node = path[:depth]
+                        first_seen.setdefault(node, len(first_seen))
+                        members.setdefault(node, set()).add(symbol)
+            nodes = sorted(
+                members,
+                key=lambda node: tuple(first_seen[node[:d]] for d in range(1, len(node) + 1))
+            )
+            membership = np.zeros((len(nodes), len(self.symbols)))
+            for row, node in enumerate(nodes):
+                for symbol in members[node]:
+                    membership[row, self._index[symbol]] = 1.0
+            self._nodes[tree] = nodes
+            self._membership[tree] = membership
+            self._symbol_nodes[tree] = [np.flatnonzero(membership[:, j]) for j in range(len(self.symbols))]
+
+        self._rows = np.zeros((len(self.symbols), len(self.FIELDS)))
+        self._sums = {tree: np.zeros((len(nodes), len(self.FIELDS))) for tree, nodes in self._nodes.items()}
+        self._updates_since_resync = 0
+        self._lock = threading.Lock()
+
+    def _row(self, symbol: str, change_percent: Optional[float], is_open: bool) -> np.ndarray:
+        """
+        Fila de sumas con la que un índice contribuye a sus grupos
+        """
+        row = np.zeros(len(self.FIELDS))
+        if change_percent is None or not np.isfinite(change_percent):
+            return row
+        x = float(change_percent)
+        cap = self._caps[self._index[symbol]]
+        row[:] = (1.0, x > 0, x < 0, bool(is_open), 1.0, x, x * x, cap, cap * x, cap * x * x)
+        return row
+
+    def update(self, quotes: Dict[str, Tuple[Optional[float], bool]],
+               commit: bool = True) -> Tuple[int, "RollupState"]:
+        """
+        Aplica las cotizaciones que han cambiado de forma incremental
+
+        Args:
+            quotes: Símbolo → (cambio porcentual o None, mercado abierto)
+            commit: Si es False, los cambios se aplican solo sobre una copia
+                (snapshots con cotizaciones pendientes) y el motor no cambia
+
+        Returns:
+            Tupla (índices cuya aportación cambió, sumas resultantes congeladas)
+        """
+        with self._lock:
+            rows = self._rows if commit else self._rows.copy()
+            sums = self._sums if commit else {tree: values.copy() for tree, values in self._sums.items()}
+            changed = 0
+            for symbol, (change_percent, is_open) in quotes.items():
+                j = self._index.get(symbol)
+                if j is None:
+                    continue
+                row = self._row(symbol, change_percent, is_open)
+                delta = row - rows[j]
+                if not delta.any():
+                    continue
+                rows[j] = row
+                for tree, tree_sums in sums.items():
+                    tree_sums[self._symbol_nodes[tree][j]] += delta
+                changed += 1
+
+            if not commit:
+                return changed, RollupState(self, sums)
+
+            if changed:
+                self._updates_since_resync += changed
+                # Recalcular periódicamente para acotar el error de redondeo
+                if self._updates_since_resync >= ROLLUP_RESYNC_UPDATES:
+                    self._resync()
+            return changed, RollupState(self, {tree: values.copy() for tree, values in self._sums.items()})
+
+    def _resync(self) -> None:
+        """
+        Recalcula todas las sumas en una pasada (llamar con el lock tomado)
+        """
+        for tree, membership in self._membership.items():
+            self._sums[tree] = membership @ self._rows
+        self._updates_since_resync = 0
+
+    def _stats(self, sums: np.ndarray, weighting: str) -> Dict[str, np.ndarray]:
+        """
+        Convierte las sumas de los nodos en medias, amplitud y dispersión
+        """
+        col = {name: sums[:, i] for i, name in enumerate(self.FIELDS)}
+        n = col["n"].round()
+        w, wx, wxx = col[f"w_{weighting}"], col[f"wx_{weighting}"], col[f"wxx_{weighting}"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where((n > 0) & (w > 0), wx / w, np.nan)
+            # Con un solo mercado la varianza es 0 (evita el ruido de redondeo)
+            variance = np.where(n > 1, wxx / w - mean ** 2, np.where(n > 0, 0.0, np.nan))
+            return {
+                "markets": n.astype(int),
+                "up": col["up"].round().astype(int),
+                "down": col["down"].round().astype(int),
+                "open": col["open"].round().astype(int),
+                "mean": mean,
+                "breadth": np.where(n > 0, col["up"] / n * 100, np.nan),
+                "dispersion": np.sqrt(np.clip(variance, 0, None)),
+                "open_ratio": np.where(n > 0, col["open"] / n * 100, np.nan)
+            }
+
+class RollupState:
+    """
+    Agregados congelados tal como quedaron al construir un snapshot
+
+    Guarda una copia de las sumas de cada árbol (nodos × campos, unos pocos
+    KB), así que las tablas de un snapshot no cambian aunque el motor
+    compartido siga actualizándose con los siguientes.
+    """
+
+    def __init__(self, engine: RollupEngine, sums: Dict[str, np.ndarray]):
+        self._engine = engine
+        self._sums = sums
+
+    def node(self, tree: str, path: Tuple[str, ...] = (), weighting: str = "equal") -> Dict:
+        """
+        Agregados de un nodo concreto (por defecto la raíz)
+
+        Args:
+            tree: Árbol de agrupación ("geography" o "baskets")
+            path: Ruta del nodo, () para el total
+            weighting: "equal" o "cap"
+
+        Returns:
+            Diccionario con markets, up, down, open, mean, breadth, dispersion y open_ratio
+        """
+        row = self._engine._nodes[tree].index(path)
+        stats = self._engine._stats(self._sums[tree][row:row + 1], weighting)
+        return {name: values[0].item() for name, values in stats.items()}
+
+    def table(self, tree: str, weighting: str = "equal") -> pd.DataFrame:
+        """
+        Agregados de todos los nodos de un árbol
+
+        Args:
+            tree: Árbol de agrupación ("geography" o "baskets")
+            weighting: "equal" o "cap"
+
+        Returns:
+            DataFrame con una fila por nodo en orden de recorrido
+        """
+        nodes = self._engine._nodes[tree]
+        stats = self._engine._stats(self._sums[tree], weighting)
+
+        labels = []
+        for path in nodes:
+            if not path:
+                name = "🌍 Total"
+            elif path[-1] in GLOBAL_MARKETS:
+                info = GLOBAL_MARKETS[path[-1]]
+                name = f"{info['flag']} {info['name']}"
+            else:
+                name = path[-1]
+            labels.append("　" * len(path) + name)
+
+        return pd.DataFrame({
+            "Grupo": labels,
+            "Mercados": stats["markets"],
+            "Rendimiento (%)": stats["mean"],
+            "Amplitud (%)": stats["breadth"],
+            "Dispersión (pp)": stats["dispersion"],
+            "Abiertos (%)": stats["open_ratio"]
+        })
+
+@st.cache_resource
+def get_rollup_engine() -> RollupEngine:
+    """
+    Motor de agregados compartido por todas las sesiones del proceso
+    """
+    caps = {symbol: info.get("market_cap", 0.0) for symbol, info in GLOBAL_MARKETS.items()}
+    paths = build_rollup_paths(load_rollup_baskets())
+    return RollupEngine(list(GLOBAL_MARKETS.keys()), caps, paths)
+
+def update_rollup_engine(market_data: Dict, commit: bool = True) -> "RollupState":
+    """
+    Pasa al motor de agregados el rendimiento y el estado de cada mercado
+    
+    Args:
+        market_data: Diccionario con datos de todos los mercados
+        commit: False para un snapshot parcial: se calcula sin tocar el motor
+        
+    Returns:
+        Agregados congelados con estas cotizaciones
+    """
+    quotes = {}
+    for symbol, data in market_data.items():
+        info = GLOBAL_MARKETS.get(symbol)
+        if info is None:
+            continue
+        status = get_market_status(info["timezone"], info["market_open"], info["market_close"])
+        quotes[symbol] = (data["change_percent"] if data is not None else None, status["is_open"])
+    
+    changed, state = get_rollup_engine().update(quotes, commit=commit)
+    if commit:
+        logger.info(f"Agregados actualizados: {changed} mercados con cambios")
+    return state
+
+def create_rollup_panel(snapshot: "MarketSnapshot") -> None:
+    """
+    Muestra los agregados por grupo con el árbol y la ponderación elegidos
+    
+    Args:
+        snapshot: Snapshot mostrado (la tabla sale de sus agregados congelados)
+    """
+    st.markdown("### 🧮 Agregados por Grupo")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        tree_label = st.selectbox("Agrupación:", list(ROLLUP_TREES.keys()), key="rollup_tree")
+    with col2:
+        weighting_label = st.radio(
+            "Ponderación:",
+            list(ROLLUP_WEIGHTINGS.keys()),
+            horizontal=True,
+            key="rollup_weighting"
+        )
+    
+    if snapshot.rollup is None:
+        st.warning("⚠️ No hay agregados para este snapshot")
+        return
+    
+    tree, weighting = ROLLUP_TREES[tree_label], ROLLUP_WEIGHTINGS[weighting_label]
+    table = snapshot.derive(("rollup", tree, weighting), lambda: snapshot.rollup.table(tree, weighting))
+    st.dataframe(
+        table,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "Rendimiento (%)": st.column_config.NumberColumn(format="%+.2f%%"),
+            "Amplitud (%)": st.column_config.NumberColumn(format="%.0f%%"),
+            "Dispersión (pp)": st.column_config.NumberColumn(format="%.2f"),
+            "Abiertos (%)": st.column_config.NumberColumn(format="%.0f%%")
+        }
+    )
+    st.caption("Amplitud: % de mercados en positivo • Dispersión: desviación típica del rendimiento dentro del grupo")
+
+# 4.9 PERFILADO DE RERUNS
+# ====================================================================
+
+# Perfilar todos los reruns (PROFILE_RERUNS=1) o solo uno con ?profile=1 en la URL
+PROFILE_RERUNS = os.environ.get("PROFILE_RERUNS", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join("data", "profiles"))
+
+# Intervalo de muestreo y número de funciones del resumen
+PROFILE_INTERVAL_SECONDS = 0.005
+PROFILE_TOP_N = 25
+
+def profiling_requested() -> bool:
+    """
+    Indica si hay que perfilar este rerun
+    
+    El parámetro de URL se consume al leerlo, así que solo se perfila el
+    rerun que lo trae. Con el modo apagado el coste es una consulta a un dict.
+    
+    Returns:
+        True si el modo está activo por variable de entorno o por ?profile=1
+    """
+    if PROFILE_RERUNS:
+        return True
+    if st.query_params.get("profile") == "1":
+        del st.query_params["profile"]
+        return True
+    return False
+
+class RerunProfiler:
+    """
+    Perfilador por muestreo del hilo del script durante un rerun
+
+    Un hilo auxiliar toma la pila del hilo del script cada
+    PROFILE_INTERVAL_SECONDS con sys._current_frames() y la pondera con el
+    tiempo real transcurrido. No instrumenta ninguna función, así que el
+    coste es el del muestreo y solo existe mientras el perfil está activo.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._target = threading.get_ident()
+        self._frames: Dict[Tuple[str, str, int], int] = {}
+        self._samples: List[Tuple[int, ...]] = []
+        self._weights: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rerun-profiler", daemon=True)
+        self.started_at = datetime.now()
+        self.duration = 0.0
+
+    def start(self) -> "RerunProfiler":
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                stack.append(self._frames.setdefault(key, len(self._frames)))
+                frame = frame.f_back
+            stack.reverse()
+            self._samples.append(tuple(stack))
+            self._weights.append((now - last) * 1000)
+            last = now
+
+    def stop(self) -> "RerunProfiler":
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+        return self
+
+    def to_speedscope(self, name: str) -> Dict:
+        """
+        Perfil en formato speedscope (https://www.speedscope.app)
+
+        Args:
+            name: Nombre del perfil
+
+        Returns:
+            Diccionario listo para json.dump
+        """
+        frames = [None] * len(self._frames)
+        for (function, filename, line), index in self._frames.items():
+            frames[index] = {"name": function, "file": filename, "line": line}
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "MapaBursatil RerunProfiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(self._weights),
+                "samples": [list(stack) for stack in self._samples],
+                "weights": self._weights
+            }]
+        }
+
+    def hotspots(self, top_n: int = PROFILE_TOP_N) -> pd.DataFrame:
+        """
+        Funciones con más tiempo propio y acumulado
+
+        Args:
+            top_n: Número de funciones a devolver
+
+        Returns:
+            DataFrame ordenado por tiempo propio (ms)
+        """
+        names = {index: f"{function} ({os.path.basename(filename)}:{line})"
+                 for (function, filename, line), index in self._frames.items()}
+        own: Dict[int, float] = {}
+        total: Dict[int, float] = {}
+        for stack, weight in zip(self._samples, self._weights):
+            if not stack:
+                continue
+            own[stack[-1]] = own.get(stack[-1], 0.0) + weight
+            for index in set(stack):
+                total[index] = total.get(index, 0.0) + weight
+
+        elapsed = sum(self._weights) or 1.0
+        rows = [{
+            "función": names[index],
+            "propio_ms": own.get(index, 0.0),
+            "acumulado_ms": total[index],
+            "acumulado_%": total[index] / elapsed * 100
+        } for index in total]
+        if not rows:
+            return pd.DataFrame(columns=["función", "propio_ms", "acumulado_ms", "acumulado_%"])
+        return (pd.DataFrame(rows)
+                .sort_values(["propio_ms", "acumulado_ms"], ascending=False)
+                .head(top_n)
+                .reset_index(drop=True))
+
+    def save(self, directory: str = PROFILE_DIR, label: str = "") -> Tuple[str, str]:
+        """
+        Escribe el perfil speedscope y el resumen de hotspots
+
+        Args:
+            directory: Directorio de salida
+            label: Sufijo del nombre de fichero (ej. id de sesión)
+
+        Returns:
+            Rutas (speedscope, resumen)
+        """
+        stem = f"rerun-{self.started_at.strftime('%Y%m%d-%H%M%S')}{'-' + label if label else ''}"
+        speedscope_path = os.path.join(directory, f"{stem}.speedscope.json")
+        summary_path = os.path.join(directory, f"{stem}.txt")
+
+        profile = self.to_speedscope(stem)
+        summary = (
+            f"Rerun perfilado el {self.started_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"Duración: {self.duration * 1000:,.0f} ms • {len(self._samples)} muestras "
+            f"cada {self.interval * 1000:g} ms\n\n"
+            f"{self.hotspots().to_string(float_format=lambda v: f'{v:,.1f}')}\n"
+        )
+
+        def write_profile(tmp_path: str) -> None:
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                json.dump(profile, handle)
+
+        def write_summary(tmp_path: str) -> None:
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                handle.write(summary)
+
+        write_atomic(speedscope_path, write_profile)
+        write_atomic(summary_path, write_summary)
+        return speedscope_path, summary_path
+
+def finish_rerun_profile(profiler: RerunProfiler) -> Optional[Tuple[str, str]]:
+    """
+    Detiene el perfil del rerun y lo guarda (sin llamadas a Streamlit, se
+    ejecuta también si el rerun se interrumpe)
+    
+    Args:
+        profiler: Perfilador en marcha
+        
+    Returns:
+        Rutas escritas, o None si no se pudo guardar
+    """
+    profiler.stop()
+    try:
+        paths = profiler.save(label=get_session_id()[:8])
+    except OSError as e:
+        logger.warning(f"No se pudo guardar el perfil del rerun: {str(e)}")
+        return None
+    logger.info(f"Perfil del rerun ({profiler.duration * 1000:,.0f} ms) guardado en {paths[0]}")
+    return paths
+
+# 4.10 VELAS INTRADÍA
+# ====================================================================
+
+# Temporalidades de las velas y su regla de pandas; todas salen de las barras de 1 minuto
+CANDLE_TIMEFRAMES = {
+    "1m": None,
+    "5m": "5min",
+    "15m": "15min",
+    "1h": "60min",
+    "1d": "1D"
+}
+
+# Barras base que se piden al endpoint chart (Yahoo permite 1m hasta 7 días)
+INTRADAY_BASE_INTERVAL = "1m"
+INTRADAY_RANGE = "5d"
+
+OHLC_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+# Agregación de cada columna al pasar a una temporalidad mayor
+OHLC_AGGREGATION = {
+    "open": "first",
+    "high": "max",
+    "low": "min",
+    "close": "last",
+    "volume": "sum"
+}
+
+def parse_yahoo_intraday_bars(data: Dict) -> pd.DataFrame:
+    """
+    Convierte una respuesta chart intradía en barras OHLCV
+    
+    Args:
+        data: JSON devuelto por /v8/finance/chart
+        
+    Returns:
+        DataFrame con OHLC_COLUMNS indexado por hora UTC (vacío si no hay datos)
+    """
+    results = (data.get('chart') or {}).get('result') or []
+    if not results or not results[0].get('timestamp'):
+        return pd.DataFrame(columns=OHLC_COLUMNS, index=pd.DatetimeIndex([], tz="UTC", name="time"))
+    
+    result = results[0]
+    quote = result['indicators']['quote'][0]
+    bars = pd.DataFrame(
+        {column: quote.get(column) for column in OHLC_COLUMNS},
+        index=pd.DatetimeIndex(pd.to_datetime(result['timestamp'], unit="s", utc=True), name="time")
+    )
+    bars = bars.dropna(subset=["close"])
+    bars = bars[~bars.index.duplicated(keep="last")]
+    bars[["open", "high", "low", "close"]] = bars[["open", "high", "low", "close"]].astype(float)
+    bars["volume"] = bars["volume"].fillna(0).astype("int64")
+    return bars
+
+def generate_intraday_bars(symbol: str, now: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    Barras de 1 minuto simuladas para los últimos días hábiles en horario de mercado
+    
+    La semilla depende del símbolo y del día, así que los reruns del mismo
+    día ven la misma serie (solo crece con los minutos nuevos).
+    
+    Args:
+        symbol: Símbolo del índice
+        now: Momento actual (por defecto ahora)
+        
+    Returns:
+        DataFrame con OHLC_COLUMNS indexado por hora UTC
+    """
+    info = GLOBAL_MARKETS[symbol]
+    tz = pytz.timezone(info["timezone"])
+    now = now or datetime.now(pytz.UTC)
+    today = now.astimezone(tz).date()
+    days = pd.bdate_range(end=pd.Timestamp(today), periods=5)
+    
+    sessions = []
+    for day in days:
+        session_open = tz.localize(datetime(day.year, day.month, day.day, info["market_open"]))
+        session_close = tz.localize(datetime(day.year, day.month, day.day, info["market_close"]))
+        minutes = pd.date_range(session_open, session_close, freq="1min", inclusive="left")
+        sessions.append(minutes[minutes <= now].tz_convert("UTC"))
+    index = pd.DatetimeIndex(np.concatenate([s.values for s in sessions]), name="time").tz_localize("UTC")
+    
+    rng = np.random.default_rng(zlib.crc32(f"{symbol}:{days[0].date()}".encode()))
+    steps = rng.normal(0, 0.0006, len(index))
+    closes = info.get("base_price", 1000) * np.exp(np.cumsum(steps))
+    opens = np.concatenate([[closes[0]], closes[:-1]]) if len(closes) else closes
+    spread = np.abs(rng.normal(0, 0.0004, len(index)))
+    
+    return pd.DataFrame({
+        "open": opens,
+        "high": np.maximum(opens, closes) * (1 + spread),
+        "low": np.minimum(opens, closes) * (1 - spread),
+        "close": closes,
+        "volume": rng.integers(10**4, 10**5, len(index))
+    }, index=index)
+
+@st.cache_data(ttl=QUOTE_CACHE_MAX_AGE, max_entries=4 * len(GLOBAL_MARKETS), show_spinner=False)
+def fetch_intraday_bars(symbol: str, expires_at: int) -> pd.DataFrame:
+    """
+    Barras de 1 minuto del proveedor, cacheadas con la misma caducidad que la cotización
+    
+    Args:
+        symbol: Símbolo del índice
+        expires_at: Caducidad (ver get_quote_expiry), solo clave de cache
+        
+    Returns:
+        DataFrame con OHLC_COLUMNS indexado por hora UTC
+        
+    Raises:
+        QuoteUnavailableError: si el proveedor no tiene barras (el fallo no se cachea)
+    """
+    bars = get_data_provider().fetch_intraday_bars(symbol)
+    if bars is None:
+        raise QuoteUnavailableError(symbol)
+    return bars
+
+@st.cache_data(max_entries=4 * len(GLOBAL_MARKETS), show_spinner=False)
+def simulate_intraday_bars(symbol: str, minute: str) -> pd.DataFrame:
+    """
+    Barras simuladas cacheadas por minuto (solo crecen al cambiar de minuto)
+    """
+    return generate_intraday_bars(symbol)
+
+def get_intraday_bars(symbol: str) -> Tuple[pd.DataFrame, str]:
+    """
+    Barras base de 1 minuto del proveedor configurado, o simuladas si no las tiene
+    
+    Args:
+        symbol: Símbolo del índice
+        
+    Returns:
+        Tupla (barras, fuente)
+    """
+    provider = get_data_provider()
+    if not isinstance(provider, SimulationProvider):
+        try:
+            return fetch_intraday_bars(symbol, get_quote_expiry(symbol)), provider.data_source
+        except QuoteUnavailableError:
+            pass
+    # Las simuladas se cachean por minuto para que crezcan con cada barra nueva
+    return simulate_intraday_bars(symbol, current_minute()), SimulationProvider.data_source
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def resample_ohlc(symbol: str, timeframe: str, source: str, last_bar: int, _bars: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega las barras base a la temporalidad pedida, una vez por última barra
+    
+    Las velas se cortan en la hora local del mercado (las diarias coinciden
+    con la sesión). Las barras no entran en la clave: la última barra y la
+    fuente identifican la serie.
+    
+    Args:
+        symbol: Símbolo del índice
+        timeframe: Clave de CANDLE_TIMEFRAMES
+        source: Fuente de las barras base
+        last_bar: Epoch de la última barra base
+        _bars: Barras base de 1 minuto indexadas por hora UTC
+        
+    Returns:
+        DataFrame con OHLC_COLUMNS indexado por hora local del mercado
+    """
+    local = _bars.tz_convert(GLOBAL_MARKETS[symbol]["timezone"])
+    rule = CANDLE_TIMEFRAMES[timeframe]
+    if rule is None:
+        return local
+    
+    resampled = local.resample(rule, label="left", closed="left").agg(OHLC_AGGREGATION)
+    return resampled.dropna(subset=["close"])
+
+def create_candlestick_chart(symbol: str, candles: pd.DataFrame, timeframe: str) -> go.Figure:
+    """
+    Gráfico de velas con el volumen debajo
+    
+    Args:
+        symbol: Símbolo del índice
+        candles: Velas de resample_ohlc
+        timeframe: Temporalidad mostrada
+        
+    Returns:
+        Figura de Plotly
+    """
+    info = GLOBAL_MARKETS[symbol]
+    times = candles.index.tz_localize(None)
+    rising = candles["close"] >= candles["open"]
+    
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.75, 0.25], vertical_spacing=0.03)
+    fig.add_trace(go.Candlestick(
+        x=times,
+        open=candles["open"],
+        high=candles["high"],
+        low=candles["low"],
+        close=candles["close"],
+        name=info["name"],
+        increasing_line_color="#28a745",
+        decreasing_line_color="#dc3545"
+    ), row=1, col=1)
+    fig.add_trace(go.Bar(
+        x=times,
+        y=candles["volume"],
+        name="Volumen",
+        marker_color=np.where(rising, "#28a745", "#dc3545")
+    ), row=2, col=1)
+    
+    # Ocultar fines de semana y, en intradía, las horas sin sesión
+    rangebreaks = [dict(bounds=["sat", "mon"])]
+    if timeframe != "1d":
+        rangebreaks.append(dict(bounds=[info["market_close"], info["market_open"]], pattern="hour"))
+    fig.update_xaxes(rangebreaks=rangebreaks)
+    
+    fig.update_layout(
+        height=550,
+        margin=dict(l=10, r=10, t=10, b=10),
+        showlegend=False,
+        xaxis_rangeslider_visible=False
+    )
+    fig.update_yaxes(title_text=info["currency"], row=1, col=1)
+    return fig
+
+def create_candlestick_panel(market_data: Mapping) -> None:
+    """
+    Velas OHLC de un mercado con temporalidad seleccionable
+    
+    Args:
+        market_data: Vista filtrada (ofrece sus mercados en el selector)
+    """
+    st.markdown("### 🕯️ Velas Intradía")
+    
+    symbols = [symbol for symbol in market_data if symbol in GLOBAL_MARKETS] or list(GLOBAL_MARKETS.keys())
+    
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        symbol = st.selectbox(
+            "Mercado:",
+            symbols,
+            format_func=lambda s: f"{GLOBAL_MARKETS[s]['flag']} {GLOBAL_MARKETS[s]['name']}",
+            key="candle_symbol"
+        )
+    with col2:
+        timeframe = st.radio("Temporalidad:", list(CANDLE_TIMEFRAMES.keys()), horizontal=True, key="candle_timeframe")
+    
+    bars, source = get_intraday_bars(symbol)
+    if bars.empty:
+        st.warning("⚠️ No hay barras intradía para este mercado")
+        return
+    
+    last_bar = int(bars.index[-1].timestamp())
+    candles = resample_ohlc(symbol, timeframe, source, last_bar, bars)
+    
+    st.plotly_chart(create_candlestick_chart(symbol, candles, timeframe), use_container_width=True)
+    st.caption(
+        f"📡 {source} • {len(candles):,} velas de {timeframe} a partir de {len(bars):,} barras de "
+        f"{INTRADAY_BASE_INTERVAL} • hora local ({GLOBAL_MARKETS[symbol]['timezone']})"
+    )
+
+# 4.11 RENTABILIDAD POR HORIZONTE
+# ====================================================================
+
+# Horizontes de la matriz de rentabilidades y su desplazamiento desde el último cierre
+# (1D es el cierre hábil anterior de cada mercado; YTD, el último cierre del año pasado)
+RETURN_HORIZONS = {
+    "1D": None,
+    "1W": pd.DateOffset(weeks=1),
+    "1M": pd.DateOffset(months=1),
+    "3M": pd.DateOffset(months=3),
+    "YTD": None,
+    "1Y": pd.DateOffset(years=1)
+}
+
+# Días de histórico simulado para los mercados sin histórico en disco
+RETURN_SIMULATION_DAYS = 400
+
+def history_version(base_dir: str = HISTORY_DIR) -> int:
+    """
+    Versión del histórico en disco (cambia cuando el relleno reescribe una partición)
+    
+    Args:
+        base_dir: Directorio del histórico
+        
+    Returns:
+        Mayor mtime en ns de las carpetas de símbolo, 0 si no hay histórico
+    """
+    if not os.path.isdir(base_dir):
+        return 0
+    return max(
+        (entry.stat().st_mtime_ns for entry in os.scandir(base_dir) if entry.name.startswith("symbol=")),
+        default=0
+    )
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_return_closes(day: str, version: int) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """
+    Cierres diarios para la matriz de rentabilidades, memoizados por día y versión del histórico
+    
+    Usa los cierres guardados por backfill.py; los mercados sin histórico en
+    disco se completan con la serie diaria simulada (y se marcan como tal).
+    
+    Args:
+        day: Fecha UTC (YYYY-MM-DD), solo clave de cache
+        version: Versión del histórico (history_version), solo clave de cache
+        
+    Returns:
+        Tupla (cierres fechas × símbolos con NaN sin sesión, fuente por símbolo)
+    """
+    history = load_daily_history(list(GLOBAL_MARKETS.keys()))
+    sources = {symbol: "💾 Histórico local" for symbol in history["symbol"].unique()}
+    
+    missing = [symbol for symbol in GLOBAL_MARKETS if symbol not in sources]
+    if missing:
+        end = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=pytz.UTC) + timedelta(days=1)
+        start = end - timedelta(days=RETURN_SIMULATION_DAYS)
+        simulated = []
+        for symbol in missing:
+            bars = generate_daily_bars(symbol, start, end)
+            bars.insert(0, "symbol", symbol)
+            simulated.append(bars)
+            sources[symbol] = "🟡 Simulación Realista"
+        history = pd.concat([history] + simulated, ignore_index=True)
+    
+    history["date"] = pd.to_datetime(history["date"], utc=True).dt.tz_localize(None).dt.normalize()
+    closes = history.pivot_table(index="date", columns="symbol", values="close", aggfunc="last").sort_index()
+    closes = closes.reindex(columns=[symbol for symbol in GLOBAL_MARKETS if symbol in closes.columns])
+    return closes, sources
+
+def create_horizon_returns_table(market_data: Mapping) -> None:
+    """
+    Muestra la matriz de rentabilidades por horizonte de los mercados filtrados
+    
+    La matriz se calcula en el pool de procesos; mientras tanto se muestra un
+    aviso y main() relanza el script al terminar. El trabajo se identifica por
+    las claves de cache de los cierres, sin hashear la tabla en cada rerun.
+    
+    Args:
+        market_data: Vista filtrada
+    """
+    st.markdown("### 🗓️ Rentabilidad por Horizonte")
+    
+    day, version = datetime.now(pytz.UTC).strftime("%Y-%m-%d"), history_version()
+    closes, sources = load_return_closes(day, version)
+    status, matrix = run_analytics_job(
+        compute_horizon_returns, closes, RETURN_HORIZONS,
+        key=("return_closes", day, version, tuple(RETURN_HORIZONS.items()))
+    )
+    if status == "pending":
+        st.info("⏳ Calculando rentabilidades en segundo plano...")
+        return
+    if status == "failed":
+        st.warning(f"⚠️ No se pudieron calcular las rentabilidades: {matrix}")
+        return
+    
+    symbols = [symbol for symbol in market_data if symbol in matrix.index]
+    if not symbols:
+        st.warning("⚠️ No hay histórico diario para los mercados seleccionados")
+        return
+    
+    table = matrix.loc[symbols].copy()
+    table.insert(0, "🏛️ Mercado", [f"{GLOBAL_MARKETS[s]['flag']} {GLOBAL_MARKETS[s]['name']}" for s in symbols])
+    table["📅 Último cierre"] = [closes[s].last_valid_index() for s in symbols]
+    table["📡 Fuente"] = [sources[s] for s in symbols]
+    
+    horizon_format = {
+        label: st.column_config.NumberColumn(label, format="%+.2f%%")
+        for label in RETURN_HORIZONS
+    }
+    st.dataframe(
+        table.reset_index(drop=True),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            **horizon_format,
+            "📅 Último cierre": st.column_config.DateColumn("📅 Último cierre", format="DD/MM/YYYY")
+        }
+    )
+    if any("Simulación" in source for source in table["📡 Fuente"]):
+        st.caption("💡 Ejecuta `python backfill.py` para calcular las rentabilidades con cierres reales")
+
+# 4.12 CÁLCULOS EN SEGUNDO PLANO
+# ====================================================================
+
+# Procesos del pool de cálculo (0 = calcular en el propio hilo del script)
+ANALYTICS_WORKERS = int(os.environ.get("ANALYTICS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Resultados guardados por hash de entrada, cadencia con la que la página
+# comprueba los cálculos en curso y tiempo máximo que los sigue
+ANALYTICS_MAX_RESULTS = 64
+ANALYTICS_POLL_SECONDS = 1.0
+ANALYTICS_TIMEOUT_SECONDS = 30
+
+class AnalyticsJobs:
+    """
+    Pool de procesos compartido para cálculos pesados, con resultados por hash de entrada
+    
+    Las funciones deben ser importables por nombre desde los procesos del
+    pool (ver analytics.py). Un mismo cálculo pedido por varias sesiones se
+    lanza una sola vez; los fallos no se guardan, se reintentan al pedirlos.
+    """
+    
+    def __init__(self, workers: int = ANALYTICS_WORKERS, max_results: int = ANALYTICS_MAX_RESULTS):
+        self.workers = workers
+        self.max_results = max_results
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._running: Dict[str, object] = {}
+        self._results: "OrderedDict[str, Tuple[str, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.hits = 0
+        self.failed = 0
+    
+    @staticmethod
+    def job_key(fn, args: Tuple) -> str:
+        """
+        Hash de la función y sus argumentos (o de la clave que los identifica)
+        """
+        payload = pickle.dumps((fn.__module__, fn.__qualname__, args), protocol=pickle.HIGHEST_PROTOCOL)
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """
+        Crea el pool la primera vez (spawn: no hereda los hilos del servidor)
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+    
+    def _store(self, key: str, status: str, value) -> None:
+        """
+        Guarda un resultado terminado, expulsando los más antiguos
+        """
+        with self._lock:
+            self._running.pop(key, None)
+            if status == "failed":
+                self.failed += 1
+            self._results[key] = (status, value)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+    
+    def _finish(self, key: str, future) -> None:
+        """
+        Callback de fin de un trabajo del pool
+        """
+        error = future.exception()
+        if error is None:
+            self._store(key, "done", future.result())
+        else:
+            logger.warning(f"Cálculo en segundo plano fallido: {error}")
+            self._store(key, "failed", error)
+    
+    def submit(self, fn, *args, key: Optional[Tuple] = None) -> str:
+        """
+        Lanza un cálculo si no está ya hecho o en curso
+        
+        Args:
+            fn: Función de nivel de módulo importable por los procesos del pool
+            *args: Argumentos serializables
+            key: Identificador pequeño de los argumentos (ej. las claves de
+                cache de las que salen); evita serializar y hashear datos
+                grandes en cada rerun
+            
+        Returns:
+            Clave del trabajo para consultar con poll()
+        """
+        key = self.job_key(fn, args if key is None else key)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return key
+            if key in self._running:
+                self.hits += 1
+                return key
+            self.submitted += 1
+            if self.workers > 0:
+                try:
+                    future = self._get_executor().submit(fn, *args)
+                except BrokenProcessPool:
+                    # Un proceso murió (p. ej. por memoria): cerrar el pool roto
+                    # sin esperarlo, para no dejar procesos ni colas huérfanos,
+                    # y rehacerlo
+                    self._executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+                    future = self._get_executor().submit(fn, *args)
+                self._running[key] = future
+        
+        if self.workers > 0:
+            future.add_done_callback(lambda done, key=key: self._finish(key, done))
+        else:
+            try:
+                self._store(key, "done", fn(*args))
+            except Exception as e:
+                self._store(key, "failed", e)
+        return key
+    
+    def poll(self, key: str) -> Tuple[str, object]:
+        """
+        Estado de un trabajo
+        
+        Args:
+            key: Clave devuelta por submit()
+            
+        Returns:
+            Tupla (estado, valor): ("done", resultado), ("failed", excepción),
+            ("pending", None) o ("unknown", None) si se expulsó o nunca se lanzó
+        """
+        with self._lock:
+            if key in self._running:
+                return "pending", None
+            if key not in self._results:
+                return "unknown", None
+            status, value = self._results[key]
+            if status == "failed":
+                # Informar del fallo una vez y permitir el reintento
+                del self._results[key]
+            return status, value
+    
+    def running(self, keys: List[str]) -> int:
+        """
+        Cuántos de los trabajos indicados siguen en curso (sin consumir sus resultados)
+        
+        Args:
+            keys: Claves de trabajos
+        """
+        with self._lock:
+            return sum(1 for key in keys if key in self._running)
+
+@st.cache_resource
+def get_analytics_jobs() -> AnalyticsJobs:
+    """
+    Pool de cálculo compartido por todas las sesiones del proceso
+    """
+    return AnalyticsJobs()
+
+def run_analytics_job(fn, *args, key: Optional[Tuple] = None) -> Tuple[str, object]:
+    """
+    Pide un cálculo al pool y devuelve su estado en este rerun
+    
+    Si sigue en curso, se anota en la sesión para que main() lo siga y
+    relance el script al terminar.
+    
+    Args:
+        fn: Función de analytics.py
+        *args: Argumentos serializables
+        key: Identificador de los argumentos (ver AnalyticsJobs.submit)
+        
+    Returns:
+        Tupla (estado, valor) como AnalyticsJobs.poll()
+    """
+    jobs = get_analytics_jobs()
+    key = jobs.submit(fn, *args, key=key)
+    status, value = jobs.poll(key)
+    if status == "unknown":
+        # Expulsado justo al terminar: se vuelve a pedir en el siguiente rerun
+        status = "pending"
+    if status == "pending":
+        st.session_state.setdefault("analytics_pending", []).append(key)
+    return status, value
+
+def wait_for_analytics_jobs(keys: List[str]) -> None:
+    """
+    Sigue los cálculos en curso del rerun sin bloquear el script
+    
+    Igual que con las cotizaciones tardías, deja un fragmento que comprueba
+    los trabajos cada ANALYTICS_POLL_SECONDS y relanza la página solo cuando
+    alguno termina. Pasados ANALYTICS_TIMEOUT_SECONDS con los mismos trabajos
+    se deja de sondear.
+    
+    Args:
+        keys: Claves anotadas por run_analytics_job()
+    """
+    followed = st.session_state.get("analytics_deadline")
+    if followed is None or followed[0] != frozenset(keys):
+        followed = (frozenset(keys), time.monotonic() + ANALYTICS_TIMEOUT_SECONDS)
+        st.session_state["analytics_deadline"] = followed
+    
+    if time.monotonic() >= followed[1]:
+        st.caption("⌛ Algunos cálculos siguen en curso; se mostrarán en el próximo refresco")
+        return
+    
+    poll_analytics_jobs(keys, followed[1])
+
+@st.fragment(run_every=ANALYTICS_POLL_SECONDS)
+def poll_analytics_jobs(keys: List[str], deadline: float) -> None:
+    """
+    Fragmento que relanza la página en cuanto termina alguno de los cálculos
+    
+    Args:
+        keys: Claves de los trabajos en curso
+        deadline: Instante (time.monotonic) en que se deja de sondear
+    """
+    running = get_analytics_jobs().running(keys)
+    if running < len(keys) or time.monotonic() >= deadline:
+        st.rerun(scope="app")
+    st.caption(f"⏳ {running} cálculos en segundo plano en curso")
+
+# 4.13 TIME-LAPSE INTRADÍA
+# ====================================================================
+
+# Un fotograma por periodo de refresco; al navegador se envían como mucho
+# TIMELAPSE_MAX_FRAMES, repartidos uniformemente a lo largo del día
+TIMELAPSE_FRAME_SECONDS = SNAPSHOT_REFRESH_SECONDS
+TIMELAPSE_MAX_FRAMES = 120
+
+# Escala de color común (en %) para el mapa y el heatmap animados
+TIMELAPSE_COLOR_RANGE = 3.0
+
+class IntradayTimelapse:
+    """
+    Fotogramas del día (UTC) con el rendimiento de cada mercado en cada refresco
+    
+    Cada refresco completo añade un fotograma ya preparado para Plotly (solo
+    los colores del mapa y los valores del heatmap, redondeados a 0,01 %);
+    los refrescos sin cambios, habituales con los mercados cerrados, no
+    añaden fotograma y un segundo refresco dentro del mismo periodo sustituye
+    al último. La figura se rehace solo cuando hay fotogramas nuevos.
+    """
+    
+    def __init__(self, symbols: List[str]):
+        self.symbols = tuple(symbols)
+        self._lock = threading.Lock()
+        self._day: Optional[str] = None
+        self._times: List[int] = []
+        self._values: List[Tuple[Optional[float], ...]] = []
+        self._frames: List[Dict] = []
+        self._figure: Optional[go.Figure] = None
+        self.version = 0
+    
+    def __len__(self) -> int:
+        return len(self._frames)
+    
+    def append(self, market_data: Mapping, timestamp: Optional[float] = None) -> bool:
+        """
+        Añade el fotograma de un refresco completo
+        
+        Args:
+            market_data: Cotizaciones de todos los mercados
+            timestamp: Momento del refresco (epoch, por defecto ahora)
+            
+        Returns:
+            True si se añadió o sustituyó un fotograma
+        """
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        moment = datetime.fromtimestamp(timestamp, tz=pytz.UTC)
+        values = tuple(
+            round(market_data[symbol]["change_percent"], 2)
+            if market_data.get(symbol) is not None else None
+            for symbol in self.symbols
+        )
+        
+        with self._lock:
+            day = moment.strftime("%Y-%m-%d")
+            if day != self._day:
+                self._day = day
+                self._times, self._values, self._frames = [], [], []
+            elif self._values and values == self._values[-1]:
+                return False
+            
+            frame = {
+                "name": moment.strftime("%H:%M"),
+                "data": [
+                    {"type": "scattergeo", "marker": {"color": [np.nan if v is None else v for v in values]}},
+                    {"type": "heatmap", "z": [list(values)]}
+                ],
+                "traces": [0, 1]
+            }
+            if self._times and timestamp // TIMELAPSE_FRAME_SECONDS == self._times[-1] // TIMELAPSE_FRAME_SECONDS:
+                self._times[-1], self._values[-1], self._frames[-1] = timestamp, values, frame
+            else:
+                self._times.append(timestamp)
+                self._values.append(values)
+                self._frames.append(frame)
+            self._figure = None
+            self.version += 1
+            return True
+    
+    def _sampled_frames(self) -> List[Dict]:
+        """
+        Fotogramas a enviar: todos si caben, si no un muestreo uniforme que conserva el último
+        """
+        if len(self._frames) <= TIMELAPSE_MAX_FRAMES:
+            return list(self._frames)
+        positions = np.unique(np.linspace(0, len(self._frames) - 1, TIMELAPSE_MAX_FRAMES).round().astype(int))
+        return [self._frames[i] for i in positions]
+    
+    def figure(self) -> Optional[go.Figure]:
+        """
+        Figura animada (mapa + heatmap), memoizada hasta el siguiente fotograma
+        
+        Returns:
+            Figura de Plotly o None si aún no hay fotogramas
+        """
+        with self._lock:
+            if self._figure is not None or not self._frames:
+                return self._figure
+            frames = self._sampled_frames()
+            last = self._values[-1]
+            
+            names = [GLOBAL_MARKETS[symbol]["name"] for symbol in self.symbols]
+            colors = dict(
+                colorscale="RdYlGn",
+                cmin=-TIMELAPSE_COLOR_RANGE,
+                cmax=TIMELAPSE_COLOR_RANGE
+            )
+            fig = make_subplots(
+                rows=2, cols=1,
+                row_heights=[0.78, 0.22],
+                vertical_spacing=0.04,
+                specs=[[{"type": "scattergeo"}], [{"type": "heatmap"}]]
+            )
+            fig.add_trace(go.Scattergeo(
+                lat=[GLOBAL_MARKETS[symbol]["coordinates"][0] for symbol in self.symbols],
+                lon=[GLOBAL_MARKETS[symbol]["coordinates"][1] for symbol in self.symbols],
+                text=names,
+                mode="markers",
+                marker=dict(size=16, color=frames[-1]["data"][0]["marker"]["color"], line=dict(width=1, color="#333"), **colors),
+                hovertemplate="%{text}: %{marker.color:+.2f}%<extra></extra>"
+            ), row=1, col=1)
+            fig.add_trace(go.Heatmap(
+                z=[list(last)],
+                x=names,
+                y=["Cambio %"],
+                zmin=colors["cmin"],
+                zmax=colors["cmax"],
+                colorscale=colors["colorscale"],
+                showscale=False,
+                hovertemplate="%{x}: %{z:+.2f}%<extra></extra>"
+            ), row=2, col=1)
+            
+            fig.frames = frames
+            fig.update_geos(showcountries=True, countrycolor="#ccc", showland=True, landcolor="#f5f5f5")
+            fig.update_layout(
+                height=560,
+                margin=dict(l=10, r=10, t=30, b=10),
+                sliders=[{
+                    "active": len(frames) - 1,
+                    "currentvalue": {"prefix": "🕐 UTC "},
+                    "pad": {"t": 30},
+                    "steps": [
+                        {
+                            "label": frame["name"],
+                            "method": "animate",
+                            "args": [[frame["name"]], {"mode": "immediate", "frame": {"duration": 0, "redraw": True}}]
+                        }
+                        for frame in frames
+                    ]
+                }],
+                updatemenus=[{
+                    "type": "buttons",
+                    "showactive": False,
+                    "x": 0, "y": 0, "xanchor": "right", "yanchor": "top",
+                    "pad": {"t": 30, "r": 10},
+                    "buttons": [
+                        {
+                            "label": "▶️",
+                            "method": "animate",
+                            "args": [None, {"frame": {"duration": 300, "redraw": True}, "fromcurrent": False}]
+                        },
+                        {
+                            "label": "⏸️",
+                            "method": "animate",
+                            "args": [[None], {"mode": "immediate", "frame": {"duration": 0, "redraw": False}}]
+                        }
+                    ]
+                }]
+            )
+            self._figure = fig
+            return fig
+
+@st.cache_resource
+def get_intraday_timelapse() -> IntradayTimelapse:
+    """
+    Time-lapse del día compartido por todas las sesiones del proceso
+    """
+    return IntradayTimelapse(list(GLOBAL_MARKETS.keys()))
+
+def create_timelapse_panel() -> None:
+    """
+    Muestra (a petición) el time-lapse animado del día
+    """
+    if not st.toggle("🎞️ Time-lapse del día", key="timelapse"):
+        return
+    
+    timelapse = get_intraday_timelapse()
+    fig = timelapse.figure()
+    if fig is None:
+        st.info("⏳ El time-lapse empieza con el primer refresco completo")
+        return
+    
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption(
+        f"🎞️ {len(timelapse)} fotogramas de hoy (UTC), uno por refresco con cambios"
+        + (f"; se muestran {TIMELAPSE_MAX_FRAMES}" if len(timelapse) > TIMELAPSE_MAX_FRAMES else "")
+    )
+
+# 4.14 SCREENER INDEXADO
+# ====================================================================
+
+# Campos del screener: categóricos (máscara por valor) y numéricos (array ordenado)
+SCREENER_CATEGORY_FIELDS = ("continent", "currency", "ma50_trend", "is_open")
+SCREENER_NUMERIC_FIELDS = ("change_percent", "current_price", "volume")
+
+# Operadores admitidos por tipo de campo ("top" = los n mayores)
+SCREENER_CATEGORY_OPS = ("eq", "in")
+SCREENER_NUMERIC_OPS = ("gt", "ge", "lt", "le", "eq", "between", "top")
+
+# Límites del deslizador de cambio % (en los extremos el rango queda abierto)
+SCREENER_CHANGE_RANGE = (-5.0, 5.0)
+
+def screener_row(symbol: str, data: Optional[Mapping]) -> Dict:
+    """
+    Campos filtrables de un mercado (estáticos de GLOBAL_MARKETS y de la cotización)
+    
+    Args:
+        symbol: Símbolo del mercado
+        data: Cotización o None si no hay
+        
+    Returns:
+        Diccionario campo → valor (None donde no hay dato)
+    """
+    info = GLOBAL_MARKETS.get(symbol, {})
+    is_open = None
+    if "timezone" in info:
+        is_open = get_market_status(info["timezone"], info["market_open"], info["market_close"])["is_open"]
+    row = {
+        "continent": info.get("continent"),
+        "currency": (data or {}).get("currency") or info.get("currency"),
+        "ma50_trend": data.get("ma50_trend") if data is not None else None,
+        "is_open": is_open
+    }
+    for field in SCREENER_NUMERIC_FIELDS:
+        row[field] = data.get(field) if data is not None else None
+    return row
+
+class ScreenerIndex:
+    """
+    Índices de un snapshot para resolver consultas del screener sin recorrer los datos
+    
+    Cada campo categórico guarda una máscara booleana por valor y cada campo
+    numérico sus posiciones ordenadas por valor, así que las comparaciones y
+    rangos son dos searchsorted y las condiciones se combinan con & de
+    máscaras. Se construye una vez por snapshot.
+    """
+    
+    def __init__(self, rows: Dict[str, Dict]):
+        self.symbols = np.array(list(rows.keys()), dtype=object)
+        self.size = len(self.symbols)
+        
+        self._categories: Dict[str, Dict[object, np.ndarray]] = {}
+        for field in SCREENER_CATEGORY_FIELDS:
+            values = np.array([row.get(field) for row in rows.values()], dtype=object)
+            self._categories[field] = {
+                value: values == value for value in set(values.tolist()) if value is not None
+            }
+        
+        # Posiciones ordenadas por valor (sin los NaN) y valores en ese orden
+        self._sorted: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for field in SCREENER_NUMERIC_FIELDS:
+            values = np.array(
+                [np.nan if row.get(field) is None else row[field] for row in rows.values()],
+                dtype=float
+            )
+            order = np.argsort(values, kind="stable")
+            order = order[:np.count_nonzero(~np.isnan(values))]
+            self._sorted[field] = (order, values[order])
+    
+    def values(self, field: str) -> List:
+        """
+        Valores presentes de un campo categórico (para las opciones de la interfaz)
+        """
+        return sorted(self._categories[field], key=str)
+    
+    def _positions_mask(self, positions: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        mask[positions] = True
+        return mask
+    
+    def _condition_mask(self, field: str, op: str, value) -> np.ndarray:
+        """
+        Máscara de los mercados que cumplen una condición
+        """
+        if field in self._categories:
+            if op not in SCREENER_CATEGORY_OPS:
+                raise ValueError(f"Operador no válido para {field}: {op}")
+            index = self._categories[field]
+            wanted = value if op == "in" else (value,)
+            mask = np.zeros(self.size, dtype=bool)
+            for item in wanted:
+                if item in index:
+                    mask |= index[item]
+            return mask
+        
+        if field not in self._sorted:
+            raise ValueError(f"Campo de screener desconocido: {field}")
+        order, ordered = self._sorted[field]
+        if op == "top":
+            return self._positions_mask(order[::-1][:max(0, int(value))])
+        if op == "between":
+            low, high = value
+            start = 0 if low is None else np.searchsorted(ordered, low, side="left")
+            end = len(ordered) if high is None else np.searchsorted(ordered, high, side="right")
+            return self._positions_mask(order[start:end])
+        bounds = {
+            "gt": (np.searchsorted(ordered, value, side="right"), len(ordered)),
+            "ge": (np.searchsorted(ordered, value, side="left"), len(ordered)),
+            "lt": (0, np.searchsorted(ordered, value, side="left")),
+            "le": (0, np.searchsorted(ordered, value, side="right")),
+            "eq": (np.searchsorted(ordered, value, side="left"), np.searchsorted(ordered, value, side="right"))
+        }
+        if op not in bounds:
+            raise ValueError(f"Operador no válido para {field}: {op}")
+        start, end = bounds[op]
+        return self._positions_mask(order[start:end])
+    
+    def select(self, conditions: Tuple[Tuple[str, str, object], ...]) -> Tuple[str, ...]:
+        """
+        Símbolos que cumplen todas las condiciones, en el orden del snapshot
+        
+        Args:
+            conditions: Tuplas (campo, operador, valor), p. ej.
+                ("continent", "in", frozenset({"Europa"})) o
+                ("change_percent", "between", (-1.0, 1.0))
+                
+        Returns:
+            Tupla de símbolos
+        """
+        mask = np.ones(self.size, dtype=bool)
+        for field, op, value in conditions:
+            mask &= self._condition_mask(field, op, value)
+        return tuple(self.symbols[mask].tolist())
+
+def create_screener_controls(market_data: "MarketSnapshot") -> Tuple[Tuple[str, str, object], ...]:
+    """
+    Controles del screener avanzado en el sidebar
+    
+    Args:
+        market_data: Snapshot (sus índices dan las opciones disponibles)
+        
+    Returns:
+        Condiciones elegidas (vacío si no se ha tocado ningún control)
+    """
+    index = market_data.screener
+    conditions = []
+    
+    with st.sidebar.expander("🔬 Screener avanzado"):
+        continents = st.multiselect("Continentes:", index.values("continent"), key="screener_continents")
+        if continents:
+            conditions.append(("continent", "in", frozenset(continents)))
+        
+        currencies = st.multiselect("Monedas:", index.values("currency"), key="screener_currencies")
+        if currencies:
+            conditions.append(("currency", "in", frozenset(currencies)))
+        
+        low, high = st.slider(
+            "Cambio % entre:",
+            min_value=SCREENER_CHANGE_RANGE[0],
+            max_value=SCREENER_CHANGE_RANGE[1],
+            value=SCREENER_CHANGE_RANGE,
+            step=0.1,
+            key="screener_change"
+        )
+        if (low, high) != SCREENER_CHANGE_RANGE:
+            conditions.append((
+                "change_percent", "between",
+                (None if low <= SCREENER_CHANGE_RANGE[0] else low, None if high >= SCREENER_CHANGE_RANGE[1] else high)
+            ))
+        
+        trend = st.selectbox("Tendencia MA50:", ["Todas"] + index.values("ma50_trend"), key="screener_trend")
+        if trend != "Todas":
+            conditions.append(("ma50_trend", "eq", trend))
+        
+        if st.checkbox("Solo mercados abiertos", key="screener_open"):
+            conditions.append(("is_open", "eq", True))
+        
+        top = st.number_input(
+            "Top por volumen (0 = todos):", min_value=0, max_value=len(market_data), value=0, key="screener_top"
+        )
+        if top:
+            conditions.append(("volume", "top", int(top)))
+    
+    return tuple(conditions)
+
+# 5. FUNCIÓN PRINCIPAL
+# ====================================================================
+
+# Secciones del dashboard: solo se calcula y dibuja la que se está viendo
+DASHBOARD_SECTIONS = {
+    "📊 Resumen": "summary",
+    "🗺️ Mapa": "map",
+    "📈 Rendimiento": "performance",
+    "🕯️ Velas": "candles",
+    "🔗 Correlación": "correlation",
+    "📋 Tabla": "table",
+    "ℹ️ Información": "info"
+}
+
+def create_technical_info() -> None:
+    """
+    Muestra la información técnica detallada de la aplicación
+    """
+    st.markdown("### ℹ️ Información Técnica Detallada")
+    st.markdown("""
+    **🌟 Características Principales:**
+    - 🗺️ **Mapa mundial interactivo** con vista geográfica de mercados
+    - 🌤️ **7 niveles de emojis meteorológicos** por rendimiento
+    - 📡 **Sistema híbrido**: Datos reales de Yahoo Finance + fallback inteligente
+    - 📊 **Análisis técnico**: Media Móvil 50 períodos calculada en tiempo real
+    - 🕐 **Horarios precisos**: Estado abierto/cerrado por zona horaria
+    - 🔍 **Filtros avanzados**: Por continente y tipo de rendimiento
+    - 🌡️ **Heatmap global**: Visualización rápida de mejores/peores performers
+    - 📈 **Estadísticas globales**: Sentimiento de mercado y promedios
+    
+    **📊 Mercados Incluidos:**
+    - **🇺🇸 Estados Unidos**: S&P 500, NASDAQ
+    - **🇨🇦 Canadá**: TSX
+    - **🇬🇧 Reino Unido**: FTSE 100
+    - **🇩🇪 Alemania**: DAX
+    - **🇫🇷 Francia**: CAC 40
+    - **🇪🇸 España**: IBEX 35
+    - **🇯🇵 Japón**: Nikkei 225
+    - **🇨🇳 China**: Shanghai Composite
+    - **🇭🇰 Hong Kong**: Hang Seng
+    - **🇦🇺 Australia**: ASX 200
+    - **🇧🇷 Brasil**: Bovespa
+    - **🇲🇽 México**: IPC
+    
+    **🔧 Tecnología:**
+    - Desarrollado con Streamlit puro (sin dependencias externas)
+    - Compatible con Streamlit Cloud
+    - Cache adaptativo: 1 minuto con el mercado abierto, hasta la apertura si está cerrado
+    - Secciones bajo demanda: solo se calcula la que se está viendo
+    - Sistema robusto de manejo de errores
+    - Interfaz responsive para móviles y desktop
+    """)
+
+def main():
+    """
+    Función principal de la aplicación
+    """
+    # Hoja de estilos compartida de las tarjetas
+    st.markdown(MARKET_CARDS_CSS, unsafe_allow_html=True)
+    
+    # Título principal
+    st.title("🌍 Mercados Financieros Globales")
+    st.markdown("### 📊 Monitor en tiempo real de los principales índices bursátiles mundiales")
+    
+    # Hora actual UTC
+    current_utc = datetime.now(pytz.UTC)
+    st.info(f"🕐 **Hora UTC:** {current_utc.strftime('%Y-%m-%d %H:%M:%S')} | 🔄 **Última actualización:** {datetime.now().strftime('%H:%M:%S')}")
+    
+    # Mostrar spinner mientras se cargan los datos
+    refresh_key = int(time.time() // SNAPSHOT_REFRESH_SECONDS)
+    with st.spinner("📡 Obteniendo datos de los mercados globales..."):
+        # El snapshot se construye una vez por refresco y se comparte entre
+        # sesiones; vencido el plazo se pinta con lo que haya llegado
+        market_data = get_market_snapshot(refresh_key, RENDER_DEADLINE_SECONDS)
+    
+    # Mostrar estado de conexión de datos
+    real_data_count = market_data.real_count
+    
+    if real_data_count > 0:
+        st.success(f"✅ Datos obtenidos exitosamente: {real_data_count} fuentes reales, {market_data.valid_count - real_data_count} simuladas")
+    else:
+        st.info("ℹ️ Usando datos simulados realistas - API externa no disponible")
+    
+    # Aviso de cotizaciones pendientes (se actualiza mientras llegan)
+    pending_status = st.empty()
+    if market_data.pending and get_last_known_quotes().warm:
+        pending_status.info("💾 Mostrando las últimas cotizaciones guardadas mientras se actualizan")
+    elif market_data.pending:
+        pending_names = ", ".join(GLOBAL_MARKETS[symbol]["name"] for symbol in market_data.pending)
+        pending_status.warning(f"⏳ Cotizaciones pendientes: {pending_names}")
+    
+    # Crear sidebar con filtros
+    conditions = create_sidebar_content(market_data)
+    
+    # Aplicar filtros usando los índices del screener del snapshot
+    filtered_data = market_data.screen(conditions)
+    
+    # Diagnóstico de memoria por sesión
+    create_session_diagnostics(market_data, filtered_data)
+    
+    # Reglas de alerta del usuario y evaluación contra el snapshot actual
+    create_alerts_panel()
+    
+    # Descargas del snapshot y del historial
+    create_export_panel(market_data)
+    
+    # Selector de sección (horizontal, como pestañas). A diferencia de
+    # st.tabs, solo se ejecuta el código de la sección elegida
+    section_label = st.radio(
+        "Sección:",
+        list(DASHBOARD_SECTIONS.keys()),
+        horizontal=True,
+        label_visibility="collapsed",
+        key="dashboard_section"
+    )
+    section = DASHBOARD_SECTIONS[section_label]
+    
+    # Los datos de cada sección se memoizan en el snapshot por filtro
+    filter_key = conditions
+    
+    if section == "summary":
+        # Mostrar resumen global
+        create_global_summary(market_data.derive(
+            ("summary",), lambda: build_global_summary(market_data)
+        ))
+        
+        # Agregados por continente, país o cesta
+        create_rollup_panel(market_data)
+    
+    elif section == "map":
+        # Mostrar mapa mundial
+        create_world_map_visualization(filtered_data, market_data.pending)
+    
+    elif section == "performance":
+        # Mostrar gráfico de rendimiento
+        st.markdown("### 📈 Análisis Comparativo de Rendimiento")
+        create_performance_chart(market_data.derive(
+            ("performance",) + filter_key, lambda: build_performance_frame(filtered_data)
+        ))
+        
+        # Rentabilidades a 1D/1W/1M/3M/YTD/1Y desde los cierres guardados
+        create_horizon_returns_table(filtered_data)
+    
+    elif section == "candles":
+        # Velas OHLC del mercado elegido
+        create_candlestick_panel(filtered_data)
+    
+    elif section == "correlation":
+        # Mostrar correlación entre todos los índices
+        create_correlation_heatmap()
+    
+    elif section == "table":
+        # Mostrar tabla detallada
+        create_detailed_table(market_data.derive(
+            ("table",) + filter_key, lambda: build_detailed_table(filtered_data)
+        ))
+    
+    else:
+        create_technical_info()
+    
+    # Footer informativo mejorado
+    st.markdown("---")
+    
+    # Estadísticas finales
+    total_valid = market_data.valid_count
+    total_real = market_data.real_count
+    total_sim = total_valid - total_real
+    success_rate = (total_real / total_valid * 100) if total_valid else 0
+    
+    st.markdown("### 🚀 Widget de Mercados Financieros Globales v3.0")
+    
+    # Crear métricas finales en columnas
+    footer_cols = st.columns(4)
+    
+    with footer_cols[0]:
+        st.metric("📊 Mercados Monitoreados", len(GLOBAL_MARKETS), "indices principales")
+    
+    with footer_cols[1]:
+        st.metric("📡 Datos Reales", total_real, f"de {total_valid} total")
+    
+    with footer_cols[2]:
+        st.metric("🟡 Datos Simulados", total_sim, "fallback realista")
+    
+    with footer_cols[3]:
+        st.metric("✅ Tasa de Éxito", f"{success_rate:.1f}%", "conexión API")
+    
+    # Aviso legal
+    st.info("""
+    ⚠️ **Aviso Legal**: Esta herramienta es exclusivamente para fines educativos e informativos. 
+    No constituye asesoramiento financiero. Las decisiones de inversión requieren análisis profesional independiente.
+    """)
+    
+    # Timestamp final
+    st.caption(f"🕐 Última actualización: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')} | Desarrollado con ❤️ usando Streamlit")
+    
+    # Con la página ya pintada, mostrar los cálculos lanzados al pool
+    pending_jobs = st.session_state.pop("analytics_pending", [])
+    if pending_jobs:
+        wait_for_analytics_jobs(pending_jobs)
+    
+    # Con la página ya pintada, incorporar las cotizaciones que falten
+    if market_data.pending:
+        wait_for_pending_quotes(refresh_key, market_data, pending_status)
+
+# 6. EJECUCIÓN PRINCIPAL
+# ====================================================================
+
+if __name__ == "__main__":
+    # Perfil opcional del rerun (sin coste si no se pide)
+    profiler = RerunProfiler().start() if profiling_requested() else None
+    profile_paths = None
+    
+    try:
+        main()
+    except Exception as e:
+        st.error(f"❌ Error ejecutando la aplicación: {str(e)}")
+        logger.error(f"Error en main(): {str(e)}")
+        
+        # Mostrar información de debug en modo de desarrollo
+        with st.expander("🔧 Información de Debug"):
+            st.exception(e)
+            st.write("**Variables del sistema:**")
+            st.write(f"- Python version: {st.__version__ if hasattr(st, '__version__') else 'N/A'}")
+            st.write(f"- Timestamp: {datetime.now()}")
+            st.write(f"- Mercados configurados: {len(GLOBAL_MARKETS)}")
+            st.write(f"- Timezone UTC: {datetime.now(pytz.UTC)}")
+    finally:
+        if profiler is not None:
+            profile_paths = finish_rerun_profile(profiler)
+    
+    if profile_paths is not None:
+        st.sidebar.success(f"📸 Perfil del rerun guardado en `{profile_paths[0]}`")
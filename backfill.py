@@ -0,0 +1,151 @@
+# ====================================================================
+# RELLENO DEL HISTÓRICO DIARIO
+# ====================================================================
+# Descarga años de barras diarias de todos los índices de GLOBAL_MARKETS
+# con un pool de hilos acotado y las guarda particionadas por símbolo y
+# año. Cada (símbolo, año) completado se anota en un checkpoint, de modo
+# que una ejecución interrumpida continúa donde se quedó.
+#
+# Uso:
+#   python backfill.py --years 10 --workers 4
+#   python backfill.py --symbols ^GSPC ^IBEX --source simulation
+# ====================================================================
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pytz
+
+import app
+
+CHECKPOINT_FILE = "_checkpoint.json"
+
+class Checkpoint:
+    """
+    Registro persistente de los rangos (símbolo, año) ya descargados
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._completed = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as handle:
+                self._completed = set(json.load(handle).get("completed", []))
+
+    @staticmethod
+    def key(symbol: str, year: int) -> str:
+        return f"{symbol}|{year}"
+
+    def is_done(self, symbol: str, year: int) -> bool:
+        return self.key(symbol, year) in self._completed
+
+    def mark_done(self, symbol: str, year: int) -> None:
+        with self._lock:
+            self._completed.add(self.key(symbol, year))
+            payload = {"completed": sorted(self._completed), "updated": datetime.now().isoformat()}
+
+            def write(tmp_path: str) -> None:
+                with open(tmp_path, "w", encoding="utf-8") as handle:
+                    json.dump(payload, handle, indent=1)
+
+            app.write_atomic(self.path, write)
+
+def backfill_range(symbol: str, year: int, source: str, base_dir: str) -> int:
+    """
+    Descarga y guarda un año de barras diarias de un símbolo
+
+    Returns:
+        Número de barras guardadas (0 si la respuesta vino vacía)
+    """
+    start = datetime(year, 1, 1, tzinfo=pytz.UTC)
+    end = min(datetime(year + 1, 1, 1, tzinfo=pytz.UTC), datetime.now(pytz.UTC))
+
+    if source == "simulation":
+        bars = app.generate_daily_bars(symbol, start, end)
+    else:
+        bars = app.fetch_daily_bars_yahoo(symbol, start, end)
+
+    if not bars.empty:
+        app.write_history_partition(symbol, year, bars, base_dir)
+    return len(bars)
+
+def main() -> int:
+    """
+    Punto de entrada del relleno del histórico
+    """
+    parser = argparse.ArgumentParser(description="Rellena el histórico diario de los mercados globales")
+    parser.add_argument("--years", type=int, default=5, help="Años hacia atrás (incluye el actual)")
+    parser.add_argument("--workers", type=int, default=4, help="Descargas simultáneas")
+    parser.add_argument("--symbols", nargs="*", default=list(app.GLOBAL_MARKETS), help="Símbolos a rellenar")
+    parser.add_argument("--source", choices=["yahoo", "simulation"], default="yahoo", help="Origen de los datos")
+    parser.add_argument("--output", default=app.HISTORY_DIR, help="Directorio del histórico")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(os.path.join(args.output, CHECKPOINT_FILE))
+    current_year = datetime.now(pytz.UTC).year
+    years = range(current_year - args.years + 1, current_year + 1)
+
+    # El año en curso nunca se da por cerrado: se vuelve a descargar siempre
+    tasks = [
+        (symbol, year)
+        for symbol in args.symbols
+        for year in years
+        if year == current_year or not checkpoint.is_done(symbol, year)
+    ]
+    pending_by_symbol = {}
+    for symbol, _ in tasks:
+        pending_by_symbol[symbol] = pending_by_symbol.get(symbol, 0) + 1
+
+    skipped = len(args.symbols) * len(years) - len(tasks)
+    print(f"📦 {len(tasks)} rangos pendientes ({skipped} ya completados) con {args.workers} hilos")
+
+    started = time.perf_counter()
+    symbols_done = bars_total = failures = 0
+    failed_symbols = set()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(backfill_range, symbol, year, args.source, args.output): (symbol, year)
+            for symbol, year in tasks
+        }
+        for future in as_completed(futures):
+            symbol, year = futures[future]
+            try:
+                bars = future.result()
+                bars_total += bars
+                # Una respuesta vacía puede ser transitoria: no se da el año por hecho
+                if bars and year != current_year:
+                    checkpoint.mark_done(symbol, year)
+            except Exception as e:
+                failures += 1
+                failed_symbols.add(symbol)
+                print(f"❌ {symbol} {year}: {e}", file=sys.stderr)
+
+            pending_by_symbol[symbol] -= 1
+            if pending_by_symbol[symbol] == 0 and symbol in failed_symbols:
+                print(f"⚠️ {symbol} incompleto: se reintentará en la próxima ejecución")
+            elif pending_by_symbol[symbol] == 0:
+                symbols_done += 1
+                elapsed = time.perf_counter() - started
+                print(
+                    f"✅ {symbol} ({symbols_done}/{len(pending_by_symbol)}) • "
+                    f"{symbols_done / elapsed:.2f} símbolos/s"
+                )
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"🏁 {symbols_done} símbolos, {bars_total:,} barras en {elapsed:.1f} s "
+        f"({symbols_done / elapsed if elapsed else 0:.2f} símbolos/s, {failures} fallos "
+        f"en {len(failed_symbols)} símbolos)"
+    )
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
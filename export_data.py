@@ -0,0 +1,48 @@
+# ====================================================================
+# EXPORTACIÓN DE DATOS DESDE LÍNEA DE COMANDOS
+# ====================================================================
+# Exporta el snapshot actual o el histórico diario en disco a CSV, Parquet
+# o Arrow IPC, escribiendo el fichero bloque a bloque. El historial de ticks
+# vive en la memoria de la app y solo se exporta desde su panel.
+#
+# Uso:
+#   python export_data.py snapshot --format parquet --output mercados.parquet
+#   python export_data.py daily --format csv > historico.csv
+# ====================================================================
+
+import argparse
+import sys
+import time
+
+import app
+
+def main() -> int:
+    """
+    Punto de entrada de la exportación por línea de comandos
+    """
+    parser = argparse.ArgumentParser(description="Exporta datos de mercados globales")
+    datasets = [name for name in app.EXPORT_DATASETS if name not in app.EXPORT_IN_PROCESS_DATASETS]
+    parser.add_argument("dataset", choices=datasets, help="Datos a exportar")
+    parser.add_argument("--format", choices=list(app.EXPORT_FORMATS), default="csv", help="Formato de salida")
+    parser.add_argument("--output", default="-", help="Fichero de salida ('-' para stdout)")
+    args = parser.parse_args()
+
+    # Este proceso obtiene su propio snapshot, solo si se va a exportar
+    snapshot = None
+    if args.dataset == "snapshot":
+        snapshot = app.get_market_snapshot(int(time.time() // app.SNAPSHOT_REFRESH_SECONDS))
+    chunks = app.iter_export_chunks(app.iter_dataset_frames(args.dataset, snapshot), args.format)
+
+    if args.output == "-":
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.output, "wb") as handle:
+            for chunk in chunks:
+                handle.write(chunk)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
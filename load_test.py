@@ -0,0 +1,274 @@
+# ====================================================================
+# PRUEBA DE CARGA CON SESIONES CONCURRENTES
+# ====================================================================
+# Simula N sesiones simultáneas del dashboard con Streamlit AppTest y un
+# servidor local que imita el endpoint chart de Yahoo Finance. Cada sesión
+# hace varias vistas de página mezclando clics en "Actualizar Datos",
+# cambios de filtro y de sección, y al final se informa de:
+#   - latencia de cada rerun (p50 / p95 / p99, total y por acción)
+#   - espera en cola de cada rerun
+#   - CPU y memoria por sesión
+#   - peticiones al proveedor por vista de página (amplificación)
+#   - bytes enviados por el stub (gzip) y respuestas 304 (ETag)
+#
+# AppTest instala un Runtime simulado global durante cada ejecución, así
+# que los reruns de las distintas sesiones se serializan con un lock. Las
+# sesiones siguen intercalándose en el mismo proceso y comparten caches
+# como en un servidor real, que es lo que determina la amplificación.
+#
+# Uso:
+#   python load_test.py --sessions 20 --views 10 --refresh-ratio 0.1
+#   python load_test.py --static-quotes   # mercados cerrados: respuestas sin cambios
+# ====================================================================
+
+import argparse
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+class YahooStubHandler(BaseHTTPRequestHandler):
+    """
+    Responde /v8/finance/chart/<símbolo> con una serie intradía sintética
+
+    Comprime con gzip si el cliente lo acepta y da un ETag del contenido
+    (304 si coincide con If-None-Match). Con static el momento de las
+    cotizaciones queda fijo, como con los mercados cerrados.
+    """
+
+    requests_served = 0
+    bytes_sent = 0
+    not_modified = 0
+    latency = 0.0
+    static = False
+    started = int(time.time())
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with YahooStubHandler.lock:
+            YahooStubHandler.requests_served += 1
+
+        path = urlparse(self.path).path
+        if not path.startswith("/v8/finance/chart/"):
+            self.send_error(404)
+            return
+
+        symbol = unquote(path.rsplit("/", 1)[-1])
+        time.sleep(YahooStubHandler.latency)
+
+        rng = random.Random(symbol)
+        base = rng.uniform(1000, 50000)
+        now = YahooStubHandler.started if YahooStubHandler.static else int(time.time())
+        closes = [round(base * (1 + rng.gauss(0, 0.002) * i ** 0.5), 2) for i in range(390)]
+        body = json.dumps({
+            "chart": {"result": [{
+                "meta": {
+                    "regularMarketPrice": closes[-1],
+                    "previousClose": closes[0],
+                    "regularMarketVolume": rng.randint(10**6, 10**9),
+                    "regularMarketTime": now
+                },
+                "timestamp": [now - 60 * (389 - i) for i in range(390)],
+                "indicators": {"quote": [{"close": closes}]}
+            }]}
+        }).encode()
+
+        etag = f'"{zlib.crc32(body):08x}"'
+        if self.headers.get("If-None-Match") == etag:
+            with YahooStubHandler.lock:
+                YahooStubHandler.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with YahooStubHandler.lock:
+            YahooStubHandler.bytes_sent += len(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_stub(latency: float, static: bool = False) -> ThreadingHTTPServer:
+    """
+    Arranca el servidor stub en un puerto libre de localhost
+    """
+    YahooStubHandler.latency = latency
+    YahooStubHandler.static = static
+    server = ThreadingHTTPServer(("127.0.0.1", 0), YahooStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def peak_rss_kb() -> float:
+    """
+    Pico de memoria residente del proceso en KB (0 si no está disponible)
+    """
+    if resource is None:
+        return 0.0
+    return float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+# Los reruns de AppTest no pueden solaparse (ver cabecera)
+RUN_LOCK = threading.Lock()
+
+def run_session(session_id: int, views: int, refresh_ratio: float, seed: int,
+                timeout: float, results: list, lock: threading.Lock) -> None:
+    """
+    Ejecuta una sesión simulada y anota la latencia de cada rerun
+    """
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed + session_id)
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def timed(action: str, step) -> None:
+        queued = time.perf_counter()
+        with RUN_LOCK:
+            started = time.perf_counter()
+            try:
+                step()
+                failed = bool(at.exception) or any("Error ejecutando" in e.value for e in at.error)
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - started
+        with lock:
+            results.append({
+                "session": session_id,
+                "action": action,
+                "seconds": elapsed,
+                "wait": started - queued,
+                "failed": failed
+            })
+
+    timed("load", at.run)
+    for _ in range(views - 1):
+        if rng.random() < refresh_ratio:
+            buttons = [b for b in at.sidebar.button if "Actualizar" in b.label]
+            if buttons:
+                timed("refresh", lambda: buttons[0].click().run())
+                continue
+        sections = [r for r in at.radio if r.key == "dashboard_section"]
+        if sections and rng.random() < 0.5:
+            section = sections[0]
+            option = rng.choice(section.options)
+            timed("section", lambda: section.set_value(option).run())
+            continue
+        selectboxes = [s for s in at.sidebar.selectbox if s.label in ("Continente:", "Rendimiento:")]
+        if not selectboxes:
+            timed("load", at.run)
+            continue
+        selectbox = rng.choice(selectboxes)
+        option = rng.choice(selectbox.options)
+        timed("filter", lambda: selectbox.select(option).run())
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    return {f"p{q}": float(np.percentile(values, q)) for q in (50, 95, 99)}
+
+def main() -> int:
+    """
+    Punto de entrada de la prueba de carga
+    """
+    parser = argparse.ArgumentParser(description="Prueba de carga del dashboard con sesiones concurrentes")
+    parser.add_argument("--sessions", type=int, default=10, help="Sesiones simultáneas")
+    parser.add_argument("--views", type=int, default=10, help="Vistas de página por sesión")
+    parser.add_argument("--refresh-ratio", type=float, default=0.1, help="Proporción de clics en 'Actualizar Datos'")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="Latencia del stub en segundos")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout de cada rerun en segundos")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla de las acciones aleatorias")
+    parser.add_argument("--static-quotes", action="store_true", help="Cotizaciones fijas (mercados cerrados)")
+    parser.add_argument("--json", action="store_true", help="Imprimir el informe en JSON")
+    args = parser.parse_args()
+
+    server = start_stub(args.stub_latency, args.static_quotes)
+    os.environ["MARKET_DATA_PROVIDER"] = "yahoo"
+    os.environ["YAHOO_HOSTS"] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    results, lock = [], threading.Lock()
+    rss_before = peak_rss_kb()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+
+    threads = [
+        threading.Thread(
+            target=run_session,
+            args=(i, args.views, args.refresh_ratio, args.seed, args.timeout, results, lock)
+        )
+        for i in range(args.sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_before
+    rss_growth = max(peak_rss_kb() - rss_before, 0)
+    server.shutdown()
+
+    page_views = len(results)
+    report = {
+        "sessions": args.sessions,
+        "page_views": page_views,
+        "failed_views": sum(1 for r in results if r["failed"]),
+        "wall_seconds": wall,
+        "latency": percentiles([r["seconds"] for r in results]),
+        "queue_wait": percentiles([r["wait"] for r in results]),
+        "latency_by_action": {
+            action: dict(count=len(values), **percentiles(values))
+            for action in ("load", "filter", "section", "refresh")
+            for values in [[r["seconds"] for r in results if r["action"] == action]]
+        },
+        "cpu_seconds_per_session": cpu / args.sessions,
+        "cpu_ms_per_view": cpu / page_views * 1000 if page_views else None,
+        "peak_rss_growth_kb_per_session": rss_growth / args.sessions,
+        "upstream_requests": YahooStubHandler.requests_served,
+        "upstream_requests_per_view": YahooStubHandler.requests_served / page_views if page_views else None,
+        "upstream_bytes": YahooStubHandler.bytes_sent,
+        "upstream_not_modified": YahooStubHandler.not_modified
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    print(f"👥 {report['sessions']} sesiones • {page_views} vistas ({report['failed_views']} fallidas) en {wall:.1f} s")
+    print("⏱️ Latencia de rerun: " + " • ".join(
+        f"{k} {v * 1000:,.0f} ms" for k, v in report["latency"].items() if v is not None
+    ))
+    print("⏳ Espera en cola: " + " • ".join(
+        f"{k} {v * 1000:,.0f} ms" for k, v in report["queue_wait"].items() if v is not None
+    ))
+    for action, stats in report["latency_by_action"].items():
+        if stats["count"]:
+            print(f"   {action:8} n={stats['count']:4} p50 {stats['p50'] * 1000:,.0f} ms • p95 {stats['p95'] * 1000:,.0f} ms")
+    print(f"🖥️ CPU: {report['cpu_seconds_per_session']:.2f} s/sesión • {report['cpu_ms_per_view']:,.0f} ms/vista")
+    print(f"🧠 Memoria: +{report['peak_rss_growth_kb_per_session']:,.0f} KB pico por sesión")
+    print(f"📡 Proveedor: {report['upstream_requests']} peticiones • {report['upstream_requests_per_view']:.2f} por vista")
+    print(f"📦 Transferido: {report['upstream_bytes'] / 1024:,.1f} KB • {report['upstream_not_modified']} respuestas 304")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())